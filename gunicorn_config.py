@@ -0,0 +1,45 @@
+import glob
+import os
+import sys
+
+
+def _metrics_dir():
+    from decouple import config
+    return config('METRICS_MULTIPROC_DIR', default='')
+
+
+def on_starting(server):
+    # drops the metrics written by the workers of a previous run
+    path = _metrics_dir()
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in glob.glob(os.path.join(path, '*.db')):
+            os.remove(name)
+
+
+def pre_fork(server, worker):
+    # closes the connections opened by the master (e.g. while preloading the
+    # app) so the workers don't inherit them
+    app = sys.modules.get('ssms.app')
+    if app:
+        app.engine.dispose()
+
+
+def post_fork(server, worker):
+    # each worker gets its own engine and connection pool
+    app = sys.modules.get('ssms.app')
+    if app:
+        app.reset_engine()
+
+    # and its own sampling profiler, the thread of the master isn't copied
+    sampler = sys.modules.get('ssms.util.sampler')
+    if sampler:
+        sampler.start()
+
+
+def child_exit(server, worker):
+    # the live gauges of the worker (e.g. the cache entries) are dropped
+    path = _metrics_dir()
+    if path:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid, path)
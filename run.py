@@ -11,12 +11,14 @@ args = parser.parse_args()
 env_path = args.env
 
 gunicorn_virtual_env = os.path.join(env_path, 'bin/gunicorn')
+gunicorn_config_path = os.path.join(root, 'gunicorn_config.py')
 
 
 def main():
     try:
         print('Starting server with: {}'.format(gunicorn_virtual_env))
-        p = subprocess.Popen((gunicorn_virtual_env, '--reload', 'ssms.app:create_app()'))
+        p = subprocess.Popen((gunicorn_virtual_env, '--reload', '-c', gunicorn_config_path,
+                              'ssms.app:create_app()'))
         p.wait()
     except KeyboardInterrupt:
         try:
@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import timeit
+
+parser = argparse.ArgumentParser("Compare the SQL and NumPy ingredients reports of a batch of orders")
+parser.add_argument('-o', '--orders', metavar='orders', type=int, default=2000)
+parser.add_argument('-p', '--products', metavar='products', type=int, default=200)
+parser.add_argument('-i', '--ingredients', metavar='ingredients', type=int, default=500)
+parser.add_argument('-l', '--lines', metavar='lines', type=int, default=5, help="products per order and ingredients per product")
+parser.add_argument('-r', '--repeat', metavar='repeat', type=int, default=5)
+
+
+def populate(amount_of_orders, amount_of_products, amount_of_ingredients, lines):
+    from ssms.database import session
+    from ssms.models import Client, Ingredient, Order, OrderProduct, Product, ProductIngredient, UsersEnum
+
+    db_session = session()
+    client = Client(email='benchmark@ssms', first_name='benchmark', last_name='benchmark',
+                    user_type=UsersEnum.client)
+    client.set_password('benchmark')
+    client.save()
+
+    ingredients = [Ingredient(name=f'ingredient {idx}', unit='g') for idx in range(amount_of_ingredients)]
+    db_session.add_all(ingredients)
+    db_session.flush()
+
+    products = [
+        Product(name=f'product {idx}', value=1.0, discount=0.0, ingredients=[
+            ProductIngredient(ingredient_id=ingredient.id, amount=random.uniform(1, 100))
+            for ingredient in random.sample(ingredients, lines)
+        ])
+        for idx in range(amount_of_products)
+    ]
+    db_session.add_all(products)
+    db_session.flush()
+
+    orders = [
+        Order(client_id=client.id, products=[
+            OrderProduct(product_id=product.id, amount=random.randint(1, 10))
+            for product in random.sample(products, lines)
+        ])
+        for idx in range(amount_of_orders)
+    ]
+    db_session.add_all(orders)
+    db_session.commit()
+
+    return [order.id for order in orders]
+
+
+def main(amount_of_orders, amount_of_products, amount_of_ingredients, lines, repeat):
+    from ssms import database
+    from ssms.models import Order
+    from ssms.util import bom
+
+    orders_ids = populate(amount_of_orders, amount_of_products, amount_of_ingredients, lines)
+
+    print('=' * 80)
+    print(f"Ingredients report of {amount_of_orders} orders, {amount_of_products} products and "
+          f"{amount_of_ingredients} ingredients (best of {repeat})")
+    print('=' * 80)
+
+    expected = Order.report_ingredients(orders_ids)
+    actual = bom.engine.report_orders_ingredients(orders_ids)
+    if [ingredient.id for ingredient, total in expected] != [ingredient.id for ingredient, total in actual] or \
+            any(abs(x - y) > 1e-6 * max(1.0, abs(x)) for (_, x), (_, y) in zip(expected, actual)):
+        raise SystemExit("The NumPy report differs from the SQL one")
+
+    for name, report in (('sql', Order.report_ingredients), ('numpy', bom.engine.report_orders_ingredients)):
+        def run():
+            report(orders_ids)
+            database.remove()
+
+        elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+        print(f"{name:<10} {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    args = parser.parse_args()
+    main(args.orders, args.products, args.ingredients, args.lines, args.repeat)
@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import time
+
+parser = argparse.ArgumentParser("Compare the bulk endpoints with one POST per item")
+parser.add_argument('-n', '--items', metavar='items', type=int, default=1000)
+
+
+def main(amount_of_items):
+    from base64 import b64encode
+
+    from falcon import testing
+    from sqlalchemy import event
+
+    import ssms.app
+    from ssms.models import Admin
+
+    admin = Admin(email='benchmark@ssms', first_name='benchmark', last_name='benchmark')
+    admin.set_password('benchmark')
+    admin.save()
+
+    client = testing.TestClient(ssms.app.create_app())
+    headers = {'Authorization': 'Basic {}'.format(b64encode(b'benchmark@ssms:benchmark').decode())}
+
+    statements = []
+    event.listen(ssms.app.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    def items(prefix):
+        return [dict(name=f'{prefix} {idx}', unit='g') for idx in range(amount_of_items)]
+
+    print('=' * 80)
+    print(f"Creating {amount_of_items} ingredients")
+    print('=' * 80)
+
+    del statements[:]
+    start = time.perf_counter()
+    for item in items('single'):
+        client.simulate_post('/v1/ingredients', headers=headers, body=json.dumps(item))
+    elapsed = time.perf_counter() - start
+    print(f"{'one by one':<12} {amount_of_items / elapsed:10.0f} items/s  {len(statements)} statements")
+
+    del statements[:]
+    start = time.perf_counter()
+    response = client.simulate_post('/v1/ingredients/bulk', headers=headers, body=json.dumps(items('bulk')))
+    elapsed = time.perf_counter() - start
+    assert json.loads(response.content)['created'] == amount_of_items, response.content
+    print(f"{'bulk':<12} {amount_of_items / elapsed:10.0f} items/s  {len(statements)} statements")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    args = parser.parse_args()
+    main(args.items)
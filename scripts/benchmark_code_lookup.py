@@ -0,0 +1,73 @@
+import argparse
+import os
+import random
+import time
+
+parser = argparse.ArgumentParser("Time the lookups by code, with and without the code cache")
+parser.add_argument('-n', '--requests', metavar='requests', type=int, default=2000)
+parser.add_argument('-i', '--items', metavar='items', type=int, default=100, help="the hot codes looked up")
+
+
+def main(amount_of_requests, amount_of_items):
+    from base64 import b64encode
+
+    from falcon import testing
+
+    import ssms.app
+    from ssms import database
+    from ssms.models import Admin
+    from ssms.util import code_cache
+    from tests import util
+
+    admin = Admin(email='benchmark@ssms.com', first_name='benchmark', last_name='benchmark')
+    admin.set_password('benchmark')
+    admin.save()
+
+    orders = [util.create_random_order(amount_of_products=3) for idx in range(amount_of_items)]
+    codes = [order.code for order in orders]
+    ids = [order.id for order in orders]
+    # the requests get sessions of their own
+    database.remove()
+
+    # the time spent in the app, without the test client
+    app = ssms.app.create_app()
+    server_times = []
+
+    def timed_app(environ, start_response):
+        start = time.perf_counter()
+        result = app(environ, start_response)
+        server_times.append(time.perf_counter() - start)
+        return result
+
+    client = testing.TestClient(timed_app)
+    headers = {'Authorization': 'Basic {}'.format(b64encode(b'benchmark@ssms.com:benchmark').decode())}
+
+    print('=' * 80)
+    print(f"{amount_of_requests} lookups of {amount_of_items} orders, server time per request:")
+    print('=' * 80)
+
+    def run(name, path, keys):
+        del server_times[:]
+        for idx in range(amount_of_requests):
+            response = client.simulate_get(path.format(random.choice(keys)), headers=headers)
+            assert response.status.startswith('200'), response.content
+        server_times.sort()
+        print(f"{name:<24} median {server_times[len(server_times) // 2] * 1000:7.3f} ms  "
+              f"p99 {server_times[int(len(server_times) * 0.99)] * 1000:7.3f} ms")
+
+    run('by id', '/v1/orders/{}', ids)
+
+    cache = code_cache.caches['orders']
+    maxsize, cache.maxsize = cache.maxsize, 0
+    run('by code, no cache', '/v1/orders/code/{}', codes)
+
+    cache.maxsize = maxsize
+    run('by code, cached', '/v1/orders/code/{}', codes)
+    print(f"{'cache':<24} {cache.stats()}")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    os.environ.setdefault('ORDER_LINES_PRELOAD', 'False')
+    args = parser.parse_args()
+    main(args.requests, args.items)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser("Compare the orders export with the orders list endpoint")
+parser.add_argument('-o', '--orders', metavar='orders', type=int, default=100000)
+parser.add_argument('-l', '--lines', metavar='lines', type=int, default=4, help="products per order")
+parser.add_argument('-p', '--products', metavar='products', type=int, default=200)
+parser.add_argument('-c', '--clients', metavar='clients', type=int, default=1000)
+
+
+def populate(amount_of_orders, lines, amount_of_products, amount_of_clients):
+    from ssms.app import engine
+    from ssms.models import Order, OrderProduct, Product, User
+
+    start = datetime(2018, 1, 1)
+
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            dict(id=idx, email=f'client{idx}@ssms.com', first_name='client', last_name=str(idx), user_type='client',
+                 code=f'C{idx}')
+            for idx in range(1, amount_of_clients + 1)
+        ])
+        connection.execute(Product.__table__.insert(), [
+            dict(id=idx, name=f'product {idx}', value=random.uniform(1, 30), discount=0.0, code=f'P{idx}')
+            for idx in range(1, amount_of_products + 1)
+        ])
+        connection.execute(Order.__table__.insert(), [
+            dict(id=idx, client_id=random.randint(1, amount_of_clients), code=f'O{idx}',
+                 created=start + timedelta(seconds=random.randrange(365 * 86400)))
+            for idx in range(1, amount_of_orders + 1)
+        ])
+        connection.execute(OrderProduct.__table__.insert(), [
+            dict(order_id=order_id, product_id=product_id, amount=random.randint(1, 10))
+            for order_id in range(1, amount_of_orders + 1)
+            for product_id in random.sample(range(1, amount_of_products + 1), lines)
+        ])
+
+
+def main(amount_of_orders, lines, amount_of_products, amount_of_clients):
+    from base64 import b64encode
+
+    from falcon import testing
+
+    import ssms.app
+    from ssms.models import Admin
+    from ssms.util import export
+
+    populate(amount_of_orders, lines, amount_of_products, amount_of_clients)
+
+    admin = Admin(email='benchmark@ssms', first_name='benchmark', last_name='benchmark')
+    admin.set_password('benchmark')
+    admin.save()
+
+    client = testing.TestClient(ssms.app.create_app())
+    headers = {'Authorization': 'Basic {}'.format(b64encode(b'benchmark@ssms:benchmark').decode())}
+    amount_of_lines = amount_of_orders * lines
+
+    print('=' * 80)
+    print(f"Exporting {amount_of_orders} orders, {amount_of_lines} order lines")
+    print('=' * 80)
+
+    def time_get(name, path, query_string='', extra_headers=None):
+        start = time.perf_counter()
+        response = client.simulate_get(path, headers=dict(headers, **(extra_headers or {})),
+                                       query_string=query_string)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<24} {amount_of_lines / elapsed:10.0f} lines/s  {len(response.content) / 2 ** 20:8.1f} MB")
+
+    # the whole list, page by page
+    start = time.perf_counter()
+    size = 0
+    query_string = f'limit={ssms.app.MAX_PAGE_SIZE}'
+    while query_string:
+        response = client.simulate_get('/v1/orders', headers=headers, query_string=query_string)
+        size += len(response.content)
+        next_page = json.loads(response.content).get('next')
+        query_string = next_page and f'limit={ssms.app.MAX_PAGE_SIZE}&after={next_page}'
+    elapsed = time.perf_counter() - start
+    print(f"{'orders list, pages':<24} {amount_of_lines / elapsed:10.0f} lines/s  {size / 2 ** 20:8.1f} MB")
+
+    time_get('orders list, ndjson', '/v1/orders', 'stream=ndjson')
+    time_get('export, csv', '/v1/orders/export')
+    time_get('export, ndjson', '/v1/orders/export', 'format=ndjson')
+    time_get('export, csv gzip', '/v1/orders/export', extra_headers={'Accept-Encoding': 'gzip'})
+
+    # the memory held while the export is written, the chunks are dropped as they are read
+    tracemalloc.start()
+    size = sum(len(chunk) for chunk in export.export_orders('csv'))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{'export peak memory':<24} {peak / 2 ** 20:10.1f} MB for {size / 2 ** 20:.1f} MB written")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    os.environ.setdefault('ORDER_LINES_PRELOAD', 'False')
+    args = parser.parse_args()
+    main(args.orders, args.lines, args.products, args.clients)
@@ -0,0 +1,55 @@
+import argparse
+import random
+import timeit
+
+parser = argparse.ArgumentParser("Compare the friendly codes with the previous random prime encoder")
+parser.add_argument('-n', '--ids', metavar='ids', type=int, default=100000)
+parser.add_argument('-r', '--repeat', metavar='repeat', type=int, default=5)
+
+# the previous encoder: a random prime factor, then float math
+_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97]
+_SIZE = 100000000000000
+_OFFSET = _SIZE / 2 - 1
+_PERIOD = 10
+_VALID_CHARS = "3456789ACDEFGHJKLQRSTUVWXY"
+
+
+def previous_encode(num):
+    num *= random.choice(_PRIMES)
+    num = ((num + _OFFSET) * (_SIZE / _PERIOD)) % (_SIZE + 1) + 1
+
+    string = ""
+    while len(_VALID_CHARS) ** len(string) <= _SIZE:
+        string = _VALID_CHARS[int(num % len(_VALID_CHARS))] + string
+        num = num / len(_VALID_CHARS)
+    return string
+
+
+def main(amount_of_ids, repeat):
+    from ssms.util import friendly_code
+
+    ids = list(range(1, amount_of_ids + 1))
+    codes = friendly_code.encode_many(ids)
+
+    print('=' * 80)
+    print(f"Encoding {amount_of_ids} ids (best of {repeat})")
+    print('=' * 80)
+
+    cases = [
+        ('previous encode', lambda: [previous_encode(num) for num in ids]),
+        ('encode', lambda: [friendly_code.encode(num) for num in ids]),
+        ('encode_many', lambda: friendly_code.encode_many(ids)),
+        ('decode_many', lambda: friendly_code.decode_many(codes)),
+    ]
+    for name, run in cases:
+        elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+        print(f"{name:<16} {amount_of_ids / elapsed:12.0f} codes/s")
+
+    previous_codes = [previous_encode(num) for num in ids]
+    print(f"{'duplicated codes':<16} previous {len(ids) - len(set(previous_codes))}, "
+          f"now {len(ids) - len(set(codes))}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.ids, args.repeat)
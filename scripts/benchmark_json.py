@@ -0,0 +1,48 @@
+import argparse
+import os
+import timeit
+
+parser = argparse.ArgumentParser("Compare the installed JSON backends on order payloads")
+parser.add_argument('-o', '--orders', metavar='orders', type=int, default=500)
+parser.add_argument('-p', '--products', metavar='products', type=int, default=4)
+parser.add_argument('-i', '--ingredients', metavar='ingredients', type=int, default=8)
+parser.add_argument('-r', '--repeat', metavar='repeat', type=int, default=5)
+
+
+def main(amount_of_orders, amount_of_products, amount_of_ingredients, repeat):
+    from scripts.benchmark_serializers import build_orders
+    from ssms.resources.orders import ORDER_SERIALIZER
+    from ssms.util import codec
+    from ssms.util.response import format_response
+
+    orders = build_orders(amount_of_orders, amount_of_products, amount_of_ingredients)
+    payload = format_response(
+        ORDER_SERIALIZER.dump(orders, many=True, context=dict(remove_fields=['seed', 'password'])))
+
+    backends = codec.available_backends()
+
+    print('=' * 80)
+    print(f"Encoding and decoding {amount_of_orders} orders with {', '.join(backends)} (best of {repeat})")
+    print('=' * 80)
+
+    expected = None
+    for name in backends:
+        dumps, loads = codec.get_codec(name)
+
+        body = dumps(payload)
+        if expected is None:
+            expected = loads(body)
+        elif loads(body) != expected:
+            raise SystemExit(f"The {name} backend output differs from the {backends[0]} one")
+
+        dumps_time = min(timeit.repeat(lambda: dumps(payload), number=1, repeat=repeat))
+        loads_time = min(timeit.repeat(lambda: loads(body), number=1, repeat=repeat))
+
+        print(f"{name:<10} dumps: {dumps_time * 1000:8.1f} ms  loads: {loads_time * 1000:8.1f} ms  "
+              f"size: {len(body)} bytes")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    args = parser.parse_args()
+    main(args.orders, args.products, args.ingredients, args.repeat)
@@ -0,0 +1,70 @@
+import argparse
+import os
+import random
+import timeit
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser("Time the timeseries reports of the order lines store")
+parser.add_argument('-o', '--orders', metavar='orders', type=int, default=250000)
+parser.add_argument('-l', '--lines', metavar='lines', type=int, default=4, help="products per order")
+parser.add_argument('-p', '--products', metavar='products', type=int, default=200)
+parser.add_argument('-d', '--days', metavar='days', type=int, default=365, help="days the orders are spread over")
+parser.add_argument('-r', '--repeat', metavar='repeat', type=int, default=5)
+
+
+def populate(amount_of_orders, lines, amount_of_products, days):
+    from ssms.app import engine
+    from ssms.models import Order, OrderProduct, Product
+
+    start = datetime(2018, 1, 1)
+
+    with engine.begin() as connection:
+        connection.execute(Product.__table__.insert(), [
+            dict(id=idx, name=f'product {idx}', value=random.uniform(1, 30), discount=0.0)
+            for idx in range(1, amount_of_products + 1)
+        ])
+        connection.execute(Order.__table__.insert(), [
+            dict(id=idx, created=start + timedelta(seconds=random.randrange(days * 86400)))
+            for idx in range(1, amount_of_orders + 1)
+        ])
+        connection.execute(OrderProduct.__table__.insert(), [
+            dict(order_id=order_id, product_id=product_id, amount=random.randint(1, 10))
+            for order_id in range(1, amount_of_orders + 1)
+            for product_id in random.sample(range(1, amount_of_products + 1), lines)
+        ])
+
+
+def main(amount_of_orders, lines, amount_of_products, days, repeat):
+    from ssms import database
+    from ssms.util import order_lines
+
+    populate(amount_of_orders, lines, amount_of_products, days)
+
+    load_time = timeit.timeit(order_lines.store.load, number=1)
+
+    print('=' * 80)
+    print(f"{len(order_lines.store.get_lines())} order lines over {days} days, loaded in {load_time:.1f} s "
+          f"(best of {repeat})")
+    print('=' * 80)
+
+    reports = [
+        ('hours', lambda: order_lines.store.timeseries('hour')),
+        ('days', lambda: order_lines.store.timeseries('day')),
+        ('weeks', lambda: order_lines.store.timeseries('week')),
+        ('products/weeks', lambda: order_lines.store.timeseries_products('week')),
+        ('slots/hour', lambda: order_lines.store.busiest_slots('hour')),
+        ('days, 1 month', lambda: order_lines.store.timeseries('day', datetime(2018, 3, 1), datetime(2018, 4, 1))),
+    ]
+    for name, report in reports:
+        def run():
+            report()
+            database.remove()
+
+        elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+        print(f"{name:<16} {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    args = parser.parse_args()
+    main(args.orders, args.lines, args.products, args.days, args.repeat)
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import time
+
+parser = argparse.ArgumentParser("Count the statements and commits of the POST and PUT of each resource")
+parser.add_argument('-n', '--requests', metavar='requests', type=int, default=200)
+
+
+def main(amount_of_requests):
+    from base64 import b64encode
+
+    from falcon import testing
+    from sqlalchemy import event
+
+    import ssms.app
+    from ssms.models import Admin
+
+    admin = Admin(email='benchmark@ssms.com', first_name='benchmark', last_name='benchmark')
+    admin.set_password('benchmark')
+    admin.save()
+
+    client = testing.TestClient(ssms.app.create_app())
+    headers = {'Authorization': 'Basic {}'.format(b64encode(b'benchmark@ssms.com:benchmark').decode())}
+
+    # the commits of the transactions which wrote something, the read only ones cost no fsync
+    statements, commits, pending = [], [], []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+        if not statement.lstrip().upper().startswith('SELECT'):
+            pending.append(statement)
+
+    def commit(conn):
+        if pending:
+            commits.append(len(pending))
+            del pending[:]
+
+    event.listen(ssms.app.engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(ssms.app.engine, 'commit', commit)
+
+    def post(path, data):
+        return json.loads(client.simulate_post(path, headers=headers, body=json.dumps(data)).content)['data']
+
+    ingredient = post('/v1/ingredients', dict(name='ingredient', unit='g'))
+    product = post('/v1/products', dict(name='product', value=10, ingredients=[
+        dict(ingredient_id=ingredient['id'], amount=1)]))
+    user = post('/v1/clients', dict(email='client@ssms.com', password='client', first_name='client',
+                                    last_name='client'))
+
+    cases = [
+        ('POST /v1/ingredients', 'post', lambda idx: '/v1/ingredients', lambda idx: dict(name=f'i{idx}', unit='g')),
+        ('PUT /v1/ingredients', 'put', lambda idx: f"/v1/ingredients/{ingredient['id']}",
+         lambda idx: dict(name=f'i{idx}')),
+        ('POST /v1/products', 'post', lambda idx: '/v1/products', lambda idx: dict(
+            name=f'p{idx}', value=1, ingredients=[dict(ingredient_id=ingredient['id'], amount=1)])),
+        ('PUT /v1/products', 'put', lambda idx: f"/v1/products/{product['id']}", lambda idx: dict(value=idx + 1)),
+        ('POST /v1/clients', 'post', lambda idx: '/v1/clients', lambda idx: dict(
+            email=f'c{idx}@ssms.com', password='c', first_name='c', last_name='c')),
+        ('PUT /v1/clients', 'put', lambda idx: f"/v1/clients/{user['id']}", lambda idx: dict(first_name=f'c{idx}')),
+        ('POST /v1/orders', 'post', lambda idx: '/v1/orders', lambda idx: dict(
+            client_id=user['id'], products=[dict(product_id=product['id'], amount=idx + 1)])),
+    ]
+
+    print('=' * 80)
+    print(f"{amount_of_requests} requests per resource, per request:")
+    print('=' * 80)
+
+    for name, method, path, data in cases:
+        del statements[:], commits[:]
+        simulate = client.simulate_post if method == 'post' else client.simulate_put
+        start = time.perf_counter()
+        for idx in range(amount_of_requests):
+            response = simulate(path(idx), headers=headers, body=json.dumps(data(idx)))
+            assert response.status.startswith('200'), response.content
+        elapsed = time.perf_counter() - start
+
+        writes = [statement for statement in statements if not statement.lstrip().upper().startswith('SELECT')]
+        print(f"{name:<22} {len(statements) / amount_of_requests:5.1f} statements "
+              f"({len(writes) / amount_of_requests:4.1f} writes)  {len(commits) / amount_of_requests:4.1f} commits "
+              f"{elapsed / amount_of_requests * 1000:7.2f} ms")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    os.environ.setdefault('ORDER_LINES_PRELOAD', 'False')
+    os.environ.setdefault('AUTH_CACHE_SIZE', '1024')
+    args = parser.parse_args()
+    main(args.requests)
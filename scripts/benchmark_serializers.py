@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import timeit
+from datetime import datetime
+
+parser = argparse.ArgumentParser("Compare the marshmallow and the compiled order serializers")
+parser.add_argument('-o', '--orders', metavar='orders', type=int, default=500)
+parser.add_argument('-p', '--products', metavar='products', type=int, default=4)
+parser.add_argument('-i', '--ingredients', metavar='ingredients', type=int, default=8)
+parser.add_argument('-r', '--repeat', metavar='repeat', type=int, default=5)
+
+
+def build_orders(amount_of_orders, amount_of_products, amount_of_ingredients):
+    """Builds transient order graphs, nothing is written to the database."""
+    from ssms.models import Client, Ingredient, Order, OrderProduct, Product, ProductIngredient
+
+    now = datetime.utcnow()
+    timestamps = dict(created=now, updated=now)
+
+    ingredients = [
+        Ingredient(id=idx, name='ingredient {}'.format(idx), unit='g', code='I{}'.format(idx), **timestamps)
+        for idx in range(amount_of_ingredients)
+    ]
+    products = [
+        Product(id=idx, name='product {}'.format(idx), value=10.0 + idx, discount=0.0, code='P{}'.format(idx),
+                ingredients=[
+                    ProductIngredient(ingredient=ingredient, ingredient_id=ingredient.id, amount=10.0, **timestamps)
+                    for ingredient in ingredients
+                ], **timestamps)
+        for idx in range(amount_of_products)
+    ]
+    client = Client(id=1, email='client@client.com', first_name='client', last_name='client',
+                    password='password', seed='seed', code='C1', **timestamps)
+
+    return [
+        Order(id=idx, code='O{}'.format(idx), client=client, client_id=client.id,
+              products=[
+                  OrderProduct(product=product, product_id=product.id, amount=2, **timestamps)
+                  for product in products
+              ], **timestamps)
+        for idx in range(amount_of_orders)
+    ]
+
+
+def main(amount_of_orders, amount_of_products, amount_of_ingredients, repeat):
+    from ssms.resources.orders import ORDER_SERIALIZER
+    from ssms.schemas import OrderSchema
+
+    orders = build_orders(amount_of_orders, amount_of_products, amount_of_ingredients)
+
+    def marshmallow_dump():
+        return OrderSchema(context=dict(remove_fields=['seed', 'password'])).dump(orders, many=True).data
+
+    def compiled_dump():
+        return ORDER_SERIALIZER.dump(orders, many=True, context=dict(remove_fields=['seed', 'password']))
+
+    if json.dumps(marshmallow_dump()) != json.dumps(compiled_dump()):
+        raise SystemExit('The compiled serializer output differs from the marshmallow one')
+
+    print('=' * 80)
+    print(f"Dumping {amount_of_orders} orders, {amount_of_products} products with "
+          f"{amount_of_ingredients} ingredients each (best of {repeat})")
+    print('=' * 80)
+
+    marshmallow_time = min(timeit.repeat(marshmallow_dump, number=1, repeat=repeat))
+    compiled_time = min(timeit.repeat(compiled_dump, number=1, repeat=repeat))
+
+    print(f"marshmallow: {marshmallow_time * 1000:.1f} ms")
+    print(f"compiled:    {compiled_time * 1000:.1f} ms ({marshmallow_time / compiled_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    args = parser.parse_args()
+    main(args.orders, args.products, args.ingredients, args.repeat)
@@ -0,0 +1,47 @@
+import argparse
+
+parser = argparse.ArgumentParser("Create the indexes missing from the existing tables")
+
+
+def create_indexes(engine):
+    """Creates the indexes of the models missing from the database, `create_all`
+    only creates the indexes of the tables it creates.
+
+    Returns:
+        The names of the created indexes.
+    """
+    from sqlalchemy import inspect
+
+    from ssms.models import BaseModel
+
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    created = []
+    for table in BaseModel.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+
+    return created
+
+
+def main():
+    from ssms.app import engine
+
+    print('=' * 80)
+    print("Creating the missing indexes")
+    print('=' * 80)
+
+    for name in create_indexes(engine):
+        print(f"{name} created")
+
+
+if __name__ == '__main__':
+    parser.parse_args()
+    main()
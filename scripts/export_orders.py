@@ -0,0 +1,43 @@
+import argparse
+import sys
+from datetime import datetime
+
+
+def _datetime(value):
+    for datetime_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"{value!r} is not an ISO 8601 date or datetime")
+
+
+parser = argparse.ArgumentParser("Export the order lines to a CSV or NDJSON file")
+parser.add_argument('path', nargs='?', default='-', help="the output file, the standard output by default")
+parser.add_argument('-f', '--format', metavar='format', choices=('csv', 'ndjson'), default='csv')
+parser.add_argument('-z', '--gzip', action='store_true', help="gzip compress the export")
+parser.add_argument('--from', dest='start', metavar='from', type=_datetime, default=None,
+                    help="the first creation datetime, included")
+parser.add_argument('--to', dest='end', metavar='to', type=_datetime, default=None,
+                    help="the last creation datetime, excluded")
+parser.add_argument('--client-id', dest='clients_ids', metavar='client_id', type=int, action='append',
+                    default=None)
+
+
+def main(path, stream_format, compress, start, end, clients_ids):
+    from ssms.util import export
+
+    chunks = export.export_orders(stream_format, compress, start=start, end=end, clients_ids=clients_ids)
+
+    output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.path, args.format, args.gzip, args.start, args.end, args.clients_ids)
@@ -0,0 +1,37 @@
+import argparse
+import os
+
+parser = argparse.ArgumentParser("Import ingredients or products from a CSV or NDJSON file")
+parser.add_argument('resource', choices=('ingredients', 'products'))
+parser.add_argument('path', help="the file to import, its extension gives the format unless --format is set")
+parser.add_argument('-f', '--format', metavar='format', choices=('csv', 'ndjson'), default=None)
+parser.add_argument('-c', '--chunk-size', metavar='chunk_size', type=int, default=None,
+                    help="the rows written per transaction, IMPORT_CHUNK_SIZE by default")
+
+
+def main(resource, path, stream_format, chunk_size):
+    from ssms.util import codec, importer
+
+    stream_format = stream_format or os.path.splitext(path)[1].lstrip('.').lower()
+    if stream_format not in importer.FORMATS:
+        raise SystemExit(f"Unknown format {stream_format!r}, use --format")
+
+    print('=' * 80)
+    print(f"Importing the {resource} of {path}")
+    print('=' * 80)
+
+    def progress(job):
+        print(f"{job.processed} rows processed, {job.inserted} inserted, {job.rejected} rejected")
+
+    job = importer.create_job(resource, stream_format)
+    with open(path, 'rb') as stream:
+        importer.run(job, stream, chunk_size=chunk_size, progress=progress)
+
+    print(f"Import {job.id} {job.status}")
+    for error in codec.loads(job.errors or '[]'):
+        print(f"row {error['row']}: {error['errors']}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.resource, args.path, args.format, args.chunk_size)
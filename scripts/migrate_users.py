@@ -0,0 +1,117 @@
+import argparse
+
+parser = argparse.ArgumentParser("Move the admins and the clients into the single user table")
+parser.add_argument('-k', '--keep-tables', action='store_true', help="don't drop the admin and client tables")
+
+LEGACY_TABLES = ('admin', 'client')
+
+
+def migrate(engine, drop_tables=True):
+    """Copies the rows of the legacy admin and client tables into the user table.
+
+    The clients keep their ids, since the orders reference them. The admins
+    keep theirs unless a client already uses it (the legacy tables had their
+    own ids on SQLite), then they get a new id and, if needed, a new code. The
+    orders foreign key is moved to the user table where the database supports
+    it, SQLite doesn't enforce it anyway.
+
+    It all runs in one transaction, nothing is written if an email is used by
+    more than one user.
+
+    Returns:
+        The number of migrated users.
+    """
+    from sqlalchemy import MetaData, func, select
+    from sqlalchemy.schema import AddConstraint, DropConstraint
+
+    from ssms.models import Order, User, UsersEnum
+    from ssms.util import friendly_code
+
+    with engine.begin() as connection:
+        legacy_tables = [name for name in LEGACY_TABLES if engine.dialect.has_table(connection, name)]
+        if not legacy_tables:
+            return 0
+
+        metadata = MetaData()
+        metadata.reflect(connection, only=legacy_tables + [Order.__tablename__])
+
+        users = User.__table__
+        columns = [column.name for column in users.columns]
+
+        used_ids, used_emails, used_codes = set(), set(), set()
+        for user_id, email, code in connection.execute(select([users.c.id, users.c.email, users.c.code])):
+            used_ids.add(user_id)
+            used_emails.add(email)
+            used_codes.add(code)
+
+        rows = []
+        duplicated_emails = set()
+        # the clients first, their ids must be kept
+        for table_name, user_type in (('client', UsersEnum.client), ('admin', UsersEnum.admin)):
+            if table_name not in metadata.tables:
+                continue
+
+            table = metadata.tables[table_name]
+            for legacy_row in connection.execute(table.select().order_by(table.c.id)):
+                row = {column: legacy_row[column] for column in columns if column in legacy_row.keys()}
+                row['user_type'] = user_type
+
+                if row['email'] in used_emails:
+                    duplicated_emails.add(row['email'])
+                used_emails.add(row['email'])
+
+                if row['id'] in used_ids:
+                    if user_type == UsersEnum.client:
+                        raise ValueError('The user id {} is already taken by another user'.format(row['id']))
+                    row['id'] = max(used_ids) + 1
+                used_ids.add(row['id'])
+
+                if not row['code'] or row['code'] in used_codes:
+                    # the codes are derived from the ids, there is no other one to try
+                    row['code'] = friendly_code.encode(row['id'])
+                    if not row['code'] or row['code'] in used_codes:
+                        raise ValueError('No unique code can be assigned to the user id {}'.format(row['id']))
+                used_codes.add(row['code'])
+
+                rows.append(row)
+
+        if duplicated_emails:
+            raise ValueError('The emails {} are used by more than one user'.format(', '.join(sorted(duplicated_emails))))
+
+        if rows:
+            connection.execute(users.insert(), rows)
+
+        if engine.dialect.name != 'sqlite':
+            orders = metadata.tables[Order.__tablename__]
+            for constraint in list(orders.foreign_key_constraints):
+                if constraint.referred_table.name == 'client':
+                    connection.execute(DropConstraint(constraint))
+                    for new_constraint in Order.__table__.foreign_key_constraints:
+                        if new_constraint.referred_table is users:
+                            connection.execute(AddConstraint(new_constraint))
+
+        if engine.dialect.supports_sequences and used_ids:
+            connection.execute(select([func.setval('user_id_seq', max(used_ids))]))
+
+        if drop_tables:
+            for table_name in legacy_tables:
+                metadata.tables[table_name].drop(connection)
+
+        return len(rows)
+
+
+def main(keep_tables):
+    from ssms.app import engine
+
+    print('=' * 80)
+    print("Migrating the admin and client tables to the user table")
+    print('=' * 80)
+
+    count = migrate(engine, drop_tables=not keep_tables)
+
+    print(f"{count} users migrated")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.keep_tables)
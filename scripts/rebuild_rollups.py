@@ -0,0 +1,18 @@
+import argparse
+
+parser = argparse.ArgumentParser("Rebuild the materialised ingredients demand of the orders")
+
+
+def main():
+    from ssms.models import OrderIngredient
+
+    print('=' * 80)
+    print("Rebuilding the orders ingredients rollup")
+    print('=' * 80)
+
+    OrderIngredient.rebuild()
+
+
+if __name__ == '__main__':
+    parser.parse_args()
+    main()
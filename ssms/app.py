@@ -5,8 +5,11 @@ from falcon_cors import CORS
 from decouple import config
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool, StaticPool
 
+from ssms.util import codec
 from ssms.util.storage import SimpleBaseStore
 
 import logging
@@ -17,21 +20,138 @@ DEBUG = config('DEBUG', cast=bool, default=False)
 JWT_SECRET_KEY = config('JWT_SECRET_KEY', cast=str, default='I_LIKE_POTATOES')
 JWT_ALGORITHM = config('JWT_ALGORITHM', cast=str, default='HS256')
 
+# Auth Cache Config, the size 0 disables the cache
+AUTH_CACHE_SIZE = config('AUTH_CACHE_SIZE', cast=int, default=1024)
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', cast=int, default=60)
+
+# Report Cache Config, the size 0 disables the cache
+REPORT_CACHE_SIZE = config('REPORT_CACHE_SIZE', cast=int, default=256)
+REPORT_CACHE_TTL = config('REPORT_CACHE_TTL', cast=int, default=3600)
+
+# Code Cache Config, the items looked up by code, the size 0 disables the cache
+CODE_CACHE_SIZE = config('CODE_CACHE_SIZE', cast=int, default=4096)
+CODE_CACHE_TTL = config('CODE_CACHE_TTL', cast=int, default=30)
+
+# Report Config, sql|numpy (the numpy backend needs numpy installed)
+REPORT_BACKEND = config('REPORT_BACKEND', default='sql')
+
+# Timeseries Config, whether the order lines store is loaded when the app is created
+ORDER_LINES_PRELOAD = config('ORDER_LINES_PRELOAD', cast=bool, default=True)
+
+# Pagination Config
+PAGE_SIZE = config('PAGE_SIZE', cast=int, default=50)
+MAX_PAGE_SIZE = config('MAX_PAGE_SIZE', cast=int, default=500)
+
+# Bulk Config, the maximum number of items of a bulk request
+BULK_MAX_SIZE = config('BULK_MAX_SIZE', cast=int, default=1000)
+
+# Import Config, the rows written per transaction and the rejected rows whose errors are kept
+IMPORT_CHUNK_SIZE = config('IMPORT_CHUNK_SIZE', cast=int, default=500)
+IMPORT_MAX_ERRORS = config('IMPORT_MAX_ERRORS', cast=int, default=100)
+
+# Streaming Config
+STREAM_BATCH_SIZE = config('STREAM_BATCH_SIZE', cast=int, default=100)
+
+# Export Config, the rows fetched at a time by the orders exports
+EXPORT_BATCH_SIZE = config('EXPORT_BATCH_SIZE', cast=int, default=5000)
+
+# Metrics Config, the directory shared by the workers to aggregate their metrics, empty for a single process
+METRICS_MULTIPROC_DIR = config('METRICS_MULTIPROC_DIR', default='')
+
+# Query Budget Config, off|warn|raise, whether the requests over their query budget (or running the same
+# statement more than QUERY_REPEAT_LIMIT times) are logged or failed, QUERY_BUDGET is the default budget (0 for none)
+QUERY_BUDGET_MODE = config('QUERY_BUDGET_MODE', default='off')
+QUERY_BUDGET = config('QUERY_BUDGET', cast=int, default=0)
+QUERY_REPEAT_LIMIT = config('QUERY_REPEAT_LIMIT', cast=int, default=5)
+
+# Slow Query Config, the statements taking SLOW_QUERY_THRESHOLD milliseconds or more (0 disables it) are logged,
+# with their query plan, to the SLOW_QUERY_LOG file, rotated after SLOW_QUERY_LOG_MAX_BYTES
+SLOW_QUERY_THRESHOLD = config('SLOW_QUERY_THRESHOLD', cast=int, default=0)
+SLOW_QUERY_LOG = config('SLOW_QUERY_LOG', default='./slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = config('SLOW_QUERY_LOG_MAX_BYTES', cast=int, default=10 * 1024 * 1024)
+SLOW_QUERY_LOG_BACKUPS = config('SLOW_QUERY_LOG_BACKUPS', cast=int, default=5)
+
+# Profiling Config, whether the admins can profile a request with the X-SSMS-Profile header, the newest
+# PROFILE_MAX_FILES profiles are kept in PROFILE_STORAGE_PATH
+PROFILING = config('PROFILING', cast=bool, default=False)
+PROFILE_STORAGE_PATH = config('PROFILE_STORAGE_PATH', default='./profiles')
+PROFILE_MAX_FILES = config('PROFILE_MAX_FILES', cast=int, default=100)
+
+# Sampling Profiler Config, the stacks of the requests sampled per second by each worker (0 disables it) and the
+# maximum number of distinct stacks kept
+SAMPLING_RATE = config('SAMPLING_RATE', cast=int, default=10)
+SAMPLING_MAX_STACKS = config('SAMPLING_MAX_STACKS', cast=int, default=10000)
+
+# JSON Config, the fastest installed backend if not set
+JSON_BACKEND = config('JSON_BACKEND', default='')
+codec.use(JSON_BACKEND or None)
+
 # set the storege module
 storage_path = config('STORAGE_PATH', './images')
 storage = SimpleBaseStore(storage_path)
 
 # set the db connection
-engine = create_engine(config('DATABASE_URI', None), echo=False)
+DATABASE_URI = config('DATABASE_URI', None)
+
+_POOL_CLASSES = {
+    'queue': QueuePool,
+    'static': StaticPool,
+    'null': NullPool,
+    'singleton': SingletonThreadPool,
+}
+
+
+def engine_options(database_uri):
+    options = dict(
+        echo=False,
+        pool_recycle=config('DATABASE_POOL_RECYCLE', cast=int, default=-1),
+        pool_pre_ping=config('DATABASE_POOL_PRE_PING', cast=bool, default=False),
+    )
+
+    is_sqlite = make_url(database_uri).get_backend_name() == 'sqlite'
+
+    pool_class = config('DATABASE_POOL_CLASS', default='')
+    if pool_class:
+        options['poolclass'] = _POOL_CLASSES[pool_class.lower()]
+
+    # only the queue pool (the default one for server databases) is sized
+    if options.get('poolclass', None if is_sqlite else QueuePool) is QueuePool:
+        options['pool_size'] = config('DATABASE_POOL_SIZE', cast=int, default=5)
+        options['max_overflow'] = config('DATABASE_MAX_OVERFLOW', cast=int, default=10)
+
+    # a static pool shares its single connection between all the threads
+    if is_sqlite and options.get('poolclass') is StaticPool:
+        options['connect_args'] = dict(check_same_thread=False)
+
+    return options
+
+
+def create_db_engine():
+    return create_engine(DATABASE_URI, **engine_options(DATABASE_URI))
+
+
+engine = create_db_engine()
 Session = sessionmaker(bind=engine)
 
 
+def reset_engine():
+    """Binds the sessions to a brand new engine.
+
+    Meant to be called inside each forked worker, so no connection opened
+    by the parent process is shared with it.
+    """
+    global engine
+    engine.dispose()
+    engine = create_db_engine()
+    Session.configure(bind=engine)
+
+
 def route_version(version, route):
     return '/' + version + route
 
 
 def set_routes(api):
-    from ssms.resources import users, ingredients, products, orders, auth
+    from ssms.resources import users, ingredients, products, orders, auth, imports, metrics, profiles
 
     _versions = ['v1', ]
     api.add_route(route_version(_versions[0], '/users'), users.UsersListResource())
@@ -41,19 +161,50 @@ def set_routes(api):
 
     api.add_route(route_version(_versions[0], '/clients'), users.ClientListResource())
     api.add_route(route_version(_versions[0], '/clients/{client_id}'), users.ClientDetailResource())
+    client_codes = users.ClientCodeResource()
+    api.add_route(route_version(_versions[0], '/clients/code'), client_codes)
+    api.add_route(route_version(_versions[0], '/clients/code/{code}'), client_codes)
 
     api.add_route(route_version(_versions[0], '/ingredients'), ingredients.IngredientListResource())
+    api.add_route(route_version(_versions[0], '/ingredients/bulk'), ingredients.IngredientBulkResource())
+    api.add_route(route_version(_versions[0], '/ingredients/import'), imports.ImportResource('ingredients'))
     api.add_route(route_version(_versions[0], '/ingredients/{ingredient_id}'), ingredients.IngredientDetailResource())
+    ingredient_codes = ingredients.IngredientCodeResource()
+    api.add_route(route_version(_versions[0], '/ingredients/code'), ingredient_codes)
+    api.add_route(route_version(_versions[0], '/ingredients/code/{code}'), ingredient_codes)
 
     api.add_route(route_version(_versions[0], '/products'), products.ProductListResource())
+    api.add_route(route_version(_versions[0], '/products/bulk'), products.ProductBulkResource())
+    api.add_route(route_version(_versions[0], '/products/import'), imports.ImportResource('products'))
     api.add_route(route_version(_versions[0], '/products/{product_id}'), products.ProductDetailResource())
+    product_codes = products.ProductCodeResource()
+    api.add_route(route_version(_versions[0], '/products/code'), product_codes)
+    api.add_route(route_version(_versions[0], '/products/code/{code}'), product_codes)
     api.add_route(route_version(_versions[0], '/products/reports/ingredients'),
                   products.ProductIngredientsReportResource())
 
     api.add_route(route_version(_versions[0], '/orders'), orders.OrderListResource())
+    api.add_route(route_version(_versions[0], '/orders/bulk'), orders.OrderBulkResource())
+    api.add_route(route_version(_versions[0], '/orders/export'), orders.OrderExportResource())
     api.add_route(route_version(_versions[0], '/orders/{order_id}'), orders.OrderDetailResource())
+    order_codes = orders.OrderCodeResource()
+    api.add_route(route_version(_versions[0], '/orders/code'), order_codes)
+    api.add_route(route_version(_versions[0], '/orders/code/{code}'), order_codes)
+
     api.add_route(route_version(_versions[0], '/orders/reports/products'), orders.OrderProductsReportResource())
     api.add_route(route_version(_versions[0], '/orders/reports/ingredients'), orders.OrderIngredientsReportResource())
+    api.add_route(route_version(_versions[0], '/orders/reports/timeseries'), orders.OrderTimeseriesResource())
+    api.add_route(route_version(_versions[0], '/orders/reports/timeseries/products'),
+                  orders.OrderProductsTimeseriesResource())
+    api.add_route(route_version(_versions[0], '/orders/reports/timeseries/slots'), orders.OrderSlotsResource())
+
+    api.add_route(route_version(_versions[0], '/imports'), imports.ImportListResource())
+    api.add_route(route_version(_versions[0], '/imports/{import_id}'), imports.ImportDetailResource())
+
+    api.add_route(route_version(_versions[0], '/metrics'), metrics.MetricsResource())
+    api.add_route(route_version(_versions[0], '/profiles'), profiles.ProfileListResource())
+    api.add_route(route_version(_versions[0], '/profiles/samples'), profiles.ProfileSamplesResource())
+    api.add_route(route_version(_versions[0], '/profiles/{name}'), profiles.ProfileDetailResource())
 
 
 def configure_logging():
@@ -69,19 +220,37 @@ def configure_logging():
 
 
 def register_middleware():
-    from ssms.middleware import NonBlockingAuthentication, LoggerMiddleware
+    from ssms.middleware import (NonBlockingAuthentication, LoggerMiddleware, MetricsMiddleware, ProfilingMiddleware,
+                                 QueryBudgetMiddleware, SamplingMiddleware, SessionMiddleware)
 
     cors = CORS(allow_all_origins=True,
                 allow_all_headers=True,
                 allow_credentials_all_origins=True,
                 allow_all_methods=True)
 
-    return [
+    # the metrics middleware comes first, so its timing wraps all the others
+    middleware = [
+        MetricsMiddleware(),
         cors.middleware,
+        SessionMiddleware(),
         NonBlockingAuthentication(),
         LoggerMiddleware(logging.getLogger(__name__)),
     ]
 
+    # first, so the samples cover the whole request
+    if SAMPLING_RATE > 0:
+        middleware.insert(0, SamplingMiddleware())
+
+    # after the authentication, which tells whether the user may profile the request
+    if PROFILING:
+        middleware.append(ProfilingMiddleware())
+
+    # last, so a failed budget check rolls the request session back
+    if QUERY_BUDGET_MODE != 'off':
+        middleware.append(QueryBudgetMiddleware(QUERY_BUDGET_MODE))
+
+    return middleware
+
 
 def create_app():
     # create the app
@@ -92,6 +261,18 @@ def create_app():
 
     configure_logging()
 
+    if SLOW_QUERY_THRESHOLD:
+        from ssms.util import slow_queries
+        slow_queries.enable()
+
+    if SAMPLING_RATE > 0:
+        from ssms.util import sampler
+        sampler.start()
+
+    if ORDER_LINES_PRELOAD:
+        from ssms.util import order_lines
+        order_lines.store.load()
+
     return api
 
 
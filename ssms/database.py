@@ -1,10 +1,61 @@
+import threading
+
+from sqlalchemy.orm import scoped_session
+
 from ssms import app
 
-_session = None
+# holds the token of the request being processed by the current thread, while
+# no request is active the thread identity is used as the session scope
+_request_scope = threading.local()
+
+
+def _scopefunc():
+    token = getattr(_request_scope, 'token', None)
+    if token is None:
+        return threading.get_ident()
+    return token
+
+
+_sessions = scoped_session(app.Session, scopefunc=_scopefunc)
 
 
 def session():
-    global _session
-    if not _session:
-        _session = app.Session()
-    return _session
+    return _sessions()
+
+
+def remove():
+    """Closes the session of the current scope."""
+    _sessions.remove()
+
+
+def begin_request():
+    """Opens a new session scope for the request handled by this thread.
+
+    The session itself is only created when something calls `session()`. If
+    the thread already holds a session (a script or the test suite calling the
+    app in-process) the request joins it and leaves it open at the end.
+    """
+    if _sessions.registry.has():
+        _request_scope.token = None
+    else:
+        _request_scope.token = object()
+
+
+def end_request(commit=True):
+    """Commits (or rolls back) and closes the current request session."""
+    try:
+        if _sessions.registry.has():
+            _session = _sessions()
+            try:
+                if commit:
+                    _session.commit()
+                else:
+                    _session.rollback()
+            except Exception:
+                _session.rollback()
+                raise
+            finally:
+                if _request_scope.token is not None:
+                    _sessions.remove()
+    finally:
+        _request_scope.token = None
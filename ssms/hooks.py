@@ -1,6 +1,11 @@
 import falcon
 
-from ssms.models import UsersEnum, Admin, Client, User, Ingredient, Order, Product
+from datetime import datetime
+
+from ssms.app import BULK_MAX_SIZE, MAX_PAGE_SIZE, PAGE_SIZE
+from ssms.models import UsersEnum, Admin, Client, User, ImportJob, Ingredient, Order, Product
+from ssms.util import codec, cursor
+from ssms.util.response import STREAM_FORMATS
 
 
 def require_auth(req, resp, resource, params):
@@ -36,7 +41,7 @@ def get_client(req, resp, resource, params):
     if not client_id:
         raise falcon.HTTPError(falcon.HTTP_400)
 
-    client = Client.get_by_id(client_id)
+    client = Client.get_by_id(client_id, options=getattr(resource, 'eager_load', ()))
 
     if not client:
         raise falcon.HTTPError(falcon.HTTP_404)
@@ -49,7 +54,7 @@ def get_ingredient(req, resp, resource, params):
     if not ingredient_id:
         raise falcon.HTTPError(falcon.HTTP_400)
 
-    ingredient = Ingredient.get_by_id(ingredient_id)
+    ingredient = Ingredient.get_by_id(ingredient_id, options=getattr(resource, 'eager_load', ()))
 
     if not ingredient:
         raise falcon.HTTPError(falcon.HTTP_404)
@@ -62,7 +67,7 @@ def get_product(req, resp, resource, params):
     if not product_id:
         raise falcon.HTTPError(falcon.HTTP_400)
 
-    product = Product.get_by_id(product_id)
+    product = Product.get_by_id(product_id, options=getattr(resource, 'eager_load', ()))
 
     if not product:
         raise falcon.HTTPError(falcon.HTTP_404)
@@ -75,9 +80,123 @@ def get_order(req, resp, resource, params):
     if not order_id:
         raise falcon.HTTPError(falcon.HTTP_400)
 
-    order = Order.get_by_id(order_id)
+    order = Order.get_by_id(order_id, options=getattr(resource, 'eager_load', ()))
 
     if not order:
         raise falcon.HTTPError(falcon.HTTP_404)
 
     params['order'] = order
+
+
+def get_codes(req, resp, resource, params):
+    # the code of the route, or the codes param
+    if params.get('code'):
+        codes = [params['code']]
+    else:
+        codes = req.get_param_as_list('codes')
+
+    if not codes:
+        raise falcon.HTTPMissingParam('codes')
+
+    if len(codes) > MAX_PAGE_SIZE:
+        raise falcon.HTTPInvalidParam('At most {} codes can be sent at once'.format(MAX_PAGE_SIZE), 'codes')
+
+    params['codes'] = codes
+
+
+def get_import_job(req, resp, resource, params):
+    import_id = params.get('import_id', None)
+    if not import_id:
+        raise falcon.HTTPError(falcon.HTTP_400)
+
+    job = ImportJob.get_by_id(import_id)
+
+    if not job:
+        raise falcon.HTTPError(falcon.HTTP_404)
+
+    params['job'] = job
+
+
+def get_page(req, resp, resource, params):
+    """Reads the page params, the cursor must hold the sort key of the `model` of the resource."""
+    limit = req.get_param_as_int('limit', min=1, max=MAX_PAGE_SIZE)
+    after = req.get_param('after')
+
+    if after:
+        try:
+            after = cursor.decode(after, resource.model.get_cursor_types())
+        except ValueError:
+            raise falcon.HTTPInvalidParam('Invalid cursor', 'after')
+
+    params['page'] = dict(
+        limit=limit or PAGE_SIZE,
+        after=after,
+    )
+
+
+def get_stream_format(req, resp, resource, params):
+    stream_format = req.get_param('stream')
+
+    if stream_format and stream_format not in STREAM_FORMATS:
+        raise falcon.HTTPInvalidParam('Unknown stream format', 'stream')
+
+    params['stream_format'] = stream_format
+
+
+# the formats accepted by the from and to params
+_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+
+def _get_param_as_datetime(req, name):
+    value = req.get_param(name)
+    if not value:
+        return None
+
+    for datetime_format in _DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+
+    raise falcon.HTTPInvalidParam('Expected an ISO 8601 date or datetime', name)
+
+
+def get_time_range(req, resp, resource, params):
+    start = _get_param_as_datetime(req, 'from')
+    end = _get_param_as_datetime(req, 'to')
+
+    if start and end and start > end:
+        raise falcon.HTTPInvalidParam('The range must not end before it starts', 'to')
+
+    params['time_range'] = dict(
+        start=start,
+        end=end,
+    )
+
+
+def get_report_filters(req, resp, resource, params):
+    get_time_range(req, resp, resource, params)
+    time_range = params.pop('time_range')
+
+    params['filters'] = dict(
+        start=time_range['start'],
+        end=time_range['end'],
+        clients_ids=req.get_param_as_list('client_id', transform=int),
+        products_ids=req.get_param_as_list('product_id', transform=int),
+    )
+
+
+def get_bulk_items(req, resp, resource, params):
+    try:
+        items = codec.loads(req.stream.read(req.content_length or 0))
+    except ValueError:
+        raise falcon.HTTPBadRequest('Invalid JSON', 'The body must be a JSON list of items')
+
+    if not isinstance(items, list):
+        raise falcon.HTTPBadRequest('Invalid body', 'The body must be a JSON list of items')
+
+    if len(items) > BULK_MAX_SIZE:
+        raise falcon.HTTPError(falcon.HTTP_413, 'Too many items',
+                               'At most {} items can be sent at once'.format(BULK_MAX_SIZE))
+
+    params['items'] = items
@@ -1,17 +1,48 @@
 import falcon
 
 import base64
+import threading
+import time
+from logging import getLogger
 
 import jwt
 
-from ssms.models import User
+from ssms import database
+from ssms.models import DataVersion, User, UsersEnum
+from ssms.util import auth, metrics, profiling, query_budget, request_stats, sampler
+
+logger = getLogger(__name__)
 
 
 class NonBlockingAuthentication(object):
     @staticmethod
-    def process_token(token):
+    def get_user(email):
+        """Returns the user with the given email, from the auth cache if possible.
+
+        A cached user is only used while the `User` data version it was loaded
+        under is the current one. The version is shared by all the workers, so
+        a committed write to any user (e.g. a password change or a delete) is
+        seen by the next request of every worker, the cache is never staler
+        than the database. The check is a primary key read of the version
+        instead of the user query, the cached user is merged into the request
+        session without querying the database.
+        """
+        # read before the user, a write committed in between makes the copy stale on the next lookup
+        version, = DataVersion.get_versions([User])
+        cached = auth.get_cached_user(email, version)
+        if cached is not None:
+            return database.session().merge(cached, load=False)
+
+        user = User.get_by_email(email)
+        if user:
+            auth.cache_user(user, version)
+        return user
+
+    @classmethod
+    def process_token(cls, token):
         try:
-            user = User.get_by_token(token)
+            data = auth.decode_cached(token)
+            user = cls.get_user(data.get('email'))
         except jwt.ExpiredSignatureError:
             raise falcon.HTTPError(falcon.HTTP_401, title='Expired Token')
         except jwt.DecodeError:
@@ -24,11 +55,11 @@ class NonBlockingAuthentication(object):
             else:
                 raise falcon.HTTPError(falcon.HTTP_404)
 
-    @staticmethod
-    def process_basic(auth):
-        email, password = base64.b64decode(auth).decode().split(':')
+    @classmethod
+    def process_basic(cls, auth_string):
+        email, password = base64.b64decode(auth_string).decode().split(':')
 
-        user = User.get_by_email(email)
+        user = cls.get_user(email)
 
         if user:
             hashed_password, seed = User.hash_password(password, user.seed)
@@ -52,16 +83,17 @@ class NonBlockingAuthentication(object):
 
         raise falcon.HTTPError(falcon.HTTP_401)
 
-    def process_url_auth(self, auth):
-        if not auth:
+    def process_url_auth(self, query_string):
+        if not query_string:
             return None, None, None
 
-        try:
-            _type, _auth_string = auth.split('=', 1)
-        except ValueError:
-            raise falcon.HTTPError(falcon.HTTP_401)
-        else:
-            return self.process_sent_auth(_type, _auth_string)
+        # the raw values are used since a basic auth may contain '+' and '='
+        for field in query_string.split('&'):
+            _type, _, _auth_string = field.partition('=')
+            if _type.lower() in ('basic', 'token'):
+                return self.process_sent_auth(_type, _auth_string)
+
+        return None, None, None
 
     def process_auth(self, auth):
         if not auth:
@@ -104,9 +136,8 @@ class NonBlockingAuthentication(object):
                 that will be passed to the resource's responder
                 method as keyword arguments.
         """
-        if req.query_string:
-            user, token, auth_type = self.process_url_auth(req.query_string)
-        else:
+        user, token, auth_type = self.process_url_auth(req.query_string)
+        if not auth_type:
             user, token, auth_type = self.process_auth(req.auth)
         setattr(req, 'user', user)
         setattr(req, 'token', token)
@@ -127,6 +158,18 @@ class NonBlockingAuthentication(object):
         """
 
 
+class SessionMiddleware(object):
+    def process_request(self, req, resp, *args, **kwargs):
+        """Opens the request session scope, the session is created lazily."""
+        database.begin_request()
+
+    def process_response(self, req, resp, resource, req_succeeded, *args, **kwargs):
+        """Commits the request session if the request succeeded, otherwise
+        rolls it back, and closes it.
+        """
+        database.end_request(commit=req_succeeded)
+
+
 class LoggerMiddleware(object):
     def __init__(self, logger):
         self.logger = logger
@@ -136,3 +179,80 @@ class LoggerMiddleware(object):
 
     def process_response(self, req, resp, *args, **kwargs):
         self.logger.info('[RESPONSE] {0} {1} {2}'.format(req.method, req.relative_uri, resp.status[:3]))
+
+
+class MetricsMiddleware(object):
+    """Records the latency, statements, serialization time and response size of each request, see `metrics`."""
+
+    def process_request(self, req, resp, *args, **kwargs):
+        request_stats.reset()
+        req.context['started'] = time.perf_counter()
+
+    def process_response(self, req, resp, resource, req_succeeded, *args, **kwargs):
+        started = req.context.get('started', time.perf_counter())
+        method, route, status = req.method, req.uri_template, resp.status[:3]
+
+        def observe(body_size):
+            metrics.observe_request(method, route, status, time.perf_counter() - started, body_size)
+
+        stream = resp.stream
+        if stream is not None and not hasattr(stream, 'read'):
+            # the streamed responses are recorded once they were sent
+            resp.stream = metrics.MeasuredStream(stream, observe)
+        elif stream is not None:
+            observe(resp.stream_len or 0)
+        elif resp.data is not None:
+            observe(len(resp.data))
+        else:
+            observe(len(resp.body.encode()) if resp.body else 0)
+
+
+class QueryBudgetMiddleware(object):
+    """Logs (or fails, in the raise mode) the requests over their query budget, see `query_budget`."""
+
+    def __init__(self, mode):
+        self.mode = mode
+
+    def process_request(self, req, resp, *args, **kwargs):
+        query_budget.reset()
+
+    def process_response(self, req, resp, resource, req_succeeded, *args, **kwargs):
+        if resource is None:
+            return
+
+        problems = query_budget.check(resource, req.method)
+        if not problems:
+            return
+
+        message = '{} {} went over its query budget: {}'.format(req.method, req.uri_template, problems)
+        logger.warning(message)
+        if self.mode == 'raise' and req_succeeded:
+            raise falcon.HTTPError(falcon.HTTP_500, 'Query budget exceeded', message)
+
+
+class ProfilingMiddleware(object):
+    """Profiles the requests of the admins sending the profiling header, see `profiling`."""
+
+    def process_resource(self, req, resp, resource, params, *args, **kwargs):
+        if req.get_header(profiling.REQUEST_HEADER) != '1':
+            return
+
+        # the header of the other users is ignored
+        user = getattr(req, 'user', None)
+        if user is not None and user.user_type == UsersEnum.admin:
+            req.context['profiler'] = profiling.start()
+
+    def process_response(self, req, resp, resource, req_succeeded, *args, **kwargs):
+        profiler = req.context.pop('profiler', None)
+        if profiler is not None:
+            resp.set_header(profiling.RESPONSE_HEADER, profiling.save(profiler))
+
+
+class SamplingMiddleware(object):
+    """Marks the threads handling a request, the only ones sampled by the `sampler`."""
+
+    def process_request(self, req, resp, *args, **kwargs):
+        sampler.active_threads.add(threading.get_ident())
+
+    def process_response(self, req, resp, resource, req_succeeded, *args, **kwargs):
+        sampler.active_threads.discard(threading.get_ident())
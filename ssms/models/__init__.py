@@ -1,16 +1,18 @@
 import hashlib
+import itertools
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Integer, Sequence, String, func
-from sqlalchemy.ext.declarative import AbstractConcreteBase, declarative_base, declared_attr
+from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Index, Integer, Sequence, String, Text, event, \
+    func, and_, inspect, or_, select, tuple_
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import backref, relationship
 from sqlalchemy.orm.mapper import configure_mappers
 
 from ssms import app
 from ssms.database import session
 from ssms.models.enums import UsersEnum
-from ssms.util import auth, friendly_code
+from ssms.util import auth, cursor, friendly_code
 
 
 class Base(object):
@@ -21,52 +23,194 @@ class Base(object):
     id = None
     code = None
 
+    # columns used to sort the pages returned by get_page, they must be unique together
+    cursor_columns = ('id',)
+
+    # whether the flushes writing the model bump its DataVersion
+    versioned = False
+
     def save(self):
+        """Writes the item in a single transaction.
+
+        A new item is flushed to get its id and its code is assigned before
+        the commit. An existing item only writes the attributes changed since
+        it was loaded, as tracked by the session, and nothing if none was.
+        """
+        db_session = session()
+        now = datetime.utcnow()
+
         if not getattr(self, 'id', None):
-            self.created = datetime.utcnow()
-            session().add(self)
-        else:
-            cls = self.__class__
-            query = session().query(cls)
-            query = query.filter(cls.id == self.id)
-            query.update({
-                column: getattr(self, column)
-                for column in self.__table__.columns.keys()
-            })
-        self.updated = datetime.utcnow()
-        session().commit()
+            self.created = now
+            self.updated = now
+        elif self not in db_session or db_session.is_modified(self):
+            self.updated = now
+        db_session.add(self)
 
-        if 'code' in self.__table__.columns.keys():
-            if not self.code:
-                self.code = friendly_code.encode(int(self.id))
-                session().commit()
+        if 'code' in self.__table__.columns.keys() and not self.code:
+            db_session.flush()
+            self.code = friendly_code.encode(int(self.id))
+
+        db_session.commit()
 
     def delete(self):
         session().delete(self)
         session().commit()
 
+    @classmethod
+    def allocate_ids(cls, amount, db_session=None):
+        """Reserves `amount` new ids.
+
+        They are taken from the id sequence where the database has sequences,
+        in one round trip on PostgreSQL (with generate_series) and one per id
+        on the others. Otherwise they follow the current highest id, in one
+        round trip, then a concurrent insert makes the transaction fail with
+        an IntegrityError.
+        """
+        db_session = db_session or session()
+        if not amount:
+            return []
+
+        sequence = cls.__table__.c.id.default
+        dialect = db_session.bind.dialect
+        if dialect.supports_sequences and isinstance(sequence, Sequence):
+            if dialect.name == 'postgresql':
+                ids = db_session.execute(
+                    select([sequence.next_value()]).select_from(func.generate_series(1, amount)))
+                return sorted(row[0] for row in ids)
+            return [db_session.execute(select([sequence.next_value()])).scalar() for idx in range(amount)]
+
+        last_id = db_session.query(func.max(cls.id)).scalar() or 0
+        return list(range(last_id + 1, last_id + amount + 1))
+
+    @classmethod
+    def bulk_create(cls, items, db_session=None):
+        """Inserts the new items, flushed but not committed.
+
+        Their ids and codes are assigned beforehand, so the unit of work
+        batches the inserts into a single executemany per table, instead of
+        one insert and one code update per item as `save` does. The flush
+        listeners (rollups and data versions) run as usual.
+        """
+        db_session = db_session or session()
+        now = datetime.utcnow()
+        has_code = 'code' in cls.__table__.columns.keys()
+
+        ids = cls.allocate_ids(len(items), db_session)
+        codes = friendly_code.encode_many(ids) if has_code else [None] * len(ids)
+
+        for item, item_id, code in zip(items, ids, codes):
+            item.id = item_id
+            item.created = item.updated = now
+            if has_code:
+                item.code = code
+
+        db_session.add_all(items)
+        db_session.flush()
+
     @declared_attr
     def __tablename__(self):
         return self.__name__.lower()
 
     @classmethod
-    def get_all(cls):
-        return session().query(cls).all()
+    def get_all(cls, options=()):
+        return session().query(cls).options(*options).all()
 
     @classmethod
-    def get_by_id(cls, model_id):
+    def _sorted_query(cls, after=None, options=()):
+        columns = [getattr(cls, name) for name in cls.cursor_columns]
+
+        query = session().query(cls).options(*options)
+        if after:
+            query = query.filter(tuple_(*columns) > tuple_(*after))
+        return query.order_by(*columns)
+
+    @classmethod
+    def get_cursor_types(cls):
+        """Returns the Python types of the `cursor_columns`, the ones of the values of a cursor."""
+        return tuple(getattr(cls, name).type.python_type for name in cls.cursor_columns)
+
+    @classmethod
+    def iter_all(cls, after=None, options=()):
+        """Iterates over all the items sorted by the `cursor_columns`, loading
+        them from the database in batches of STREAM_BATCH_SIZE rows.
+        """
+        return cls._sorted_query(after, options).yield_per(app.STREAM_BATCH_SIZE)
+
+    @classmethod
+    def get_page(cls, limit, after=None, options=()):
+        """Returns up to `limit` items sorted by the `cursor_columns` and the cursor
+        of the next page, which is None on the last page.
+
+        Args:
+            limit: The page size.
+            after: The values of the `cursor_columns` of the last item of the
+                previous page.
+            options: The loader options of the query.
+        """
+        items = cls._sorted_query(after, options).limit(limit + 1).all()
+
+        if len(items) <= limit:
+            return items, None
+
+        items = items[:limit]
+        last = items[-1]
+        return items, cursor.encode([getattr(last, name) for name in cls.cursor_columns])
+
+    @classmethod
+    def get_by_id(cls, model_id, options=()):
         if cls.id:
-            return session().query(cls).filter(cls.id == model_id).first()
+            return session().query(cls).options(*options).filter(cls.id == model_id).first()
         else:
             return None
 
     @classmethod
-    def get_by_code(cls, code):
-        if getattr(cls, 'code', None):
-            return session().query(cls).filter(cls.code == code).first()
-        else:
+    def get_by_code(cls, code, options=()):
+        """Returns the item with the code, looked up by the id it decodes to.
+
+        The codes written before they were reversible don't decode, they are
+        looked up by value.
+        """
+        if not getattr(cls, 'code', None):
             return None
 
+        model_id = friendly_code.decode(code)
+        if model_id is None:
+            return session().query(cls).options(*options).filter(cls.code == code).first()
+
+        item = session().query(cls).options(*options).get(model_id)
+        # the item may still have a code of the previous encoder
+        if item is not None and item.code == code:
+            return item
+        return None
+
+    @classmethod
+    def get_by_codes(cls, codes, options=()):
+        """Returns the {code: item} of the items with the codes, the missing ones are left out.
+
+        The codes are looked up by the ids they decode to, in a single query, and
+        the ones of the previous encoder by value, in another one.
+        """
+        codes = set(codes)
+        if not getattr(cls, 'code', None) or not codes:
+            return {}
+
+        decoded = {}
+        legacy = []
+        for code, model_id in zip(codes, friendly_code.decode_many(codes)):
+            if model_id is None:
+                legacy.append(code)
+            else:
+                decoded[model_id] = code
+
+        items = {}
+        query = session().query(cls).options(*options)
+        if decoded:
+            items.update((item.code, item) for item in query.filter(cls.id.in_(decoded))
+                         if item.code == decoded[item.id])
+        if legacy:
+            items.update((item.code, item) for item in query.filter(cls.code.in_(legacy)))
+        return items
+
 
 BaseModel = declarative_base(cls=Base)
 
@@ -78,6 +222,8 @@ class Ingredient(BaseModel):
     unit = Column(String(128))
     code = Column(String(256), index=True, unique=True)
 
+    versioned = True
+
     __mapper_args__ = {
         'confirm_deleted_rows': False,
     }
@@ -95,6 +241,8 @@ class Product(BaseModel):
     discount = Column(Float)
     code = Column(String(256), index=True, unique=True)
 
+    versioned = True
+
     __mapper_args__ = {
         'confirm_deleted_rows': False,
     }
@@ -104,16 +252,19 @@ class Product(BaseModel):
             .format(self.__class__.__name__, self.name, self.value)
 
     @classmethod
-    def report_ingredients(cls, products_ids=list(), subquery=False):
+    def report_ingredients(cls, products_ids=list(), subquery=False, options=(), stream=False):
         query = session().query(Ingredient,
                                 func.sum(ProductIngredient.amount).label(
                                     'total'))
+        query = query.options(*options)
         query = query.select_from(ProductIngredient).join(Ingredient)
         query = query.filter(ProductIngredient.product_id.in_(products_ids))
         query = query.group_by(ProductIngredient.ingredient_id)
 
         if subquery:
             return query.subquery()
+        elif stream:
+            return query.yield_per(app.STREAM_BATCH_SIZE)
         else:
             return query.all()
 
@@ -123,7 +274,15 @@ class Order(BaseModel):
                 autoincrement=True)
     code = Column(String(256), index=True, unique=True)
 
-    client_id = Column(Integer, ForeignKey('client.id'))
+    client_id = Column(Integer, ForeignKey('user.id'))
+
+    cursor_columns = ('created', 'id')
+    versioned = True
+
+    __table_args__ = (
+        Index('ix_order_created_id', 'created', 'id'),
+        Index('ix_order_client_id_created', 'client_id', 'created'),
+    )
 
     __mapper_args__ = {
         'confirm_deleted_rows': False,
@@ -134,30 +293,85 @@ class Order(BaseModel):
             .format(self.__class__.__name__, self.id, self.code, self.client_id)
 
     @classmethod
-    def report_products(cls, orders_ids=list(), subquery=False):
+    def filter_orders(cls, order_id, orders_ids=None, start=None, end=None, clients_ids=None):
+        """Returns the conditions restricting an order id column to the orders
+        matching the report filters, `None` filters are ignored.
+
+        The orders filters are pushed down as a sub-select of the order table,
+        served by its (created, id) and (client_id, created) indexes.
+
+        Args:
+            order_id: The order id column to filter.
+            orders_ids: The orders ids.
+            start: The first creation datetime, included.
+            end: The last creation datetime, excluded.
+            clients_ids: The clients ids.
+        """
+        conditions = []
+        if orders_ids is not None:
+            conditions.append(order_id.in_(orders_ids))
+
+        orders_conditions = []
+        if start is not None:
+            orders_conditions.append(cls.created >= start)
+        if end is not None:
+            orders_conditions.append(cls.created < end)
+        if clients_ids is not None:
+            orders_conditions.append(cls.client_id.in_(clients_ids))
+        if orders_conditions:
+            conditions.append(order_id.in_(select([cls.id]).where(and_(*orders_conditions))))
+
+        return conditions
+
+    @classmethod
+    def report_products(cls, orders_ids=list(), subquery=False, options=(), stream=False,
+                        start=None, end=None, clients_ids=None, products_ids=None):
+        """Returns the [(Product, total amount)...] of the orders, the `orders_ids`
+        may be None to report on every order matching the other filters.
+        """
         query = session().query(Product,
                                 func.sum(OrderProduct.amount).label('total'))
+        query = query.options(*options)
         query = query.select_from(OrderProduct).join(Product)
-        query = query.filter(OrderProduct.order_id.in_(orders_ids))
+        query = query.filter(*cls.filter_orders(OrderProduct.order_id, orders_ids, start, end, clients_ids))
+        if products_ids is not None:
+            query = query.filter(OrderProduct.product_id.in_(products_ids))
         query = query.group_by(Product.id)
 
         if subquery:
             return query.subquery()
+        elif stream:
+            return query.yield_per(app.STREAM_BATCH_SIZE)
         else:
             return query.all()
 
     @classmethod
-    def report_ingredients(cls, orders_ids=list(), subquery=False):
-        stmt = cls.report_products(orders_ids=orders_ids, subquery=True)
-
-        query = session().query(Ingredient, func.sum(
-            stmt.c.total * ProductIngredient.amount), )
-        query = query.select_from(ProductIngredient).join(Ingredient)
-        query = query.join(stmt, ProductIngredient.product_id == stmt.c.id)
+    def report_ingredients(cls, orders_ids=list(), subquery=False, options=(), stream=False,
+                           start=None, end=None, clients_ids=None, products_ids=None):
+        """Returns the [(Ingredient, total amount)...] needed by the orders, the
+        `orders_ids` may be None to report on every order matching the other
+        filters. With `products_ids` only the lines of those products count.
+        """
+        if products_ids is None:
+            # served from the materialised demand of each order, see OrderIngredient
+            query = session().query(Ingredient, func.sum(OrderIngredient.total))
+            query = query.select_from(OrderIngredient).join(Ingredient)
+            query = query.filter(*cls.filter_orders(OrderIngredient.order_id, orders_ids, start, end, clients_ids))
+        else:
+            # the rollup holds whole orders, the lines of the products are summed instead
+            query = session().query(Ingredient, func.sum(OrderProduct.amount * ProductIngredient.amount))
+            query = query.select_from(OrderProduct) \
+                .join(ProductIngredient, ProductIngredient.product_id == OrderProduct.product_id) \
+                .join(Ingredient, Ingredient.id == ProductIngredient.ingredient_id)
+            query = query.filter(*cls.filter_orders(OrderProduct.order_id, orders_ids, start, end, clients_ids))
+            query = query.filter(OrderProduct.product_id.in_(products_ids))
+        query = query.options(*options)
         query = query.group_by(Ingredient.id)
 
         if subquery:
             return query.subquery()
+        elif stream:
+            return query.yield_per(app.STREAM_BATCH_SIZE)
         else:
             return query.all()
 
@@ -168,18 +382,20 @@ class ProductIngredient(BaseModel):
                            primary_key=True)
     amount = Column(Float)
 
+    versioned = True
+
     product = relationship('Product',
-                           lazy="subquery",
+                           lazy="select",
                            cascade='save-update, merge, expunge',
                            backref=backref('ingredients',
-                                           lazy="subquery",
+                                           lazy="select",
                                            cascade="all, delete-orphan",
                                            single_parent=True))
     ingredient = relationship('Ingredient',
-                              lazy="subquery",
+                              lazy="select",
                               cascade='save-update, merge, expunge',
                               backref=backref('products',
-                                              lazy="subquery",
+                                              lazy="select",
                                               cascade="all, delete-orphan",
                                               single_parent=True))
 
@@ -213,18 +429,25 @@ class OrderProduct(BaseModel):
     order_id = Column(Integer, ForeignKey('order.id'), primary_key=True)
     amount = Column(Integer)
 
+    versioned = True
+
+    # the primary key starts with the product, the reports look the lines up by order
+    __table_args__ = (
+        Index('ix_orderproduct_order_id_product_id', 'order_id', 'product_id'),
+    )
+
     product = relationship('Product',
-                           lazy="subquery",
+                           lazy="select",
                            cascade='save-update, merge, expunge',
                            backref=backref('orders',
-                                           lazy="subquery",
+                                           lazy="select",
                                            cascade="all, delete-orphan",
                                            single_parent=True))
     order = relationship('Order',
-                         lazy="subquery",
+                         lazy="select",
                          cascade='save-update, merge, expunge',
                          backref=backref('products',
-                                         lazy="subquery",
+                                         lazy="select",
                                          cascade="all, delete-orphan",
                                          single_parent=True))
 
@@ -252,18 +475,156 @@ class OrderProduct(BaseModel):
                     self.amount)
 
 
-class User(AbstractConcreteBase, BaseModel):
+class OrderIngredient(BaseModel):
+    """The materialised amount of each ingredient needed by an order, the sum
+    of its products amounts times their recipes amounts.
+
+    The rows of the orders whose products or recipes are written are refreshed
+    on every flush (see `_refresh_order_ingredients`), `rebuild` recomputes the
+    whole table.
+    """
+    order_id = Column(Integer, ForeignKey('order.id', ondelete='CASCADE'), primary_key=True)
+    ingredient_id = Column(Integer, ForeignKey('ingredient.id', ondelete='CASCADE'), primary_key=True)
+    total = Column(Float)
+
+    # bumped by rebuild, the flushes only refresh the rows through the orders and recipes
+    versioned = True
+
+    def __repr__(self):
+        return "<{}(order_id={}, ingredient_id={}, total={:.2f})>" \
+            .format(self.__class__.__name__, self.order_id,
+                    self.ingredient_id, self.total)
+
+    @classmethod
+    def _refresh(cls, db_session, orders_condition=None):
+        demand = select([
+            OrderProduct.order_id,
+            ProductIngredient.ingredient_id,
+            func.sum(OrderProduct.amount * ProductIngredient.amount),
+        ]).select_from(
+            OrderProduct.__table__.join(ProductIngredient.__table__,
+                                        OrderProduct.product_id == ProductIngredient.product_id)
+        ).group_by(OrderProduct.order_id, ProductIngredient.ingredient_id)
+
+        delete = cls.__table__.delete()
+        if orders_condition is not None:
+            delete = delete.where(orders_condition(cls.order_id))
+            demand = demand.where(orders_condition(OrderProduct.order_id))
+
+        db_session.execute(delete)
+        db_session.execute(cls.__table__.insert().from_select(['order_id', 'ingredient_id', 'total'], demand))
+
+    @classmethod
+    def refresh(cls, orders_ids=(), products_ids=(), db_session=None):
+        """Recomputes the rows of the given orders and of the orders with any of the given products."""
+        orders_ids, products_ids = list(orders_ids), list(products_ids)
+
+        def orders_condition(column):
+            conditions = []
+            if orders_ids:
+                conditions.append(column.in_(orders_ids))
+            if products_ids:
+                conditions.append(column.in_(
+                    select([OrderProduct.order_id]).where(OrderProduct.product_id.in_(products_ids))))
+            return or_(*conditions)
+
+        if orders_ids or products_ids:
+            cls._refresh(db_session or session(), orders_condition)
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes the whole table, to fix any drift from the orders and recipes."""
+        cls._refresh(session())
+        DataVersion.bump([cls.__tablename__])
+        session().commit()
+
+
+class DataVersion(BaseModel):
+    """A counter per versioned model, bumped once per transaction by its first
+    flush writing the model. Being in the database they are shared by all the
+    processes, anything cached with the versions read at the start of a
+    request is consistent with the data that request can see.
+
+    A session which bumped a version hasn't committed yet: the next flushes
+    write under the same version and the transaction may still roll back, so
+    nothing read by it is cached under that version (see `is_pending`).
+    """
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<{}(name={}, version={})>" \
+            .format(self.__class__.__name__, self.name, self.version)
+
+    @classmethod
+    def get_versions(cls, models, db_session=None):
+        """Returns the versions of the given models, in the same order."""
+        names = [model.__table__.name for model in models]
+        versions = dict((db_session or session()).query(cls.name, cls.version).filter(cls.name.in_(names)))
+        return tuple(versions.get(name, 0) for name in names)
+
+    @classmethod
+    def is_pending(cls, models, db_session=None):
+        """Returns whether the session bumped the version of one of the models in its current transaction."""
+        bumped = (db_session or session()).info.get('bumped_versions')
+        return bool(bumped) and any(model.__table__.name in bumped for model in models)
+
+    @classmethod
+    def bump(cls, names, db_session=None):
+        """Increments the versions, the new ones are kept in `db_session.info['data_versions']`."""
+        db_session = db_session or session()
+        for name in sorted(names):
+            result = db_session.execute(
+                cls.__table__.update().where(cls.name == name).values(version=cls.version + 1))
+            if not result.rowcount:
+                db_session.execute(cls.__table__.insert().values(name=name, version=1))
+
+        versions = db_session.execute(select([cls.name, cls.version]).where(cls.name.in_(names)))
+        db_session.info.setdefault('data_versions', {}).update(
+            (name, version) for name, version in versions)
+
+
+class ImportJob(BaseModel):
+    """The progress of a catalogue import, committed along with every chunk it writes."""
+    id = Column(Integer, Sequence('importjob_id_seq'), primary_key=True,
+                autoincrement=True)
+    resource = Column(String(32), nullable=False)
+    format = Column(String(16), nullable=False)
+    status = Column(String(16), nullable=False, default='running')
+    processed = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    rejected = Column(Integer, nullable=False, default=0)
+    # the JSON list of the first rejected rows errors
+    errors = Column(Text)
+    message = Column(String(256))
+
+    __mapper_args__ = {
+        'confirm_deleted_rows': False,
+    }
+
+    def __repr__(self):
+        return "<{}(id={}, resource={}, status={}, processed={})>" \
+            .format(self.__class__.__name__, self.id, self.resource,
+                    self.status, self.processed)
+
+
+class User(BaseModel):
+    """The admins and the clients, stored in a single table told apart by the user_type."""
     id = Column(Integer, Sequence('user_id_seq'), primary_key=True,
                 autoincrement=True)
-    email = Column(String(128), unique=True)
+    email = Column(String(128), index=True, unique=True)
     first_name = Column(String(128))
     last_name = Column(String(128))
     password = Column(String(256))
     seed = Column(String(128))
-    user_type = Column(Enum(UsersEnum), default=UsersEnum.client)
+    user_type = Column(Enum(UsersEnum), nullable=False, default=UsersEnum.client)
     code = Column(String(256), index=True, unique=True)
 
+    # the authenticated users cached by each worker are checked against it
+    versioned = True
+
     __mapper_args__ = {
+        'polymorphic_on': user_type,
         'confirm_deleted_rows': False,
     }
 
@@ -281,6 +642,20 @@ class User(AbstractConcreteBase, BaseModel):
     def set_password(self, password):
         self.password, self.seed = self.hash_password(password, None)
 
+    def _cached_emails(self):
+        # the current email and the previous one, if it was changed
+        return {self.email} | set(inspect(self).attrs.email.history.deleted or ())
+
+    def save(self, *args, **kwargs):
+        emails = self._cached_emails()
+        super().save(*args, **kwargs)
+        auth.invalidate_user(*emails)
+
+    def delete(self, *args, **kwargs):
+        emails = self._cached_emails()
+        super().delete(*args, **kwargs)
+        auth.invalidate_user(*emails)
+
     @classmethod
     def get_by_email(cls, email):
         return session().query(cls).filter(cls.email == email).first()
@@ -296,9 +671,10 @@ class User(AbstractConcreteBase, BaseModel):
 
 
 class Admin(User):
+    __tablename__ = None
+
     __mapper_args__ = {
-        'polymorphic_identity': 'admin',
-        'concrete':             True,
+        'polymorphic_identity': UsersEnum.admin,
     }
 
     def save(self, *args, **kwargs):
@@ -308,13 +684,14 @@ class Admin(User):
 
 class Client(User):
     orders = relationship('Order',
-                          backref=backref('client', lazy="subquery"),
+                          backref=backref('client', lazy="select"),
                           cascade="all, delete-orphan",
-                          lazy="subquery")
+                          lazy="select")
+
+    __tablename__ = None
 
     __mapper_args__ = {
-        'polymorphic_identity': 'client',
-        'concrete':             True
+        'polymorphic_identity': UsersEnum.client,
     }
 
     def save(self, *args, **kwargs):
@@ -322,6 +699,54 @@ class Client(User):
         super().save(*args, **kwargs)
 
 
+def _changed_values(obj, key):
+    """Returns the current and the previous values of a primary key column of a
+    flushed object, without loading anything.
+    """
+    state = inspect(obj)
+    values = set(state.attrs[key].history.sum())
+    if state.key:
+        primary_key = [column.key for column in state.mapper.primary_key]
+        values.add(state.key[1][primary_key.index(key)])
+    values.discard(None)
+    return values
+
+
+@event.listens_for(app.Session, 'after_flush')
+def _refresh_order_ingredients(db_session, flush_context):
+    orders_ids, products_ids = set(), set()
+    for obj in itertools.chain(db_session.new, db_session.dirty, db_session.deleted):
+        if isinstance(obj, OrderProduct):
+            orders_ids.update(_changed_values(obj, 'order_id'))
+        elif isinstance(obj, ProductIngredient):
+            products_ids.update(_changed_values(obj, 'product_id'))
+
+    OrderIngredient.refresh(orders_ids, products_ids, db_session)
+
+
+@event.listens_for(app.Session, 'after_flush')
+def _bump_data_versions(db_session, flush_context):
+    # a version is bumped once per transaction, what the later flushes write is committed along, the caches
+    # aren't filled until then (DataVersion.is_pending)
+    bumped = db_session.info.setdefault('bumped_versions', set())
+    names = {
+        # the table of the model, the subclasses of a single table one (e.g. Client) have no __tablename__
+        obj.__table__.name
+        for obj in itertools.chain(db_session.new, db_session.dirty, db_session.deleted)
+        if obj.versioned
+    } - bumped
+    if names:
+        DataVersion.bump(names, db_session)
+        bumped.update(names)
+
+
+@event.listens_for(app.Session, 'after_transaction_end')
+def _reset_bumped_versions(db_session, transaction):
+    # the subtransactions of the flushes are part of the current transaction
+    if transaction.parent is None or transaction.nested:
+        db_session.info.pop('bumped_versions', None)
+
+
 BaseModel.metadata.create_all(app.engine)
-# maps the abstract user class
+# sets up the backrefs, used as class attributes by the resources
 configure_mappers()
@@ -1,10 +1,9 @@
 import falcon
 
+from ssms.util import codec
 from ssms.util.response import format_response
 from ssms.hooks import require_auth
 
-import json
-
 from logging import getLogger
 
 logger = getLogger(__name__)
@@ -12,8 +11,10 @@ logger = getLogger(__name__)
 
 @falcon.before(require_auth)
 class UserAuthenticationResource(object):
+    query_budget = dict(POST=3)
+
     def on_post(self, req, resp, *args, **kwargs):
         user = getattr(req, 'user')
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(format_response(user.get_token()), ensure_ascii=False)
+        resp.data = codec.dumps(format_response(user.get_token()))
@@ -0,0 +1,86 @@
+from logging import getLogger
+
+import falcon
+
+from ssms import hooks
+from ssms.models import ImportJob
+from ssms.schemas import ImportJobSchema
+from ssms.util import codec, importer
+from ssms.util.response import format_error, format_errors, format_response
+
+logger = getLogger(__name__)
+
+# the import formats of the content types
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ImportResource(object):
+    """Imports the rows of a CSV or NDJSON body, read as it is received.
+
+    The format is given by the `format` param or by the content type. The
+    progress can be followed on /imports/{import_id} while the import runs.
+    """
+
+    # a transaction per chunk of rows, its statements grow with the file
+    query_budget = None
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def on_post(self, req, resp, *args, **kwargs):
+        content_type = (req.content_type or '').split(';')[0].strip()
+        stream_format = req.get_param('format') or CONTENT_TYPES.get(content_type)
+
+        if stream_format not in importer.FORMATS:
+            errors = [format_error('invalid-format', 'Expected one of {}'.format(', '.join(importer.FORMATS)),
+                                   dict(field='format'))]
+            resp.status = falcon.HTTP_400
+            resp.data = codec.dumps(format_errors(errors))
+            return
+
+        job = importer.create_job(self.resource, stream_format)
+
+        try:
+            importer.run(job, req.bounded_stream)
+        except Exception as e:
+            logger.error(e)
+            resp.status = falcon.HTTP_500
+        else:
+            resp.status = falcon.HTTP_200
+
+        data, errors = ImportJobSchema().dump(job)
+        resp.data = codec.dumps(format_response(data))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ImportListResource(object):
+    model = ImportJob
+    query_budget = dict(GET=3)
+
+    @falcon.before(hooks.get_page)
+    def on_get(self, req, resp, page, *args, **kwargs):
+        jobs, next_page = ImportJob.get_page(**page)
+
+        data, errors = ImportJobSchema().dump(jobs, many=True)
+
+        resp.status = falcon.HTTP_200
+        resp.data = codec.dumps(format_response(data, next=next_page))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+@falcon.before(hooks.get_import_job)
+class ImportDetailResource(object):
+    query_budget = dict(GET=3)
+
+    def on_get(self, req, resp, job, *args, **kwargs):
+        data, errors = ImportJobSchema().dump(job)
+
+        resp.status = falcon.HTTP_200
+        resp.data = codec.dumps(format_response(data))
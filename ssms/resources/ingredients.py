@@ -1,4 +1,3 @@
-import json
 from logging import getLogger
 
 import falcon
@@ -6,33 +5,43 @@ import falcon
 from ssms import hooks
 from ssms.models import Ingredient
 from ssms.schemas import IngredientSchema
-from ssms.util.response import format_error, format_errors, format_response
+from ssms.schemas.compiler import compile_schema
+from ssms.util import bulk, code_cache, codec
+from ssms.util.response import format_error, format_errors, format_response, stream_response
 
 logger = getLogger(__name__)
 
+# compiled dump used by the read paths
+INGREDIENT_SERIALIZER = compile_schema(IngredientSchema)
+
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class IngredientListResource(object):
+    model = Ingredient
+    query_budget = dict(GET=3, POST=9)
 
-    def on_get(self, req, resp, *args, **kwargs):
-        schema = IngredientSchema()
-        ingredients = Ingredient.get_all()
+    @falcon.before(hooks.get_page)
+    @falcon.before(hooks.get_stream_format)
+    def on_get(self, req, resp, page, stream_format, *args, **kwargs):
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Ingredient.iter_all(after=page['after']),
+                            INGREDIENT_SERIALIZER.dump)
+            return
 
-        data, errors = schema.dump(ingredients, many=True)
+        ingredients, next_page = Ingredient.get_page(**page)
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+        data = INGREDIENT_SERIALIZER.dump(ingredients, many=True)
 
-        data = format_response(data)
+        data = format_response(data, next=next_page)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_post(self, req, resp, *args, **kwargs):
         schema = IngredientSchema()
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         data.pop('type', None)
 
@@ -44,37 +53,34 @@ class IngredientListResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             ingredient.save()
 
             data, errors = schema.dump(ingredient)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 @falcon.before(hooks.get_ingredient)
 class IngredientDetailResource(object):
-    def on_get(self, res, resp, ingredient, *args, **kwargs):
-        schema = IngredientSchema()
-        data, errors = schema.dump(ingredient)
+    query_budget = dict(GET=3, PUT=8, DELETE=12)
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+    def on_get(self, res, resp, ingredient, *args, **kwargs):
+        data = INGREDIENT_SERIALIZER.dump(ingredient)
 
         data = format_response(data)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_put(self, req, resp, ingredient, *args, **kwargs):
         schema = IngredientSchema()
 
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         ingredient, errors = schema.load(data, partial=True, instance=ingredient)
 
@@ -84,14 +90,14 @@ class IngredientDetailResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             ingredient.save()
 
             data, errors = schema.dump(ingredient)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
     def on_delete(self, req, resp, ingredient, *args, **kwargs):
         schema = IngredientSchema()
@@ -102,4 +108,30 @@ class IngredientDetailResource(object):
 
         resp.status = falcon.HTTP_200
 
-        resp.body = json.dumps(format_response(data), ensure_ascii=False)
+        resp.data = codec.dumps(format_response(data))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class IngredientCodeResource(object):
+    """The ingredients looked up by code, `code/{code}` or `code?codes=A,B` for several of them."""
+
+    query_budget = dict(GET=4)
+    cache = code_cache.register('ingredients', (Ingredient,))
+
+    @falcon.before(hooks.get_codes)
+    def on_get(self, req, resp, codes, code=None, *args, **kwargs):
+        items = code_cache.get_items(self.cache, Ingredient, codes, INGREDIENT_SERIALIZER.dump)
+        code_cache.send_items(resp, items, codes, many=code is None)
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class IngredientBulkResource(object):
+    query_budget = dict(POST=7)
+
+    @falcon.before(hooks.get_bulk_items)
+    def on_post(self, req, resp, items, *args, **kwargs):
+        loaded, errors = bulk.load_items(IngredientSchema(), items)
+
+        bulk.create(resp, Ingredient, loaded, errors, INGREDIENT_SERIALIZER.dump)
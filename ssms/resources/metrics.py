@@ -0,0 +1,17 @@
+import falcon
+
+from ssms import hooks
+from ssms.util import metrics
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class MetricsResource(object):
+    """The Prometheus metrics of the requests and caches, of all the workers in multiprocess mode."""
+
+    query_budget = dict(GET=3)
+
+    def on_get(self, req, resp, *args, **kwargs):
+        resp.status = falcon.HTTP_200
+        resp.content_type = metrics.CONTENT_TYPE
+        resp.data = metrics.collect()
@@ -1,39 +1,64 @@
-import json
 from logging import getLogger
 
 import falcon
+from sqlalchemy.orm import joinedload, selectinload
 
 from ssms import hooks
-from ssms.models import Order
+from ssms.app import REPORT_BACKEND
+from ssms.models import Client, Ingredient, Order, OrderIngredient, OrderProduct, Product, ProductIngredient, User
+from ssms.resources.products import PRODUCT_EAGER_LOAD
 from ssms.schemas import OrderIngredientsReportSchema, OrderProductSchema, OrderProductsReportSchema, OrderSchema
-from ssms.util.response import format_error, format_errors, format_response
+from ssms.schemas.compiler import compile_schema
+from ssms.util import bom, bulk, code_cache, codec, export, order_lines, report_cache
+from ssms.util.response import format_error, format_errors, format_response, stream_response
 
 logger = getLogger(__name__)
 
+# relationships dumped by the OrderSchema
+ORDER_EAGER_LOAD = (
+    joinedload(Order.client),
+    selectinload(Order.products)
+    .joinedload(OrderProduct.product)
+    .selectinload(Product.ingredients)
+    .joinedload(ProductIngredient.ingredient),
+)
+
+# compiled dumps used by the read paths
+ORDER_SERIALIZER = compile_schema(OrderSchema)
+ORDER_PRODUCTS_REPORT_SERIALIZER = compile_schema(OrderProductsReportSchema)
+ORDER_INGREDIENTS_REPORT_SERIALIZER = compile_schema(OrderIngredientsReportSchema)
+
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class OrderListResource(object):
-    def on_get(self, req, resp, *args, **kwargs):
-        schema = OrderSchema()
-        orders = Order.get_all()
+    model = Order
+    query_budget = dict(GET=5, POST=17)
+    eager_load = ORDER_EAGER_LOAD
 
-        data, errors = schema.dump(orders, many=True)
+    @falcon.before(hooks.get_page)
+    @falcon.before(hooks.get_stream_format)
+    def on_get(self, req, resp, page, stream_format, *args, **kwargs):
+        context = dict(remove_fields=['seed', 'password'])
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Order.iter_all(after=page['after'], options=self.eager_load),
+                            lambda order: ORDER_SERIALIZER.dump(order, context=context))
+            return
 
-        schema.context['remove_fields'] = ['seed', 'password']
+        orders, next_page = Order.get_page(options=self.eager_load, **page)
 
-        data = format_response(data)
+        data = ORDER_SERIALIZER.dump(orders, many=True, context=context)
+
+        data = format_response(data, next=next_page)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_post(self, req, resp, *args, **kwargs):
         schema = OrderSchema()
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         data.pop('type', None)
 
@@ -46,41 +71,39 @@ class OrderListResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             schema.context['remove_fields'] = ['seed', 'password']
 
             order.save()
 
+            # reloaded with its relationships, instead of lazy loading them one row at a time
+            order = Order.get_by_id(order.id, options=self.eager_load)
             data, errors = schema.dump(order)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 @falcon.before(hooks.get_order)
 class OrderDetailResource(object):
-    def on_get(self, req, resp, order, *args, **kwargs):
-        schema = OrderSchema()
-        data, errors = schema.dump(order)
+    query_budget = dict(GET=5, PUT=19, DELETE=13)
+    eager_load = ORDER_EAGER_LOAD
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
-
-        schema.context['remove_fields'] = ['seed', 'password']
+    def on_get(self, req, resp, order, *args, **kwargs):
+        data = ORDER_SERIALIZER.dump(order, context=dict(remove_fields=['seed', 'password']))
 
         data = format_response(data)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_put(self, req, resp, order, *args, **kwargs):
         schema = OrderSchema()
 
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         products = data.pop('products', None)
 
@@ -100,7 +123,7 @@ class OrderDetailResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         elif op_errors:
             logger.error(op_errors)
             op_errors = [
@@ -108,7 +131,7 @@ class OrderDetailResource(object):
                 for key, value in op_errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(op_errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(op_errors))
         else:
             if op:
                 order.products = op
@@ -117,70 +140,250 @@ class OrderDetailResource(object):
 
             order.save()
 
+            # reloaded, the commit expired the relationships loaded by the hook
+            order = Order.get_by_id(order.id, options=self.eager_load)
             data, errors = schema.dump(order)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
     def on_delete(self, req, resp, order, *args, **kwargs):
         schema = OrderSchema()
 
-        order.delete()
-
         schema.context['remove_fields'] = ['seed', 'password']
 
+        # dumped before the commit expires the loaded relationships
         data, errors = schema.dump(order)
 
+        order.delete()
+
         resp.status = falcon.HTTP_200
 
-        resp.body = json.dumps(format_response(data), ensure_ascii=False)
+        resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
-class OrderProductsReportResource(object):
-    def on_get(self, req, resp, *args, **kwargs):
-        schema = OrderProductsReportSchema()
+class OrderCodeResource(object):
+    """The orders looked up by code, `code/{code}` or `code?codes=A,B` for several of them."""
+
+    query_budget = dict(GET=5)
+    eager_load = ORDER_EAGER_LOAD
+    cache = code_cache.register('orders', (Order, OrderProduct, Product, ProductIngredient, Ingredient, User))
+
+    @falcon.before(hooks.get_codes)
+    def on_get(self, req, resp, codes, code=None, *args, **kwargs):
+        context = dict(remove_fields=['seed', 'password'])
+        items = code_cache.get_items(self.cache, Order, codes,
+                                     lambda order: ORDER_SERIALIZER.dump(order, context=context),
+                                     options=self.eager_load)
+        code_cache.send_items(resp, items, codes, many=code is None)
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class OrderBulkResource(object):
+    query_budget = dict(POST=15)
+
+    @falcon.before(hooks.get_bulk_items)
+    def on_post(self, req, resp, items, *args, **kwargs):
+        loaded, errors = bulk.load_items(OrderSchema(), items)
+
+        bulk.check_references(loaded, errors, 'client_id',
+                              lambda order: [order.client_id] if order.client_id else [], Client)
+        bulk.check_references(loaded, errors, 'products',
+                              lambda order: [op.product_id for op in order.products], Product,
+                              options=PRODUCT_EAGER_LOAD)
+
+        context = dict(remove_fields=['seed', 'password'])
+        bulk.create(resp, Order, loaded, errors, lambda order: ORDER_SERIALIZER.dump(order, context=context))
 
-        data = json.loads(req.stream.read(req.content_length or 0))
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class OrderExportResource(object):
+    """Streams every order line (with its order, client and product) as CSV or NDJSON.
+
+    The export is gzip compressed when the client accepts it.
+    """
+
+    # the export runs once the response was started, outside of the request
+    query_budget = None
+
+    @falcon.before(hooks.get_time_range)
+    def on_get(self, req, resp, time_range, *args, **kwargs):
+        stream_format = _get_choice_param(req, 'format', export.FORMATS, 'csv')
+        clients_ids = req.get_param_as_list('client_id', transform=int)
+        compress = 'gzip' in (req.get_header('Accept-Encoding') or '')
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = export.FORMATS[stream_format]
+        resp.set_header('Content-Disposition', 'attachment; filename="orders.{}"'.format(stream_format))
+        if compress:
+            resp.set_header('Content-Encoding', 'gzip')
+        resp.set_header('Vary', 'Accept-Encoding')
+        resp.stream = export.export_orders(stream_format, compress, clients_ids=clients_ids, **time_range)
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class OrderProductsReportResource(object):
+    query_budget = dict(GET=5)
+    eager_load = PRODUCT_EAGER_LOAD
+    report_dependencies = (Order, OrderProduct, Product, ProductIngredient, Ingredient)
+
+    @falcon.before(hooks.get_stream_format)
+    @falcon.before(hooks.get_report_filters)
+    def on_get(self, req, resp, stream_format, filters, *args, **kwargs):
+        # the orders ids are optional, the filters alone select the orders
+        content = req.stream.read(req.content_length or 0)
+        data = codec.loads(content) if content else None
+
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Order.report_products(data, options=self.eager_load, stream=True, **filters),
+                            lambda row: ORDER_PRODUCTS_REPORT_SERIALIZER.dump(dict(
+                                product_id=row[0].id,
+                                product=row[0],
+                                total=float(row[1]),
+                            )))
+            return
 
         try:
-            report_data = [
-                dict(
-                    product_id=product.id,
-                    product=product,
-                    total=float(total),
-                ) for product, total in Order.report_products(data)
-            ]
-            report, errors = schema.dump(report_data, many=True)
+            body = report_cache.get_report('orders/products', data, self.report_dependencies, self.build_report,
+                                           **filters)
         except Exception as e:
             logger.error(e)
             resp.status = falcon.HTTP_500
         else:
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(report), ensure_ascii=False)
+            resp.data = body
+
+    def build_report(self, orders_ids, **filters):
+        report_data = [
+            dict(
+                product_id=product.id,
+                product=product,
+                total=float(total),
+            ) for product, total in Order.report_products(orders_ids, options=self.eager_load, **filters)
+        ]
+        report = ORDER_PRODUCTS_REPORT_SERIALIZER.dump(report_data, many=True)
+        return codec.dumps(format_response(report))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class OrderIngredientsReportResource(object):
-    def on_get(self, req, resp, *args, **kwargs):
-        oi_schema = OrderIngredientsReportSchema()
-
-        data = json.loads(req.stream.read(req.content_length or 0))
+    query_budget = dict(GET=7)
+
+    report_dependencies = (Order, OrderIngredient, OrderProduct, ProductIngredient, Ingredient)
+
+    @falcon.before(hooks.get_stream_format)
+    @falcon.before(hooks.get_report_filters)
+    def on_get(self, req, resp, stream_format, filters, *args, **kwargs):
+        # the orders ids are optional, the filters alone select the orders
+        content = req.stream.read(req.content_length or 0)
+        data = codec.loads(content) if content else None
+
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Order.report_ingredients(data, stream=True, **filters),
+                            lambda row: ORDER_INGREDIENTS_REPORT_SERIALIZER.dump(dict(
+                                ingredient_id=row[0].id,
+                                ingredient=row[0],
+                                total=float(row[1]),
+                            )))
+            return
 
         try:
-            report_data = [
-                dict(
-                    ingredient_id=ingredient.id,
-                    ingredient=ingredient,
-                    total=float(total),
-                ) for ingredient, total in Order.report_ingredients(data)
-            ]
-            report, errors = oi_schema.dump(report_data, many=True)
+            body = report_cache.get_report('orders/ingredients', data, self.report_dependencies, self.build_report,
+                                           **filters)
         except Exception as e:
             logger.error(e)
             resp.status = falcon.HTTP_500
         else:
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(report), ensure_ascii=False)
+            resp.data = body
+
+    def build_report(self, orders_ids, **filters):
+        if REPORT_BACKEND == 'numpy':
+            rows = bom.engine.report_orders_ingredients(orders_ids, **filters)
+        else:
+            rows = Order.report_ingredients(orders_ids, **filters)
+
+        report_data = [
+            dict(
+                ingredient_id=ingredient.id,
+                ingredient=ingredient,
+                total=float(total),
+            ) for ingredient, total in rows
+        ]
+        report = ORDER_INGREDIENTS_REPORT_SERIALIZER.dump(report_data, many=True)
+        return codec.dumps(format_response(report))
+
+
+def _get_choice_param(req, name, choices, default):
+    value = req.get_param(name) or default
+    if value not in choices:
+        raise falcon.HTTPInvalidParam('Expected one of {}'.format(', '.join(sorted(choices))), name)
+    return value
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class OrderTimeseriesResource(object):
+    """The orders, units sold and revenue of each hour, day or week, served from the order lines store."""
+
+    query_budget = dict(GET=6)
+
+    @falcon.before(hooks.get_time_range)
+    def on_get(self, req, resp, time_range, *args, **kwargs):
+        interval = _get_choice_param(req, 'interval', order_lines.INTERVALS, 'day')
+
+        data = [
+            dict(start=start, orders=orders, units=units, revenue=revenue)
+            for start, orders, units, revenue in order_lines.store.timeseries(interval, **time_range)
+        ]
+
+        resp.status = falcon.HTTP_200
+        resp.data = codec.dumps(format_response(data))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class OrderProductsTimeseriesResource(object):
+    """The units sold and revenue of each product in each hour, day or week."""
+
+    query_budget = dict(GET=6)
+
+    @falcon.before(hooks.get_time_range)
+    def on_get(self, req, resp, time_range, *args, **kwargs):
+        interval = _get_choice_param(req, 'interval', order_lines.INTERVALS, 'day')
+
+        data = [
+            dict(start=start, product_id=product_id, units=units, revenue=revenue)
+            for start, product_id, units, revenue in order_lines.store.timeseries_products(interval, **time_range)
+        ]
+
+        resp.status = falcon.HTTP_200
+        resp.data = codec.dumps(format_response(data))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class OrderSlotsResource(object):
+    """The busiest hours of the day (or weekdays, monday being 0), by number of orders."""
+
+    query_budget = dict(GET=6)
+
+    @falcon.before(hooks.get_time_range)
+    def on_get(self, req, resp, time_range, *args, **kwargs):
+        slot = _get_choice_param(req, 'slot', order_lines.SLOTS, 'hour')
+
+        data = [
+            dict(slot=slot_idx, orders=orders, units=units, revenue=revenue)
+            for slot_idx, orders, units, revenue in order_lines.store.busiest_slots(slot, **time_range)
+        ]
+
+        resp.status = falcon.HTTP_200
+        resp.data = codec.dumps(format_response(data))
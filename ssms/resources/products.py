@@ -1,37 +1,56 @@
-import json
 from logging import getLogger
 
 import falcon
+from sqlalchemy.orm import selectinload
 
 from ssms import hooks
-from ssms.models import Product
+from ssms.app import REPORT_BACKEND
+from ssms.models import Ingredient, Product, ProductIngredient
 from ssms.schemas import ProductIngredientSchema, ProductIngredientsReportSchema, ProductSchema
-from ssms.util.response import format_error, format_errors, format_response
+from ssms.schemas.compiler import compile_schema
+from ssms.util import bom, bulk, code_cache, codec, report_cache
+from ssms.util.response import format_error, format_errors, format_response, stream_response
 
 logger = getLogger(__name__)
 
+# relationships dumped by the ProductSchema
+PRODUCT_EAGER_LOAD = (
+    selectinload(Product.ingredients).joinedload(ProductIngredient.ingredient),
+)
+
+# compiled dumps used by the read paths
+PRODUCT_SERIALIZER = compile_schema(ProductSchema)
+PRODUCT_INGREDIENTS_REPORT_SERIALIZER = compile_schema(ProductIngredientsReportSchema)
+
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class ProductListResource(object):
-    def on_get(self, req, resp, *args, **kwargs):
-        schema = ProductSchema()
-        products = Product.get_all()
+    model = Product
+    query_budget = dict(GET=4, POST=16)
+    eager_load = PRODUCT_EAGER_LOAD
 
-        data, errors = schema.dump(products, many=True)
+    @falcon.before(hooks.get_page)
+    @falcon.before(hooks.get_stream_format)
+    def on_get(self, req, resp, page, stream_format, *args, **kwargs):
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Product.iter_all(after=page['after'], options=self.eager_load),
+                            PRODUCT_SERIALIZER.dump)
+            return
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+        products, next_page = Product.get_page(options=self.eager_load, **page)
 
-        data = format_response(data)
+        data = PRODUCT_SERIALIZER.dump(products, many=True)
+
+        data = format_response(data, next=next_page)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_post(self, req, resp, *args, **kwargs):
         schema = ProductSchema()
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         data.pop('type', None)
 
@@ -43,36 +62,36 @@ class ProductListResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             product.save()
 
+            # reloaded with its ingredients, instead of lazy loading them one row at a time
+            product = Product.get_by_id(product.id, options=self.eager_load)
             data, errors = schema.dump(product)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 @falcon.before(hooks.get_product)
 class ProductDetailResource(object):
-    def on_get(self, res, resp, product, *args, **kwargs):
-        schema = ProductSchema()
-        data, errors = schema.dump(product)
+    query_budget = dict(GET=4, PUT=16, DELETE=13)
+    eager_load = PRODUCT_EAGER_LOAD
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+    def on_get(self, res, resp, product, *args, **kwargs):
+        data = PRODUCT_SERIALIZER.dump(product)
 
         data = format_response(data)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_put(self, req, resp, product, *args, **kwargs):
         schema = ProductSchema()
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         ingredients = data.pop('ingredients', None)
 
@@ -91,7 +110,7 @@ class ProductDetailResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         elif pi_errors:
             logger.error(pi_errors)
             pi_errors = [
@@ -99,50 +118,105 @@ class ProductDetailResource(object):
                 for key, value in pi_errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(pi_errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(pi_errors))
         else:
             if pi:
                 product.ingredients = pi
 
             product.save()
 
+            # reloaded, the commit expired the relationships loaded by the hook
+            product = Product.get_by_id(product.id, options=self.eager_load)
             data, errors = schema.dump(product)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
     def on_delete(self, req, resp, product, *args, **kwargs):
         schema = ProductSchema()
 
-        product.delete()
-
+        # dumped before the commit expires the loaded relationships
         data, errors = schema.dump(product)
 
+        product.delete()
+
         resp.status = falcon.HTTP_200
 
-        resp.body = json.dumps(format_response(data), ensure_ascii=False)
+        resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class ProductIngredientsReportResource(object):
-    def on_get(self, req, resp, *args, **kwargs):
-        schema = ProductIngredientsReportSchema()
+    query_budget = dict(GET=6)
+
+    report_dependencies = (ProductIngredient, Ingredient)
 
-        data = json.loads(req.stream.read(req.content_length or 0))
+    @falcon.before(hooks.get_stream_format)
+    def on_get(self, req, resp, stream_format, *args, **kwargs):
+        data = codec.loads(req.stream.read(req.content_length or 0))
+
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Product.report_ingredients(data, stream=True),
+                            lambda row: PRODUCT_INGREDIENTS_REPORT_SERIALIZER.dump(dict(
+                                ingredient_id=row[0].id,
+                                ingredient=row[0],
+                                total=float(row[1]),
+                            )))
+            return
 
         try:
-            report_data = [
-                dict(
-                    ingredient_id=ingredient.id,
-                    ingredient=ingredient,
-                    total=float(total),
-                ) for ingredient, total in Product.report_ingredients(data)
-            ]
-            report, errors = schema.dump(report_data, many=True)
+            body = report_cache.get_report('products/ingredients', data, self.report_dependencies, self.build_report)
         except Exception as e:
             logger.error(e)
             resp.status = falcon.HTTP_500
         else:
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(report), ensure_ascii=False)
+            resp.data = body
+
+    def build_report(self, products_ids):
+        if REPORT_BACKEND == 'numpy':
+            rows = bom.engine.report_products_ingredients(products_ids)
+        else:
+            rows = Product.report_ingredients(products_ids)
+
+        report_data = [
+            dict(
+                ingredient_id=ingredient.id,
+                ingredient=ingredient,
+                total=float(total),
+            ) for ingredient, total in rows
+        ]
+        report = PRODUCT_INGREDIENTS_REPORT_SERIALIZER.dump(report_data, many=True)
+        return codec.dumps(format_response(report))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ProductCodeResource(object):
+    """The products looked up by code, `code/{code}` or `code?codes=A,B` for several of them."""
+
+    query_budget = dict(GET=4)
+    eager_load = PRODUCT_EAGER_LOAD
+    cache = code_cache.register('products', (Product, ProductIngredient, Ingredient))
+
+    @falcon.before(hooks.get_codes)
+    def on_get(self, req, resp, codes, code=None, *args, **kwargs):
+        items = code_cache.get_items(self.cache, Product, codes, PRODUCT_SERIALIZER.dump, options=self.eager_load)
+        code_cache.send_items(resp, items, codes, many=code is None)
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ProductBulkResource(object):
+    query_budget = dict(POST=13)
+
+    @falcon.before(hooks.get_bulk_items)
+    def on_post(self, req, resp, items, *args, **kwargs):
+        loaded, errors = bulk.load_items(ProductSchema(), items)
+
+        bulk.check_references(loaded, errors, 'ingredients',
+                              lambda product: [pi.ingredient_id for pi in product.ingredients], Ingredient)
+
+        bulk.create(resp, Product, loaded, errors, PRODUCT_SERIALIZER.dump)
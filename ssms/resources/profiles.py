@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import falcon
+
+from ssms import hooks
+from ssms.util import codec, profiling, sampler
+from ssms.util.response import format_response
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ProfileListResource(object):
+    """The profiles of the requests sent with the X-SSMS-Profile header, the newest first."""
+
+    query_budget = dict(GET=3)
+
+    def on_get(self, req, resp, *args, **kwargs):
+        data = [
+            dict(name=name, size=size, created=datetime.utcfromtimestamp(modified))
+            for name, size, modified in profiling.get_store().list_files()
+        ]
+
+        resp.status = falcon.HTTP_200
+        resp.data = codec.dumps(format_response(data))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ProfileDetailResource(object):
+    """Downloads a profile, in the pstats format."""
+
+    query_budget = dict(GET=3)
+
+    def on_get(self, req, resp, name, *args, **kwargs):
+        try:
+            resp.stream, resp.stream_len = profiling.get_store().open(name)
+        except IOError:
+            raise falcon.HTTPError(falcon.HTTP_404)
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = profiling.CONTENT_TYPE
+        resp.set_header('Content-Disposition', 'attachment; filename="{}"'.format(name))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ProfileSamplesResource(object):
+    """The folded stacks sampled by the worker serving the request, the input of flamegraph.pl or speedscope.
+
+    The headers hold the number of samples and the share of the time spent sampling.
+    """
+
+    query_budget = dict(GET=3, DELETE=3)
+
+    def on_get(self, req, resp, *args, **kwargs):
+        stack_sampler = _get_sampler()
+        stats = stack_sampler.stats()
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = 'text/plain; charset=UTF-8'
+        resp.set_header('X-SSMS-Samples', str(stats['samples']))
+        resp.set_header('X-SSMS-Sampling-Overhead', '{:.5f}'.format(stats['overhead']))
+        resp.data = stack_sampler.folded().encode()
+
+    def on_delete(self, req, resp, *args, **kwargs):
+        """Drops the samples taken so far."""
+        _get_sampler().reset()
+
+        resp.status = falcon.HTTP_204
+
+
+def _get_sampler():
+    stack_sampler = sampler.get_sampler()
+    if stack_sampler is None:
+        raise falcon.HTTPError(falcon.HTTP_404, 'Sampling disabled',
+                               'The sampling profiler only runs with SAMPLING_RATE set')
+    return stack_sampler
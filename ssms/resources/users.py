@@ -1,58 +1,71 @@
-import json
 from logging import getLogger
 
 import falcon
+from sqlalchemy.orm import selectinload
 
 from ssms import hooks
-from ssms.models import Admin, Client
+from ssms.models import Admin, Client, Order
 from ssms.schemas import AdminSchema, ClientSchema, UserSchema
-from ssms.util.response import format_error, format_errors, format_response
+from ssms.schemas.compiler import compile_schema
+from ssms.util import code_cache, codec
+from ssms.util.response import format_error, format_errors, format_response, stream_response
 
 logger = getLogger(__name__)
 
+# relationships deleted along with a client, loaded at once instead of order by order
+CLIENT_DELETE_LOAD = (
+    selectinload(Client.orders).selectinload(Order.products),
+)
+
+# compiled dumps used by the read paths
+USER_SERIALIZER = compile_schema(UserSchema)
+ADMIN_SERIALIZER = compile_schema(AdminSchema)
+CLIENT_SERIALIZER = compile_schema(ClientSchema)
+
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_user)
 class UsersListResource(object):
+    query_budget = dict(GET=3)
 
     def on_get(self, req, resp, *args, **kwargs):
         user = req.user
-        schema = UserSchema()
-        schema.context['remove_fields'] = ['seed', 'password']
 
-        data, errors = schema.dump(user)
-
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+        data = USER_SERIALIZER.dump(user, context=dict(remove_fields=['seed', 'password']))
 
         data = format_response(data)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class AdminListResource(object):
+    model = Admin
+    query_budget = dict(GET=3, POST=6)
 
-    def on_get(self, req, resp):
-        admins = Admin.get_all()
-        schema = AdminSchema()
-        schema.context['remove_fields'] = ['seed', 'password']
-        data, errors = schema.dump(admins, many=True)
+    @falcon.before(hooks.get_page)
+    @falcon.before(hooks.get_stream_format)
+    def on_get(self, req, resp, page, stream_format):
+        context = dict(remove_fields=['seed', 'password'])
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Admin.iter_all(after=page['after']),
+                            lambda admin: ADMIN_SERIALIZER.dump(admin, context=context))
+            return
 
-        data = format_response(data)
+        admins, next_page = Admin.get_page(**page)
+        data = ADMIN_SERIALIZER.dump(admins, many=True, context=context)
+
+        data = format_response(data, next=next_page)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_post(self, req, resp):
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         schema = AdminSchema()
 
@@ -64,7 +77,7 @@ class AdminListResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             admin.set_password(admin.password)
             admin.save()
@@ -73,29 +86,36 @@ class AdminListResource(object):
             data, errors = schema.dump(admin)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.require_admin)
 class ClientListResource(object):
-    def on_get(self, req, resp):
-        users = Client.get_all()
-        schema = ClientSchema()
-        schema.context['remove_fields'] = ['seed', 'password']
-        data, errors = schema.dump(users, many=True)
+    model = Client
+    query_budget = dict(GET=3, POST=6)
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+    @falcon.before(hooks.get_page)
+    @falcon.before(hooks.get_stream_format)
+    def on_get(self, req, resp, page, stream_format):
+        context = dict(remove_fields=['seed', 'password'])
 
-        data = format_response(data)
+        if stream_format:
+            stream_response(resp, stream_format,
+                            lambda: Client.iter_all(after=page['after']),
+                            lambda client: CLIENT_SERIALIZER.dump(client, context=context))
+            return
+
+        users, next_page = Client.get_page(**page)
+        data = CLIENT_SERIALIZER.dump(users, many=True, context=context)
+
+        data = format_response(data, next=next_page)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_post(self, req, resp):
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         schema = ClientSchema()
 
@@ -107,7 +127,7 @@ class ClientListResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             user.set_password(user.password)
             user.save()
@@ -116,30 +136,25 @@ class ClientListResource(object):
             data, errors = schema.dump(user)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
 
 @falcon.before(hooks.require_auth)
 @falcon.before(hooks.get_client)
 @falcon.before(hooks.require_admin)
 class ClientDetailResource(object):
-    def on_get(self, req, resp, client, *args, **kwargs):
-        schema = ClientSchema()
-        schema.context['remove_fields'] = ['seed', 'password']
-
-        data, errors = schema.dump(client)
+    query_budget = dict(GET=3, PUT=7, DELETE=15)
 
-        if errors:
-            logger.error(errors)
-            raise falcon.HTTPInternalServerError()
+    def on_get(self, req, resp, client, *args, **kwargs):
+        data = CLIENT_SERIALIZER.dump(client, context=dict(remove_fields=['seed', 'password']))
 
         data = format_response(data)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(data, ensure_ascii=False)
+        resp.data = codec.dumps(data)
 
     def on_put(self, req, resp, client, *args, **kwargs):
-        data = json.loads(req.stream.read(req.content_length or 0))
+        data = codec.loads(req.stream.read(req.content_length or 0))
 
         schema = ClientSchema()
 
@@ -151,7 +166,7 @@ class ClientDetailResource(object):
                 for key, value in errors.items()
             ]
             resp.status = falcon.HTTP_400
-            resp.body = json.dumps(format_errors(errors), ensure_ascii=False)
+            resp.data = codec.dumps(format_errors(errors))
         else:
             client.save()
 
@@ -159,11 +174,12 @@ class ClientDetailResource(object):
             data, errors = schema.dump(client)
 
             resp.status = falcon.HTTP_200
-            resp.body = json.dumps(format_response(data), ensure_ascii=False)
+            resp.data = codec.dumps(format_response(data))
 
     def on_delete(self, req, resp, client, *args, **kwargs):
         schema = ClientSchema()
 
+        client = Client.get_by_id(client.id, options=CLIENT_DELETE_LOAD)
         client.delete()
 
         schema.context['remove_fields'] = ['seed', 'password']
@@ -171,4 +187,20 @@ class ClientDetailResource(object):
 
         resp.status = falcon.HTTP_200
 
-        resp.body = json.dumps(format_response(data), ensure_ascii=False)
+        resp.data = codec.dumps(format_response(data))
+
+
+@falcon.before(hooks.require_auth)
+@falcon.before(hooks.require_admin)
+class ClientCodeResource(object):
+    """The clients looked up by code, `code/{code}` or `code?codes=A,B` for several of them."""
+
+    query_budget = dict(GET=3)
+    cache = code_cache.register('clients', (Client,))
+
+    @falcon.before(hooks.get_codes)
+    def on_get(self, req, resp, codes, code=None, *args, **kwargs):
+        context = dict(remove_fields=['seed', 'password'])
+        items = code_cache.get_items(self.cache, Client, codes,
+                                     lambda client: CLIENT_SERIALIZER.dump(client, context=context))
+        code_cache.send_items(resp, items, codes, many=code is None)
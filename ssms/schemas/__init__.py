@@ -1,9 +1,12 @@
+import json
+
 from marshmallow import Schema as BaseSchema, fields, post_load, post_dump
 from marshmallow_enum import EnumField
 
 from sqlalchemy import inspect
 
 from ssms.models.enums import UsersEnum
+from ssms.util.request_stats import timed_serialization
 
 
 class Schema(BaseSchema):
@@ -27,6 +30,10 @@ class Schema(BaseSchema):
 
         return result, errors
 
+    @timed_serialization
+    def dump(self, obj, **kwargs):
+        return super(Schema, self).dump(obj, **kwargs)
+
 
 class UserSchema(Schema):
     id = fields.Integer(allow_none=True, dump_only=True)
@@ -128,6 +135,18 @@ class OrderSchema(Schema):
         return Order(**data)
 
 
+class ImportJobSchema(Schema):
+    id = fields.Integer(dump_only=True)
+    resource = fields.String(dump_only=True)
+    format = fields.String(dump_only=True)
+    status = fields.String(dump_only=True)
+    processed = fields.Integer(dump_only=True)
+    inserted = fields.Integer(dump_only=True)
+    rejected = fields.Integer(dump_only=True)
+    errors = fields.Function(lambda job: json.loads(job.errors or '[]'), dump_only=True)
+    message = fields.String(dump_only=True, allow_none=True)
+
+
 class OrderProductsReportSchema(BaseSchema):
     product_id = fields.Integer()
     product = fields.Nested(ProductSchema)
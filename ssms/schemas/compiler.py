@@ -0,0 +1,225 @@
+"""Compiles marshmallow schemas into plain python dump functions.
+
+The compiled functions return exactly what `Schema.dump(...).data` returns for
+valid data (same keys, key order, values and post_dump processing), without
+the generic per-field machinery of marshmallow. They are meant for the read
+paths, the writes keep using the schemas to load and validate the data.
+
+Only the dump side of the schemas is compiled, schemas with pre_dump processors
+or a custom `get_attribute` are not supported.
+"""
+from marshmallow import Schema, fields, utils
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+from ssms.util.request_stats import timed_serialization
+
+_missing = utils.missing
+
+_ISO_FORMATS = ('iso', 'iso8601')
+
+
+class _ProcessorSelf(object):
+    """Stands for the schema instance when its processors are called, holding
+    the context of the current dump instead of the schema one.
+    """
+    __slots__ = ('_schema', 'context')
+
+    def __init__(self, schema, context):
+        self._schema = schema
+        self.context = context
+
+    def __getattr__(self, name):
+        return getattr(self._schema, name)
+
+
+def _get_value(obj, key, default):
+    # same as marshmallow.utils.get_value, skipping the failed item lookup on
+    # objects that can't be subscripted (e.g. the models)
+    if hasattr(obj, '__getitem__'):
+        return utils.get_value(obj, key, default)
+    return getattr(obj, key, default)
+
+
+class CompiledSchema(object):
+    def __init__(self, schema, dump_one, dump_many):
+        self.schema = schema
+        self._dump_one = dump_one
+        self._dump_many = dump_many
+
+    @timed_serialization
+    def dump(self, obj, many=False, context=None):
+        """Serializes `obj`, returns the same data as `self.schema.dump(obj, many).data`.
+
+        Args:
+            obj: The object, or the iterable of objects, to serialize.
+            many: Whether `obj` is a collection.
+            context: The schema context, shared by all the nested schemas.
+        """
+        context = context or {}
+        if many:
+            return self._dump_many(obj, context)
+        return self._dump_one(obj, context)
+
+
+class _Compiler(object):
+    def __init__(self):
+        self.namespace = dict(
+            _missing=_missing,
+            _get_value=_get_value,
+            _dotted_get_value=utils.get_value,
+            _if_none=utils.if_none,
+            _ensure_text_type=utils.ensure_text_type,
+            _isoformat=utils.isoformat,
+            _ProcessorSelf=_ProcessorSelf,
+            _bool=bool,
+            _str=str,
+        )
+        self.lines = []
+        self.counter = 0
+
+    def name(self, prefix, value=None):
+        name = '_{}_{}'.format(prefix, self.counter)
+        self.counter += 1
+        if value is not None:
+            self.namespace[name] = value
+        return name
+
+    def compile(self, schema):
+        """Returns the names of the (one, many) dump functions of the schema."""
+        schema_class = type(schema)
+        if schema_class.get_attribute is not Schema.get_attribute:
+            raise ValueError('{} defines a custom get_attribute'.format(schema_class.__name__))
+        if schema._has_processors and (schema.__processors__[(PRE_DUMP, False)] or
+                                       schema.__processors__[(PRE_DUMP, True)]):
+            raise ValueError('{} defines pre_dump processors'.format(schema_class.__name__))
+
+        schema_name = self.name('schema', schema)
+        accessor_name = self.name('accessor', schema.get_attribute)
+
+        body = []
+        for attr_name, field in schema.fields.items():
+            if getattr(field, 'load_only', False):
+                continue
+            key = ''.join([schema.prefix or '', field.dump_to or attr_name])
+            body.extend(self.compile_field(attr_name, key, field, accessor_name))
+
+        one_name = self.name('dump_one')
+        many_name = self.name('dump_many')
+
+        lines = [
+            'def {}(obj, ctx):'.format(one_name),
+            '    data = {}',
+        ]
+        lines.extend('    ' + line for line in body)
+        lines.extend('    ' + line for line in self.compile_processors(schema, schema_name, pass_many=False))
+        lines.append('    return data')
+
+        lines.extend([
+            '',
+            'def {}(objs, ctx):'.format(many_name),
+            '    data = [{}(obj, ctx) for obj in objs]'.format(one_name),
+        ])
+        lines.extend('    ' + line for line in self.compile_processors(schema, schema_name, pass_many=True))
+        lines.append('    return data')
+
+        self.lines.extend(lines + ['', ''])
+        return one_name, many_name
+
+    def compile_processors(self, schema, schema_name, pass_many):
+        if not schema._has_processors:
+            return []
+
+        attr_names = schema.__processors__[(POST_DUMP, pass_many)]
+        if not attr_names:
+            return []
+
+        lines = ['self = _ProcessorSelf({}, ctx)'.format(schema_name)]
+        for attr_name in attr_names:
+            processor = getattr(schema, attr_name)
+            processor_kwargs = processor.__marshmallow_kwargs__[(POST_DUMP, pass_many)]
+            processor_name = self.name('processor', getattr(type(schema), attr_name))
+
+            args = ['self', 'data']
+            if pass_many:
+                args.append('True')
+            if processor_kwargs.get('pass_original', False):
+                args.append('objs' if pass_many else 'obj')
+
+            lines.append('data = _if_none({}({}), data)'.format(processor_name, ', '.join(args)))
+        return lines
+
+    def compile_field(self, attr_name, key, field, accessor_name):
+        field_name = self.name('field', field)
+        attribute = field.attribute or attr_name
+
+        expression = self.compile_value(attr_name, field, field_name)
+        if expression is None or not field._CHECK_ATTRIBUTE:
+            # the generic marshmallow path
+            return [
+                'value = {}.serialize({!r}, obj, accessor={})'.format(field_name, attr_name, accessor_name),
+                'if value is not _missing:',
+                '    data[{!r}] = value'.format(key),
+            ]
+
+        getter = '_dotted_get_value' if '.' in attribute else '_get_value'
+        lines = [
+            'value = {}(obj, {!r}, _missing)'.format(getter, attribute),
+            'if value is not _missing:',
+            '    data[{!r}] = {}'.format(key, expression),
+        ]
+        if field.default is not _missing:
+            default_name = self.name('default', field.default)
+            lines.extend([
+                'else:',
+                '    data[{!r}] = {}'.format(key, default_name + '()' if callable(field.default) else default_name),
+            ])
+        return lines
+
+    def compile_value(self, attr_name, field, field_name):
+        """Returns the expression serializing `value`, None to use the generic path."""
+        field_type = type(field)
+        fallback = '{}._serialize(value, {!r}, obj)'.format(field_name, attr_name)
+
+        if field_type in (fields.Integer, fields.Float):
+            if field.as_string or getattr(field, 'strict', False):
+                return None
+            num_type_name = self.name('num_type', field.num_type)
+            # booleans are rejected by marshmallow, let the field fail
+            return 'None if value is None else ({}(value) if value.__class__ is not _bool else {})'.format(
+                num_type_name, fallback)
+
+        if field_type is fields.String:
+            return 'None if value is None else (value if value.__class__ is _str else _ensure_text_type(value))'
+
+        if field_type is fields.DateTime:
+            if (field.dateformat or field.DEFAULT_FORMAT) not in _ISO_FORMATS or field.localtime:
+                return None
+            return 'None if value is None else _isoformat(value)'
+
+        if field_type is fields.Nested:
+            if isinstance(field.only, str):
+                return None
+            one_name, many_name = self.compile(field.schema)
+            return 'None if value is None else {}(value, ctx)'.format(many_name if field.many else one_name)
+
+        return fallback
+
+
+def compile_schema(schema_class):
+    """Compiles the dump of a marshmallow schema.
+
+    Args:
+        schema_class: The schema class, all its nested schemas are compiled too.
+
+    Returns:
+        A `CompiledSchema`.
+    """
+    schema = schema_class()
+
+    compiler = _Compiler()
+    one_name, many_name = compiler.compile(schema)
+
+    source = '\n'.join(compiler.lines)
+    exec(compile(source, '<compiled {}>'.format(schema_class.__name__), 'exec'), compiler.namespace)
+
+    return CompiledSchema(schema, compiler.namespace[one_name], compiler.namespace[many_name])
@@ -1,7 +1,21 @@
+import time
+
 import jwt
 
 from datetime import datetime, timedelta
 
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from ssms.app import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+from ssms.util.cache import TTLCache
+
+# the data of the tokens already decoded, kept until the token expires
+tokens = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+# (User data version, detached copy) of the authenticated users, by email
+users = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
 
 def encode(data):
     from ssms.app import JWT_ALGORITHM, JWT_SECRET_KEY
@@ -12,7 +26,56 @@ def encode(data):
     return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
 
-def decode(data):
+def _decode_payload(data):
     from ssms.app import JWT_ALGORITHM, JWT_SECRET_KEY
-    payload = jwt.decode(data, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM, ])
+    return jwt.decode(data, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM, ])
+
+
+def decode(data):
+    payload = _decode_payload(data)
     return payload.get('data', None)
+
+
+def decode_cached(data):
+    """Same as `decode`, the result is cached until the token expires."""
+    token_data = tokens.get(data)
+    if token_data is None:
+        payload = _decode_payload(data)
+        token_data = payload.get('data', None)
+        if token_data is not None:
+            tokens.set(data, token_data, ttl=payload['exp'] - time.time())
+    return token_data
+
+
+def get_cached_user(email, version):
+    """Returns the detached copy of the user, None if it isn't cached under the given `User` data version."""
+    cached = users.get(email)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    return None
+
+
+def cache_user(user, version):
+    """Caches a detached copy of the user, holding only its column attributes.
+
+    Args:
+        user: The user to cache.
+        version: The `User` data version read before the user was loaded.
+    """
+    mapper = inspect(user).mapper
+    copy = mapper.class_(**{
+        attr.key: getattr(user, attr.key)
+        for attr in mapper.column_attrs
+    })
+    make_transient_to_detached(copy)
+    users.set(user.email, (version, copy))
+
+
+def invalidate_user(*emails):
+    """Drops the cached users of this process, meant to be called when they are updated or deleted.
+
+    The other processes drop theirs on the next lookup, the data version of
+    the write no longer matching.
+    """
+    for email in emails:
+        users.invalidate(email)
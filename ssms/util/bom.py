@@ -0,0 +1,243 @@
+"""Bill of materials engine, the NumPy backend of the ingredients reports.
+
+The recipes are kept in memory as a sparse product x ingredient matrix, in
+coordinate format (one entry per `ProductIngredient`), and the requirements of
+a batch are the product of the matrix by the vector of the products amounts.
+
+The matrix is checked against the `ProductIngredient` data version on every
+call. When all the versions since the last check were written by this process
+only the products whose recipes changed are reloaded, otherwise the whole
+matrix is. A published matrix is never changed, the threads of the worker read
+it without locking: the refreshes build a new one and swap it in.
+
+NumPy is only imported when the engine is used.
+"""
+import threading
+
+from ssms import app
+
+# the recipe changes kept while waiting for a sync, past it the matrix is rebuilt
+_MAX_PENDING_CHANGES = 1024
+
+
+class RecipeMatrix(object):
+    """The product x ingredient matrix of the recipe amounts."""
+
+    def __init__(self, recipes=None):
+        import numpy
+
+        self._np = numpy
+        self._recipes = dict(recipes or {})
+        self._entries = None
+
+    def __len__(self):
+        return sum(len(ingredients) for ingredients, amounts in self._recipes.values())
+
+    def copy(self):
+        """Returns a new matrix with the same recipes, to be changed instead of this one."""
+        return RecipeMatrix(self._recipes)
+
+    def set_recipes(self, products_ids, rows):
+        """Replaces the recipes of the given products, only before the matrix is shared.
+
+        Args:
+            products_ids: The products to replace, the ones with no rows are removed.
+            rows: The (product_id, ingredient_id, amount) of the new recipes.
+        """
+        np = self._np
+
+        recipes = {product_id: ([], []) for product_id in products_ids}
+        for product_id, ingredient_id, amount in rows:
+            ingredients, amounts = recipes.setdefault(product_id, ([], []))
+            ingredients.append(ingredient_id)
+            amounts.append(amount)
+
+        for product_id, (ingredients, amounts) in recipes.items():
+            if ingredients:
+                self._recipes[product_id] = (np.array(ingredients, dtype=np.int64),
+                                             np.array(amounts, dtype=np.float64))
+            else:
+                self._recipes.pop(product_id, None)
+
+        self._entries = None
+
+    def _get_entries(self):
+        # the (product index, ingredient id, amount) columns of all the entries
+        if self._entries is None:
+            np = self._np
+
+            products_ids = list(self._recipes)
+            recipes = [self._recipes[product_id] for product_id in products_ids]
+            sizes = [len(ingredients) for ingredients, amounts in recipes]
+
+            self._entries = (
+                {product_id: idx for idx, product_id in enumerate(products_ids)},
+                np.repeat(np.arange(len(products_ids), dtype=np.int64), sizes),
+                np.concatenate([ingredients for ingredients, amounts in recipes] or [np.zeros(0, np.int64)]),
+                np.concatenate([amounts for ingredients, amounts in recipes] or [np.zeros(0)]),
+            )
+        return self._entries
+
+    def requirements(self, demand):
+        """Returns the [(ingredient_id, total)...] needed by the products amounts, sorted by ingredient.
+
+        Args:
+            demand: The [(product_id, amount)...] of the batch. Every ingredient
+                of the given products is returned, even if its total is zero.
+        """
+        np = self._np
+
+        products_index, products, ingredients, amounts = self._get_entries()
+
+        vector = np.zeros(len(products_index), dtype=np.float64)
+        present = np.zeros(len(products_index), dtype=bool)
+        for product_id, amount in demand:
+            idx = products_index.get(product_id)
+            if idx is not None:
+                vector[idx] += amount
+                present[idx] = True
+
+        mask = present[products]
+        ingredients_ids, positions = np.unique(ingredients[mask], return_inverse=True)
+        totals = np.bincount(positions, weights=amounts[mask] * vector[products[mask]],
+                             minlength=len(ingredients_ids))
+
+        return list(zip(ingredients_ids.tolist(), totals.tolist()))
+
+
+class BillOfMaterials(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._version = None
+        # {version: products ids} of the recipe writes committed by this process
+        self._changes = {}
+
+    def record_changes(self, changes):
+        """Records the recipes written by a transaction of this process, with their data versions."""
+        with self._lock:
+            if self._matrix is None:
+                return
+            for version, products_ids in changes:
+                self._changes.setdefault(version, set()).update(products_ids)
+            if len(self._changes) > _MAX_PENDING_CHANGES:
+                self._matrix = None
+                self._changes = {}
+
+    def get_matrix(self):
+        """Returns the recipe matrix, up to date with the committed recipes."""
+        from ssms.models import DataVersion, ProductIngredient
+        from ssms.database import session
+
+        query = session().query(ProductIngredient.product_id, ProductIngredient.ingredient_id,
+                                ProductIngredient.amount)
+
+        # the recipes written by the current transaction aren't shared until the commit
+        if DataVersion.is_pending([ProductIngredient]):
+            matrix = RecipeMatrix()
+            matrix.set_recipes((), query)
+            return matrix
+
+        version, = DataVersion.get_versions([ProductIngredient])
+
+        with self._lock:
+            if self._matrix is not None and version == self._version:
+                return self._matrix
+
+            missing = [v for v in range(self._version + 1, version + 1) if v not in self._changes] \
+                if self._matrix is not None and self._version < version else None
+
+            # copy on write, the current matrix may be in use by other threads
+            if missing == []:
+                products_ids = set()
+                for v in range(self._version + 1, version + 1):
+                    products_ids.update(self._changes[v])
+                matrix = self._matrix.copy()
+                matrix.set_recipes(products_ids, query.filter(ProductIngredient.product_id.in_(products_ids)))
+            else:
+                matrix = RecipeMatrix()
+                matrix.set_recipes((), query)
+
+            # built before the matrix is published, so the readers never write to it
+            matrix._get_entries()
+            self._matrix = matrix
+
+            self._version = version
+            self._changes = {v: products_ids for v, products_ids in self._changes.items() if v > version}
+            return self._matrix
+
+    def report_ingredients(self, demand, options=()):
+        """Returns the [(Ingredient, total)...] needed by the products amounts, like the SQL reports."""
+        from ssms.models import Ingredient
+        from ssms.database import session
+
+        requirements = self.get_matrix().requirements(demand)
+        if not requirements:
+            return []
+
+        ingredients = session().query(Ingredient).options(*options) \
+            .filter(Ingredient.id.in_([ingredient_id for ingredient_id, total in requirements]))
+        ingredients = {ingredient.id: ingredient for ingredient in ingredients}
+
+        return [(ingredients[ingredient_id], total) for ingredient_id, total in requirements
+                if ingredient_id in ingredients]
+
+    def report_orders_ingredients(self, orders_ids, options=(), start=None, end=None, clients_ids=None,
+                                  products_ids=None):
+        """Same as `Order.report_ingredients`."""
+        from ssms.models import Order, OrderProduct
+        from ssms.database import session
+        from sqlalchemy import func
+
+        demand = session().query(OrderProduct.product_id, func.sum(OrderProduct.amount)) \
+            .filter(*Order.filter_orders(OrderProduct.order_id, orders_ids, start, end, clients_ids))
+        if products_ids is not None:
+            demand = demand.filter(OrderProduct.product_id.in_(products_ids))
+        demand = demand.group_by(OrderProduct.product_id)
+
+        return self.report_ingredients(list(demand), options)
+
+    def report_products_ingredients(self, products_ids, options=()):
+        """Same as `Product.report_ingredients`."""
+        return self.report_ingredients([(product_id, 1) for product_id in set(products_ids)], options)
+
+
+engine = BillOfMaterials()
+
+
+def _record_recipe_changes(db_session, flush_context):
+    from ssms.models import ProductIngredient, _changed_values
+
+    products_ids = set()
+    for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+        if isinstance(obj, ProductIngredient):
+            products_ids.update(_changed_values(obj, 'product_id'))
+
+    if products_ids:
+        version = db_session.info['data_versions'][ProductIngredient.__tablename__]
+        db_session.info.setdefault('recipe_changes', []).append((version, products_ids))
+
+
+def _commit_recipe_changes(db_session):
+    changes = db_session.info.pop('recipe_changes', None)
+    if changes:
+        engine.record_changes(changes)
+
+
+def _discard_recipe_changes(db_session, *args):
+    db_session.info.pop('recipe_changes', None)
+
+
+def register_listeners():
+    """Tracks the recipe writes of the sessions, for the incremental refreshes of the matrix."""
+    from sqlalchemy import event
+
+    # the models listeners, which bump the data versions, must run first
+    import ssms.models  # noqa: F401
+
+    event.listen(app.Session, 'after_flush', _record_recipe_changes)
+    event.listen(app.Session, 'after_commit', _commit_recipe_changes)
+    event.listen(app.Session, 'after_rollback', _discard_recipe_changes)
+
+
+register_listeners()
@@ -0,0 +1,128 @@
+"""The bulk creation of the items of a list, used by the /bulk resources.
+
+Every item is validated on its own and the valid ones are inserted together
+with `Base.bulk_create`, in one transaction. The response holds one result per
+item, in the same order, either its data or its errors.
+"""
+import falcon
+from sqlalchemy import event
+
+from ssms import app
+from ssms.database import session
+from ssms.util import codec
+from ssms.util.response import format_error, format_response
+
+
+def field_errors(errors, prefix=''):
+    """Flattens the marshmallow errors of an item into a list of `format_error`."""
+    formatted = []
+    for key, value in errors.items():
+        field = '{}{}'.format(prefix, key)
+        if isinstance(value, dict):
+            formatted.extend(field_errors(value, field + '.'))
+        else:
+            formatted.append(format_error('missing-field', ' '.join(value), dict(field=field)))
+    return formatted
+
+
+def load_items(schema, items):
+    """Validates the items one by one.
+
+    Returns:
+        The ({index: loaded item}, {index: errors}) of the items.
+    """
+    loaded, errors = {}, {}
+    for idx, data in enumerate(items):
+        if not isinstance(data, dict):
+            errors[idx] = [format_error('invalid-item', 'Expected an object', dict())]
+            continue
+
+        data.pop('type', None)
+        item, item_errors = schema.load(data)
+        if item_errors:
+            errors[idx] = field_errors(item_errors)
+        else:
+            loaded[idx] = item
+    return loaded, errors
+
+
+def check_references(loaded, errors, field, get_ids, model, options=()):
+    """Rejects the loaded items referencing missing rows of `model`.
+
+    The referenced rows are loaded in a single query (with the given loader
+    options), so they are in the identity map when the items are dumped. The
+    identity map only holds them weakly, the session info keeps them until the
+    transaction ends.
+
+    Args:
+        loaded: The {index: loaded item}, the rejected ones are moved to `errors`.
+        errors: The {index: errors}.
+        field: The field reported in the errors.
+        get_ids: A callable returning the ids referenced by an item.
+        model: The referenced model.
+        options: The loader options of the referenced rows.
+    """
+    ids = {item_id for item in loaded.values() for item_id in get_ids(item)}
+    found = set()
+    if ids:
+        rows = session().query(model).options(*options).filter(model.id.in_(ids)).all()
+        session().info.setdefault('referenced_rows', []).extend(rows)
+        found = {row.id for row in rows}
+
+    for idx, item in list(loaded.items()):
+        missing = sorted(item_id for item_id in get_ids(item) if item_id not in found)
+        if missing:
+            del loaded[idx]
+            errors[idx] = [format_error('not-found', 'Unknown {} {}'.format(
+                model.__tablename__, ', '.join(map(str, missing))), dict(field=field))]
+
+
+def create_items(model, loaded, errors, dump):
+    """Inserts the loaded items and commits.
+
+    Returns:
+        The results of all the items, in order, as dict(data=...) or dict(errors=...).
+    """
+    items = [loaded[idx] for idx in sorted(loaded)]
+    model.bulk_create(items)
+
+    # dumped before the commit expires them
+    results = {idx: dict(data=dump(item)) for idx, item in zip(sorted(loaded), items)}
+    session().commit()
+
+    results.update((idx, dict(errors=item_errors)) for idx, item_errors in errors.items())
+    return [results[idx] for idx in sorted(results)]
+
+
+def send_results(resp, results):
+    """Writes the results, the status is 207 when only some of the items were created."""
+    failed = sum(1 for result in results if 'errors' in result)
+
+    if not failed:
+        resp.status = falcon.HTTP_200
+    elif failed < len(results):
+        resp.status = falcon.HTTP_207
+    else:
+        resp.status = falcon.HTTP_400
+    resp.data = codec.dumps(format_response(results, created=len(results) - failed, rejected=failed))
+
+
+def create(resp, model, loaded, errors, dump):
+    """Creates the loaded items, if any, and sends the results of all of them."""
+    if loaded:
+        results = create_items(model, loaded, errors, dump)
+    else:
+        results = [dict(errors=errors[idx]) for idx in sorted(errors)]
+    send_results(resp, results)
+
+
+def _release_referenced_rows(db_session, *args):
+    db_session.info.pop('referenced_rows', None)
+
+
+def register_listeners():
+    event.listen(app.Session, 'after_commit', _release_referenced_rows)
+    event.listen(app.Session, 'after_rollback', _release_referenced_rows)
+
+
+register_listeners()
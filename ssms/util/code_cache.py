@@ -0,0 +1,103 @@
+"""The in-process cache of the items looked up by code, e.g. read over the phone.
+
+Each resource registers a cache of its items as it dumps them, by code. The
+entries are kept for CODE_CACHE_TTL seconds. A commit writing any of the models
+a resource depends on drops all of its entries in the process which made it,
+the other processes see the change once their entries expire.
+"""
+import itertools
+from collections import OrderedDict
+
+import falcon
+from sqlalchemy import event
+
+from ssms import app
+from ssms.app import CODE_CACHE_SIZE, CODE_CACHE_TTL
+from ssms.util import codec
+from ssms.util.cache import TTLCache
+from ssms.util.response import format_response
+
+# the caches by resource name, with the tables they depend on
+caches = {}
+_dependencies = {}
+
+
+def register(name, dependencies):
+    """Returns the cache of a resource, dropped when any of the `dependencies` models is written."""
+    caches[name] = TTLCache(CODE_CACHE_SIZE, CODE_CACHE_TTL)
+    _dependencies[name] = frozenset(model.__table__.name for model in dependencies)
+    return caches[name]
+
+
+def get_items(cache, model, codes, dump, options=()):
+    """Returns the {code: dumped item} of the items with the codes, the missing ones are left out.
+
+    Args:
+        cache: The cache of the resource, see `register`.
+        model: The model looked up.
+        codes: The codes.
+        dump: A callable serializing an item.
+        options: The loader options of the items which aren't cached.
+    """
+    items, missing = {}, []
+    for code in codes:
+        data = cache.get(code)
+        if data is None:
+            missing.append(code)
+        else:
+            items[code] = data
+
+    if missing:
+        for code, item in model.get_by_codes(missing, options=options).items():
+            items[code] = dump(item)
+            cache.set(code, items[code])
+    return items
+
+
+def send_items(resp, items, codes, many):
+    """Writes the item of the code, or the items of the codes in order with the `missing` codes.
+
+    Raises:
+        HTTPError: A 404 if the single item isn't found.
+    """
+    if many:
+        codes = list(OrderedDict.fromkeys(codes))
+        data = format_response([items[code] for code in codes if code in items],
+                               missing=[code for code in codes if code not in items])
+    elif codes[0] in items:
+        data = format_response(items[codes[0]])
+    else:
+        raise falcon.HTTPError(falcon.HTTP_404)
+
+    resp.status = falcon.HTTP_200
+    resp.data = codec.dumps(data)
+
+
+def invalidate(tables):
+    for name, dependencies in _dependencies.items():
+        if dependencies & tables:
+            caches[name].clear()
+
+
+def _record_written_tables(db_session, flush_context):
+    db_session.info.setdefault('written_tables', set()).update(
+        obj.__table__.name for obj in itertools.chain(db_session.new, db_session.dirty, db_session.deleted))
+
+
+def _invalidate_written_tables(db_session):
+    tables = db_session.info.pop('written_tables', None)
+    if tables:
+        invalidate(tables)
+
+
+def _discard_written_tables(db_session, *args):
+    db_session.info.pop('written_tables', None)
+
+
+def register_listeners():
+    event.listen(app.Session, 'after_flush', _record_written_tables)
+    event.listen(app.Session, 'after_commit', _invalidate_written_tables)
+    event.listen(app.Session, 'after_rollback', _discard_written_tables)
+
+
+register_listeners()
@@ -0,0 +1,139 @@
+"""JSON encoding and decoding of the request and response bodies.
+
+The resources go through `dumps` and `loads` instead of the json module, so the
+backend can be swapped for a faster one. By default the fastest installed
+backend is used, the `JSON_BACKEND` setting forces one of the BACKENDS.
+
+`dumps` returns bytes, to be written straight to `resp.data`. Datetimes are
+written in iso format and enums as their value, whatever the backend.
+"""
+import enum
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from ssms.util.request_stats import timed_serialization
+
+# in order of preference
+BACKENDS = ('orjson', 'rapidjson', 'ujson', 'json')
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _json_codec():
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode()
+
+    return dumps, json.loads
+
+
+def _orjson_codec():
+    import orjson
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=option)
+
+    return dumps, orjson.loads
+
+
+def _rapidjson_codec():
+    import rapidjson
+
+    def dumps(obj):
+        return rapidjson.dumps(obj, ensure_ascii=False, default=_default).encode()
+
+    def loads(data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        return rapidjson.loads(data)
+
+    return dumps, loads
+
+
+def _ujson_codec():
+    import ujson
+
+    # the `default` hook only exists since ujson 5.4
+    try:
+        ujson.dumps(None, default=_default)
+    except TypeError:
+        raise ImportError('ujson>=5.4 is required')
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=_default).encode()
+
+    return dumps, ujson.loads
+
+
+_CODECS = {
+    'orjson': _orjson_codec,
+    'rapidjson': _rapidjson_codec,
+    'ujson': _ujson_codec,
+    'json': _json_codec,
+}
+
+backend = None
+_dumps = _loads = None
+
+
+def get_codec(name):
+    """Returns the (dumps, loads) pair of a backend.
+
+    Raises:
+        ValueError: If the backend is unknown or not installed.
+    """
+    if name not in _CODECS:
+        raise ValueError('Unknown JSON backend {!r}, expected one of {}'.format(name, ', '.join(BACKENDS)))
+    try:
+        return _CODECS[name]()
+    except ImportError:
+        raise ValueError('The JSON backend {!r} is not installed or is too old'.format(name))
+
+
+def available_backends():
+    """Returns the names of the installed backends, in order of preference."""
+    names = []
+    for name in BACKENDS:
+        try:
+            get_codec(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+def use(name=None):
+    """Selects the backend used by `dumps` and `loads`.
+
+    Args:
+        name: One of the BACKENDS, the fastest installed one if not given.
+    """
+    global backend, _dumps, _loads
+
+    name = name or available_backends()[0]
+    _dumps, _loads = get_codec(name)
+    backend = name
+
+
+@timed_serialization
+def dumps(obj):
+    """Serializes `obj` to UTF-8 encoded JSON bytes."""
+    return _dumps(obj)
+
+
+def loads(data):
+    """Deserializes JSON bytes (or str), raises a ValueError on invalid JSON."""
+    return _loads(data)
+
+
+use()
@@ -0,0 +1,40 @@
+import base64
+import json
+from datetime import datetime
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode(values):
+    """Encodes the sort key of the last item of a page into an opaque cursor.
+
+    Integers are kept as they are and datetimes are written as strings.
+    """
+    data = [
+        value.strftime(_DATETIME_FORMAT) if isinstance(value, datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def decode(cursor, types):
+    """Decodes a cursor created by `encode`, raises a ValueError if it is not valid.
+
+    Args:
+        cursor: The cursor sent by the client.
+        types: The types of the sort key (int or datetime), one per value.
+    """
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+    if not isinstance(data, list) or len(data) != len(types):
+        raise ValueError('Invalid cursor')
+
+    values = []
+    for value, value_type in zip(data, types):
+        if value_type is datetime and isinstance(value, str):
+            values.append(datetime.strptime(value, _DATETIME_FORMAT))
+        elif value_type is int and isinstance(value, int) and not isinstance(value, bool):
+            values.append(value)
+        else:
+            raise ValueError('Invalid cursor')
+    return values
@@ -0,0 +1,187 @@
+"""Streaming exports of the orders, one flat row per order line, as CSV or NDJSON.
+
+The lines are read with a Core select (no ORM objects are built) through a
+server side cursor where the database has one, fetching EXPORT_BATCH_SIZE rows
+at a time, and written out as they are read, optionally gzip compressed. Only
+the lines of one order are held at a time, to write the order total on each of
+them, so the memory used does not grow with the size of the export.
+"""
+import csv
+import io
+import zlib
+
+from sqlalchemy import and_, func, select
+
+from ssms import database
+from ssms.app import EXPORT_BATCH_SIZE
+from ssms.util import codec
+
+FORMATS = {
+    'csv': 'text/csv; charset=UTF-8',
+    'ndjson': 'application/x-ndjson; charset=UTF-8',
+}
+
+COLUMNS = (
+    'order_id', 'order_code', 'created', 'client_id', 'client_email', 'client_first_name', 'client_last_name',
+    'product_id', 'product_code', 'product_name', 'amount', 'value', 'discount', 'line_total', 'order_total',
+)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def lines_query(start=None, end=None, clients_ids=None):
+    """Returns the select of the order lines, sorted by order (created, id) and product.
+
+    Args:
+        start: The first creation datetime, included.
+        end: The last creation datetime, excluded.
+        clients_ids: The clients ids.
+    """
+    from ssms.models import Order, OrderProduct, Product, User
+
+    amount = func.coalesce(OrderProduct.amount, 0)
+    value = func.coalesce(Product.value, 0)
+    discount = func.coalesce(Product.discount, 0)
+
+    query = select([
+        Order.id,
+        Order.code,
+        Order.created,
+        Order.client_id,
+        User.email,
+        User.first_name,
+        User.last_name,
+        Product.id,
+        Product.code,
+        Product.name,
+        amount,
+        value,
+        discount,
+        amount * (value - discount),
+    ]).select_from(
+        Order.__table__
+        .join(OrderProduct.__table__, OrderProduct.order_id == Order.id)
+        .join(Product.__table__, Product.id == OrderProduct.product_id)
+        .outerjoin(User.__table__, User.id == Order.client_id)
+    )
+
+    conditions = []
+    if start is not None:
+        conditions.append(Order.created >= start)
+    if end is not None:
+        conditions.append(Order.created < end)
+    if clients_ids is not None:
+        conditions.append(Order.client_id.in_(clients_ids))
+    if conditions:
+        query = query.where(and_(*conditions))
+
+    return query.order_by(Order.created, Order.id, OrderProduct.product_id)
+
+
+def iter_lines(connection, batch_size=None, **filters):
+    """Yields the order lines as tuples of the COLUMNS, with the total of their order.
+
+    Args:
+        connection: The connection to read with.
+        batch_size: The rows fetched at a time, EXPORT_BATCH_SIZE by default.
+        filters: The filters of `lines_query`.
+    """
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    result = connection.execution_options(stream_results=True).execute(lines_query(**filters))
+
+    order_id = None
+    order_lines = []
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                row = tuple(row)
+                if row[0] != order_id and order_lines:
+                    yield from _with_total(order_lines)
+                    order_lines = []
+                order_id = row[0]
+                order_lines.append(row)
+    finally:
+        result.close()
+
+    yield from _with_total(order_lines)
+
+
+def _with_total(order_lines):
+    total = sum(line[-1] for line in order_lines)
+    for line in order_lines:
+        yield line + (total,)
+
+
+def _dump_csv(lines):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+
+    for line in lines:
+        writer.writerow(line)
+        if buffer.tell() >= _CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode()
+
+
+def _dump_ndjson(lines):
+    chunk = []
+    chunk_size = 0
+
+    for line in lines:
+        data = codec.dumps(dict(zip(COLUMNS, line))) + b'\n'
+        chunk.append(data)
+        chunk_size += len(data)
+
+        if chunk_size >= _CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            chunk_size = 0
+
+    yield b''.join(chunk)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses the chunks on the fly into a gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def dump_lines(lines, stream_format, compress=False):
+    """Returns the iterator of the bytes of the lines written in the format (one of the FORMATS)."""
+    chunks = _dump_csv(lines) if stream_format == 'csv' else _dump_ndjson(lines)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return chunks
+
+
+def export_orders(stream_format, compress=False, batch_size=None, **filters):
+    """Yields the bytes of the export of the order lines matching the filters.
+
+    The lines are only read when the iterator is consumed, in a session of its
+    own, so it can be sent as the response stream after the request session
+    was closed.
+
+    Args:
+        stream_format: One of the FORMATS.
+        compress: Whether the export is gzip compressed.
+        batch_size: The rows fetched at a time, EXPORT_BATCH_SIZE by default.
+        filters: The filters of `lines_query`.
+    """
+    database.begin_request()
+    try:
+        connection = database.session().connection()
+        yield from dump_lines(iter_lines(connection, batch_size, **filters), stream_format, compress)
+    finally:
+        database.end_request(commit=False)
@@ -0,0 +1,160 @@
+"""Streaming imports of the catalogue (ingredients and products) from CSV or NDJSON.
+
+The rows are read line by line from a binary stream (the request body
+or a file), validated in chunks of IMPORT_CHUNK_SIZE rows and each chunk is
+written with `Base.bulk_create` and committed along with the progress of its
+`ImportJob`. Only one chunk is held in memory at a time, whatever the size of
+the input.
+
+The CSV files have a header row with the schema fields. The ingredients of a
+product are written as `ingredient_id:amount` pairs separated by `;`, e.g.
+`12:2.5;14:1`.
+"""
+import csv
+import itertools
+
+from ssms.app import IMPORT_CHUNK_SIZE, IMPORT_MAX_ERRORS
+from ssms.database import session
+from ssms.util import bulk, codec
+
+FORMATS = ('csv', 'ndjson')
+
+_READ_SIZE = 64 * 1024
+
+
+def _parse_ingredients(value):
+    ingredients = []
+    for pair in value.split(';'):
+        ingredient_id, _, amount = pair.strip().partition(':')
+        ingredients.append(dict(ingredient_id=ingredient_id, amount=amount) if amount else
+                           dict(ingredient_id=ingredient_id))
+    return ingredients
+
+
+def _ingredients_ids(product):
+    return [pi.ingredient_id for pi in product.ingredients]
+
+
+def get_catalogues():
+    """Returns the importable resources, as {name: (model, schema class, csv parsers, references)}."""
+    from ssms.models import Ingredient, Product
+    from ssms.schemas import IngredientSchema, ProductSchema
+
+    return {
+        'ingredients': (Ingredient, IngredientSchema, {}, ()),
+        'products': (Product, ProductSchema, dict(ingredients=_parse_ingredients),
+                     (('ingredients', _ingredients_ids, Ingredient),)),
+    }
+
+
+def _iter_lines(stream):
+    # read in blocks, the readline of falcon's bounded stream consumes the whole body
+    pending = b''
+    first = True
+    while True:
+        block = stream.read(_READ_SIZE)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8-sig' if first else 'utf-8') + '\n'
+            first = False
+    if pending:
+        yield pending.decode('utf-8-sig' if first else 'utf-8')
+
+
+def read_csv(stream, parsers=None):
+    """Yields the rows of a CSV stream as dicts, without the empty cells."""
+    parsers = parsers or {}
+    for row in csv.DictReader(_iter_lines(stream)):
+        yield {
+            field: parsers[field](value) if field in parsers else value
+            for field, value in row.items()
+            if field and value not in (None, '')
+        }
+
+
+def read_ndjson(stream):
+    """Yields the JSON objects of a NDJSON stream, the invalid lines are yielded as they are."""
+    for line in _iter_lines(stream):
+        if not line.strip():
+            continue
+        try:
+            yield codec.loads(line)
+        except ValueError:
+            yield line
+
+
+def read_rows(stream, stream_format, parsers=None):
+    if stream_format == 'csv':
+        return read_csv(stream, parsers)
+    return read_ndjson(stream)
+
+
+def create_job(resource, stream_format):
+    from ssms.models import ImportJob
+
+    job = ImportJob(resource=resource, format=stream_format, status='running',
+                    processed=0, inserted=0, rejected=0, errors='[]')
+    job.save()
+    return job
+
+
+def run(job, stream, chunk_size=None, progress=None):
+    """Imports the rows of the stream, updating the job after every chunk.
+
+    A chunk is written in one transaction with the job progress, the rejected
+    rows are counted and the errors of the first IMPORT_MAX_ERRORS are kept.
+    An unexpected error rolls back the current chunk and marks the job as
+    failed, the previous chunks stay written.
+
+    Args:
+        job: The `ImportJob`, its resource and format say how to read the stream.
+        stream: A binary stream, read in blocks.
+        chunk_size: The rows written per transaction, IMPORT_CHUNK_SIZE by default.
+        progress: A callable called with the job after every chunk.
+    """
+    model, schema_class, parsers, references = get_catalogues()[job.resource]
+    schema = schema_class()
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+
+    rows = read_rows(stream, job.format, parsers)
+    errors = codec.loads(job.errors or '[]')
+
+    try:
+        for chunk_start in itertools.count(0, chunk_size):
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            loaded, chunk_errors = bulk.load_items(schema, chunk)
+            for field, get_ids, referenced_model in references:
+                bulk.check_references(loaded, chunk_errors, field, get_ids, referenced_model)
+
+            if loaded:
+                model.bulk_create([loaded[idx] for idx in sorted(loaded)])
+
+            for idx in sorted(chunk_errors)[:max(IMPORT_MAX_ERRORS - len(errors), 0)]:
+                errors.append(dict(row=chunk_start + idx + 1, errors=chunk_errors[idx]))
+
+            job.processed += len(chunk)
+            job.inserted += len(loaded)
+            job.rejected += len(chunk_errors)
+            job.errors = codec.dumps(errors).decode()
+            # the session holds the chunk objects weakly, they are freed with the chunk
+            session().commit()
+
+            if progress:
+                progress(job)
+    except Exception as e:
+        session().rollback()
+        job.status = 'failed'
+        job.message = str(e)[:256]
+        session().commit()
+        raise
+
+    job.status = 'done'
+    session().commit()
+    return job
+
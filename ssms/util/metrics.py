@@ -0,0 +1,156 @@
+"""The Prometheus metrics of the requests and of the in-process caches.
+
+Each request records its latency, statements, database time, serialization
+time and response size by route template, so the slow routes and the routes
+running more statements than they used to (e.g. an N+1 regression) stand out.
+
+With METRICS_MULTIPROC_DIR set every worker writes its metrics to that
+directory and `collect` aggregates the ones of all the workers, whichever
+worker serves the scrape. The directory must be emptied before the server
+starts, `gunicorn_config.on_starting` does it.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ssms.app import METRICS_MULTIPROC_DIR
+
+# the multiprocess mode is picked when prometheus_client is imported
+if METRICS_MULTIPROC_DIR:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', METRICS_MULTIPROC_DIR)
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram  # noqa: E402
+from prometheus_client import generate_latest, multiprocess  # noqa: E402
+
+from ssms.util import request_stats  # noqa: E402
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# the label of the requests which didn't match any route
+UNMATCHED_ROUTE = 'unmatched'
+
+# the cache stats are exported at most once per interval (in seconds) by each process
+_CACHE_STATS_INTERVAL = 5
+
+_LABELS = ('method', 'route')
+
+requests_total = Counter('ssms_requests_total', 'The requests served.', _LABELS + ('status',))
+request_duration = Histogram('ssms_request_duration_seconds', 'The latency of the requests.', _LABELS)
+request_queries = Histogram('ssms_request_queries', 'The SQL statements run by each request.', _LABELS,
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, float('inf')))
+request_db_duration = Histogram('ssms_request_db_duration_seconds', 'The time spent running the SQL statements.',
+                                _LABELS)
+request_serialization_duration = Histogram('ssms_request_serialization_seconds',
+                                           'The time spent serializing the responses.', _LABELS)
+response_bytes = Histogram('ssms_response_bytes', 'The size of the response bodies.', _LABELS,
+                           buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, float('inf')))
+
+cache_hits = Counter('ssms_cache_hits_total', 'The hits of the in-process caches.', ('cache',))
+cache_misses = Counter('ssms_cache_misses_total', 'The misses of the in-process caches.', ('cache',))
+cache_entries = Gauge('ssms_cache_entries', 'The entries of the in-process caches.', ('cache',),
+                      multiprocess_mode='livesum')
+
+# the stats of each cache as of its last export, only the new hits and misses are counted
+_exported_cache_stats = {}
+_last_cache_export = 0.0
+_cache_export_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request_stats.before_query()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request_stats.after_query()
+
+
+def register_listeners():
+    # the Engine class is listened to instead of `app.engine`, so the engines
+    # created by `app.reset_engine` in the forked workers are counted too
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _caches():
+    from ssms.util import auth, code_cache, report_cache
+
+    yield 'auth_tokens', auth.tokens
+    yield 'auth_users', auth.users
+    yield 'reports', report_cache.reports
+    for name, cache in code_cache.caches.items():
+        yield 'codes_' + name, cache
+
+
+def export_cache_stats():
+    """Exports the hits, misses and size of the caches of this process."""
+    global _last_cache_export
+
+    with _cache_export_lock:
+        _last_cache_export = time.monotonic()
+
+        for name, cache in _caches():
+            stats = cache.stats()
+            previous = _exported_cache_stats.get(name, dict(hits=0, misses=0))
+            # a cleared or replaced cache may count from 0 again
+            cache_hits.labels(name).inc(max(stats['hits'] - previous['hits'], 0))
+            cache_misses.labels(name).inc(max(stats['misses'] - previous['misses'], 0))
+            cache_entries.labels(name).set(stats['size'])
+            _exported_cache_stats[name] = stats
+
+
+def observe_request(method, route, status, duration, body_size):
+    """Records a request, the statements and serialization time are the ones of `request_stats`."""
+    stats = request_stats.stats
+    route = route or UNMATCHED_ROUTE
+
+    requests_total.labels(method, route, status).inc()
+    request_duration.labels(method, route).observe(duration)
+    request_queries.labels(method, route).observe(stats.queries)
+    request_db_duration.labels(method, route).observe(stats.db_time)
+    request_serialization_duration.labels(method, route).observe(stats.serialization_time)
+    response_bytes.labels(method, route).observe(body_size)
+
+    if time.monotonic() - _last_cache_export >= _CACHE_STATS_INTERVAL:
+        export_cache_stats()
+
+
+def collect():
+    """Returns the metrics in the Prometheus text format, the ones of all the workers in multiprocess mode."""
+    export_cache_stats()
+
+    if METRICS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+class MeasuredStream(object):
+    """Wraps a streamed response body, the request is recorded once the body was sent."""
+
+    def __init__(self, stream, observe):
+        self._stream = stream
+        self._observe = observe
+        self._size = 0
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self._stream, 'close', None)
+            if close:
+                close()
+        finally:
+            if self._observe:
+                self._observe(self._size)
+                self._observe = None
+
+
+register_listeners()
@@ -0,0 +1,393 @@
+"""Columnar in-memory store of the order lines, the backend of the timeseries reports.
+
+Every `OrderProduct` is kept as one line of the NumPy columns `order_id`,
+`client_id`, `product_id`, `amount` and `created` (the order creation time, in
+seconds), sorted by creation time and order. A time range is then a slice of
+the columns and the aggregations per time bucket are `np.add.reduceat` over
+the contiguous lines of each bucket.
+
+The columns are checked against the `Order` and `OrderProduct` data versions on
+every call. When all the versions since the last check were written by this
+process only the lines of the written orders are reloaded, otherwise all the
+lines are.
+
+The revenue is the amount times the current `value - discount` of the product,
+the orders don't keep the prices they were placed at. The prices are cached
+under the `Product` data version.
+
+NumPy is only imported when the store is used.
+"""
+import threading
+
+from ssms import app
+
+COLUMNS = ('order_id', 'client_id', 'product_id', 'amount', 'created')
+
+# the width and the origin of the time buckets, in seconds, the weeks start on monday
+INTERVALS = {
+    'hour': (3600, 0),
+    'day': (86400, 0),
+    'week': (7 * 86400, 4 * 86400),
+}
+
+# the slots of the busiest slots report, as (width, period, origin) in seconds
+SLOTS = {
+    'hour': (3600, 24, 0),
+    'weekday': (86400, 7, 3 * 86400),
+}
+
+# the order writes kept while waiting for a sync, past it the columns are reloaded
+_MAX_PENDING_CHANGES = 1024
+
+# the bucket x product cells aggregated in dense arrays, past it they are sorted instead
+_MAX_DENSE_CELLS = 1 << 24
+
+# the names of the data versions the lines depend on
+_VERSIONED = ('order', 'orderproduct')
+
+
+class OrderLines(object):
+    """The order lines columns, sorted by creation time and order."""
+
+    def __init__(self, rows=()):
+        import numpy
+
+        self._np = numpy
+        self.columns = self._to_columns(rows)
+
+    def __len__(self):
+        return len(self.columns['order_id'])
+
+    def _to_columns(self, rows):
+        np = self._np
+
+        # the rows are (order_id, client_id, product_id, amount, created)
+        values = list(zip(*rows)) or [()] * len(COLUMNS)
+        columns = {
+            name: np.array(column, dtype=np.int64)
+            for name, column in zip(COLUMNS[:-1], values[:-1])
+        }
+        columns['created'] = np.array(values[-1], dtype='datetime64[s]').astype(np.int64)
+
+        order = np.lexsort((columns['order_id'], columns['created']))
+        return {name: column[order] for name, column in columns.items()}
+
+    def replace_orders(self, orders_ids, rows):
+        """Replaces the lines of the given orders, the ones with no rows are removed."""
+        np = self._np
+
+        keep = ~np.isin(self.columns['order_id'], np.array(sorted(orders_ids), dtype=np.int64))
+        kept = {name: column[keep] for name, column in self.columns.items()}
+        added = self._to_columns(rows)
+
+        columns = {name: np.concatenate([kept[name], added[name]]) for name in COLUMNS}
+
+        # the new orders are usually the latest ones, then the columns are still sorted
+        if len(kept['created']) and len(added['created']) and \
+                (added['created'][0], added['order_id'][0]) < (kept['created'][-1], kept['order_id'][-1]):
+            order = np.lexsort((columns['order_id'], columns['created']))
+            columns = {name: column[order] for name, column in columns.items()}
+
+        self.columns = columns
+
+    def select(self, start=None, end=None):
+        """Returns the columns of the lines created in [start, end), as views."""
+        np = self._np
+
+        created = self.columns['created']
+        lo = 0 if start is None else np.searchsorted(created, _to_seconds(start), 'left')
+        hi = len(created) if end is None else np.searchsorted(created, _to_seconds(end), 'left')
+        return {name: column[lo:hi] for name, column in self.columns.items()}
+
+
+def _to_seconds(value):
+    import numpy
+
+    return numpy.datetime64(value, 's').astype(numpy.int64)
+
+
+class OrderLineStore(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines = None
+        self._versions = None
+        # {(name, version): orders ids} of the order writes committed by this process
+        self._changes = {}
+        # (Product data version, prices by product id)
+        self._prices_cache = None
+
+    def record_changes(self, changes):
+        """Records the orders written by a transaction of this process, with their data versions."""
+        with self._lock:
+            if self._lines is None:
+                return
+            for name, version, orders_ids in changes:
+                self._changes.setdefault((name, version), set()).update(orders_ids)
+            if len(self._changes) > _MAX_PENDING_CHANGES:
+                self._lines = None
+                self._changes = {}
+
+    @staticmethod
+    def _query(db_session, orders_ids=None):
+        from sqlalchemy import func, select
+
+        from ssms.models import Order, OrderProduct
+
+        query = select([
+            OrderProduct.order_id,
+            func.coalesce(Order.client_id, 0),
+            OrderProduct.product_id,
+            func.coalesce(OrderProduct.amount, 0),
+            Order.created,
+        ]).select_from(
+            OrderProduct.__table__.join(Order.__table__, OrderProduct.order_id == Order.id)
+        ).where(Order.created.isnot(None))
+
+        if orders_ids is not None:
+            query = query.where(OrderProduct.order_id.in_(orders_ids))
+
+        return db_session.execute(query).fetchall()
+
+    def load(self):
+        """Loads all the lines, meant to be called at startup."""
+        self.get_lines(app.Session())
+
+    def get_lines(self, db_session=None):
+        """Returns the order lines, up to date with the committed orders.
+
+        Args:
+            db_session: The session to read with, the current one if not given.
+                A given session is closed afterwards.
+        """
+        from ssms.models import DataVersion, Order, OrderProduct
+        from ssms.database import session
+
+        close = db_session is not None
+        db_session = db_session or session()
+        try:
+            # the orders written by the current transaction aren't shared until the commit
+            if DataVersion.is_pending([Order, OrderProduct], db_session):
+                return OrderLines(self._query(db_session))
+
+            versions = dict(zip(_VERSIONED, DataVersion.get_versions([Order, OrderProduct], db_session)))
+
+            with self._lock:
+                if self._lines is not None and versions == self._versions:
+                    return self._lines
+
+                pending = None
+                if self._lines is not None:
+                    pending = [
+                        (name, version)
+                        for name in _VERSIONED
+                        for version in range(self._versions[name] + 1, versions[name] + 1)
+                    ]
+                    if any(key not in self._changes for key in pending) or \
+                            any(versions[name] < self._versions[name] for name in _VERSIONED):
+                        pending = None
+
+                if pending is not None:
+                    orders_ids = set()
+                    for key in pending:
+                        orders_ids.update(self._changes[key])
+                    self._lines.replace_orders(orders_ids, self._query(db_session, list(orders_ids)))
+                else:
+                    self._lines = OrderLines(self._query(db_session))
+
+                self._versions = versions
+                self._changes = {
+                    (name, version): orders_ids for (name, version), orders_ids in self._changes.items()
+                    if version > versions[name]
+                }
+                return self._lines
+        finally:
+            if close:
+                db_session.close()
+
+    @staticmethod
+    def _load_prices(rows):
+        import numpy as np
+
+        rows = [(product_id, (value or 0.0) - (discount or 0.0)) for product_id, value, discount in rows]
+
+        prices = np.zeros(max(product_id for product_id, price in rows) + 1 if rows else 0, dtype=np.float64)
+        if rows:
+            ids, values = zip(*rows)
+            prices[list(ids)] = values
+        return prices
+
+    def _prices(self, products_ids):
+        """Returns the `value - discount` of the products by id, covering at least the given ids.
+
+        The prices of all the products are cached under the `Product` data
+        version, a change of any product reloads them.
+        """
+        import numpy as np
+
+        from ssms.models import DataVersion, Product
+        from ssms.database import session
+
+        query = session().query(Product.id, Product.value, Product.discount)
+
+        if DataVersion.is_pending([Product]):
+            # the products written by the current transaction aren't shared until the commit
+            prices = self._load_prices(query.filter(Product.id.in_(np.unique(products_ids).tolist())))
+        else:
+            version, = DataVersion.get_versions([Product])
+            # replaced as a whole, the threads reading the previous vector keep it
+            cached = self._prices_cache
+            if cached is None or cached[0] != version:
+                cached = self._prices_cache = (version, self._load_prices(query))
+            prices = cached[1]
+
+        size = int(products_ids.max()) + 1 if len(products_ids) else 0
+        if len(prices) < size:
+            # the ids of the deleted products
+            prices = np.concatenate([prices, np.zeros(size - len(prices))])
+        return prices
+
+    def timeseries(self, interval, start=None, end=None):
+        """Returns the [(start, orders, units, revenue)...] of each time bucket with any order.
+
+        Args:
+            interval: One of the INTERVALS.
+            start: The first datetime of the range, included.
+            end: The last datetime of the range, excluded.
+        """
+        import numpy as np
+
+        lines = self.get_lines().select(start, end)
+        if not len(lines['order_id']):
+            return []
+
+        width, origin = INTERVALS[interval]
+        buckets = (lines['created'] - origin) // width * width + origin
+
+        # the lines are sorted by time, each bucket is a contiguous run of lines
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+
+        # the lines of an order are contiguous too, and never span two buckets
+        order_ids = lines['order_id']
+        first_lines = np.ones(len(order_ids), dtype=np.int64)
+        first_lines[1:] = order_ids[1:] != order_ids[:-1]
+
+        revenue = lines['amount'] * self._prices(lines['product_id'])[lines['product_id']]
+
+        return list(zip(
+            buckets[starts].astype('datetime64[s]').tolist(),
+            np.add.reduceat(first_lines, starts).tolist(),
+            np.add.reduceat(lines['amount'], starts).tolist(),
+            np.add.reduceat(revenue, starts).tolist(),
+        ))
+
+    def timeseries_products(self, interval, start=None, end=None):
+        """Returns the [(start, product_id, units, revenue)...] of each time bucket and product sold in it."""
+        import numpy as np
+
+        lines = self.get_lines().select(start, end)
+        if not len(lines['order_id']):
+            return []
+
+        width, origin = INTERVALS[interval]
+        buckets = (lines['created'] - origin) // width * width + origin
+
+        # the lines are sorted by time, the bucket index of a line is the number of bucket changes before it
+        changes = np.zeros(len(buckets), dtype=np.int64)
+        changes[1:] = buckets[1:] != buckets[:-1]
+        buckets_index = np.cumsum(changes)
+        buckets_starts = buckets[np.concatenate([[0], np.flatnonzero(changes)])]
+
+        products_ids = lines['product_id']
+        size = int(products_ids.max()) + 1
+        cells = buckets_index * size + products_ids
+
+        if len(buckets_starts) * size <= _MAX_DENSE_CELLS:
+            counts = np.bincount(cells, minlength=len(buckets_starts) * size)
+            keys = np.flatnonzero(counts)
+            positions = cells
+        else:
+            keys, positions = np.unique(cells, return_inverse=True)
+
+        prices = self._prices(products_ids)
+        units = np.bincount(positions, weights=lines['amount'])
+        revenue = np.bincount(positions, weights=lines['amount'] * prices[products_ids])
+        if positions is cells:
+            units, revenue = units[keys], revenue[keys]
+
+        return list(zip(
+            buckets_starts[keys // size].astype('datetime64[s]').tolist(),
+            (keys % size).tolist(),
+            units.astype(np.int64).tolist(),
+            revenue.tolist(),
+        ))
+
+    def busiest_slots(self, slot, start=None, end=None):
+        """Returns the [(slot, orders, units, revenue)...] of the hours of the day (or the
+        weekdays, monday being 0) with any order, the busiest first.
+        """
+        import numpy as np
+
+        lines = self.get_lines().select(start, end)
+        if not len(lines['order_id']):
+            return []
+
+        width, period, origin = SLOTS[slot]
+        slots = (lines['created'] - origin) // width % period
+
+        order_ids = lines['order_id']
+        first_lines = np.ones(len(order_ids), dtype=np.float64)
+        first_lines[1:] = order_ids[1:] != order_ids[:-1]
+
+        revenue = lines['amount'] * self._prices(lines['product_id'])[lines['product_id']]
+
+        orders = np.bincount(slots, weights=first_lines, minlength=period).astype(np.int64)
+        units = np.bincount(slots, weights=lines['amount'], minlength=period).astype(np.int64)
+        revenue = np.bincount(slots, weights=revenue, minlength=period)
+
+        busiest = [idx for idx in np.lexsort((np.arange(period), -orders)).tolist() if orders[idx]]
+        return [(idx, int(orders[idx]), int(units[idx]), float(revenue[idx])) for idx in busiest]
+
+
+store = OrderLineStore()
+
+
+def _record_order_changes(db_session, flush_context):
+    import itertools
+
+    from ssms.models import Order, OrderProduct, _changed_values
+
+    changes = {}
+    for obj in itertools.chain(db_session.new, db_session.dirty, db_session.deleted):
+        if isinstance(obj, Order):
+            changes.setdefault(Order.__tablename__, set()).update(_changed_values(obj, 'id'))
+        elif isinstance(obj, OrderProduct):
+            changes.setdefault(OrderProduct.__tablename__, set()).update(_changed_values(obj, 'order_id'))
+
+    versions = db_session.info.get('data_versions', {})
+    db_session.info.setdefault('order_changes', []).extend(
+        (name, versions[name], orders_ids) for name, orders_ids in changes.items())
+
+
+def _commit_order_changes(db_session):
+    changes = db_session.info.pop('order_changes', None)
+    if changes:
+        store.record_changes(changes)
+
+
+def _discard_order_changes(db_session, *args):
+    db_session.info.pop('order_changes', None)
+
+
+def register_listeners():
+    """Tracks the order writes of the sessions, for the incremental refreshes of the lines."""
+    from sqlalchemy import event
+
+    # the models listeners, which bump the data versions, must run first
+    import ssms.models  # noqa: F401
+
+    event.listen(app.Session, 'after_flush', _record_order_changes)
+    event.listen(app.Session, 'after_commit', _commit_order_changes)
+    event.listen(app.Session, 'after_rollback', _discard_order_changes)
+
+
+register_listeners()
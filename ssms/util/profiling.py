@@ -0,0 +1,58 @@
+"""Profiles the requests of the admins sending the `X-SSMS-Profile: 1` header, with cProfile.
+
+The profiles are saved in the pstats format (`python -m pstats <file>` or
+snakeviz read them) to their own store, the newest PROFILE_MAX_FILES are kept.
+The name of the profile of a request is sent back in the X-SSMS-Profile-Id
+header, the profiles are listed and downloaded on /v1/profiles.
+
+The middleware is only installed with PROFILING set, otherwise the requests
+pay nothing for it.
+"""
+import cProfile
+import io
+import marshal
+import mimetypes
+import pstats
+
+from ssms.app import PROFILE_MAX_FILES, PROFILE_STORAGE_PATH
+from ssms.util.storage import SimpleBaseStore
+
+REQUEST_HEADER = 'X-SSMS-Profile'
+RESPONSE_HEADER = 'X-SSMS-Profile-Id'
+
+CONTENT_TYPE = 'application/x-pstats'
+mimetypes.add_type(CONTENT_TYPE, '.prof')
+
+_store = None
+
+
+def get_store():
+    """Returns the store of the profiles, created on first use."""
+    global _store
+    if _store is None:
+        _store = SimpleBaseStore(PROFILE_STORAGE_PATH)
+    return _store
+
+
+def start():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save(profiler):
+    """Stops the profiler and saves its stats, returns the name of the profile."""
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+
+    store = get_store()
+    # the same data as `stats.dump_stats`, without the temporary file
+    name = store.save_stream(io.BytesIO(marshal.dumps(stats.stats)), CONTENT_TYPE)
+
+    for old_name, size, modified in store.list_files()[PROFILE_MAX_FILES:]:
+        try:
+            store.delete(old_name)
+        except OSError:
+            # already deleted by another worker
+            pass
+    return name
@@ -0,0 +1,96 @@
+"""Groups the SQL statements of each request by their normalized SQL, to catch the N+1 queries.
+
+Meant for debugging and CI (QUERY_BUDGET_MODE=warn|raise). After each request
+`check` reports the request if it ran more statements than its budget, or the
+same normalized statement more than QUERY_REPEAT_LIMIT times (e.g. a lazy load
+per row).
+
+The budget of a route is the `query_budget` attribute of its resource, an int
+or a dict of ints by HTTP method, QUERY_BUDGET otherwise (0 for none). A budget
+of None disables the checks of the resource. The statements of the streamed
+responses run once the response was started, they aren't checked.
+"""
+import re
+import threading
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ssms.app import QUERY_BUDGET, QUERY_BUDGET_MODE, QUERY_REPEAT_LIMIT
+
+MODES = ('off', 'warn', 'raise')
+
+_WHITESPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)', re.IGNORECASE)
+
+
+class _Statements(threading.local):
+    def __init__(self):
+        self.counts = Counter()
+
+
+_statements = _Statements()
+
+
+def normalize(statement):
+    """Returns the statement without its literals and with its IN lists collapsed, e.g. `IN (?, ?)` to `IN (...)`."""
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _LITERALS.sub('?', statement)
+    return _IN_LISTS.sub('IN (...)', statement)
+
+
+def reset():
+    _statements.counts = Counter()
+
+
+def counts():
+    """Returns the {normalized statement: times run} of the current request."""
+    return _statements.counts
+
+
+def get_budget(resource, method):
+    budget = getattr(resource, 'query_budget', QUERY_BUDGET)
+    if isinstance(budget, dict):
+        return budget.get(method, QUERY_BUDGET)
+    return budget
+
+
+def check(resource, method, repeat_limit=QUERY_REPEAT_LIMIT):
+    """Returns the problems of the current request, an empty list if it kept to its budget.
+
+    Args:
+        resource: The resource of the request, its `query_budget` is checked.
+        method: The HTTP method of the request.
+        repeat_limit: The times the same statement may run, 0 for any.
+    """
+    budget = get_budget(resource, method)
+    if budget is None:
+        return []
+
+    problems = []
+    total = sum(_statements.counts.values())
+    if budget and total > budget:
+        problems.append(dict(problem='budget', queries=total, budget=budget))
+
+    if repeat_limit:
+        for statement, times in _statements.counts.most_common():
+            if times <= repeat_limit:
+                break
+            problems.append(dict(problem='repeated', statement=statement, times=times, limit=repeat_limit))
+
+    return problems
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _statements.counts[normalize(statement)] += 1
+
+
+def register_listeners():
+    # the statements are only normalized when the budgets are checked
+    if QUERY_BUDGET_MODE != 'off':
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+
+
+register_listeners()
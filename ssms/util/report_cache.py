@@ -0,0 +1,46 @@
+from ssms.app import REPORT_CACHE_SIZE, REPORT_CACHE_TTL
+from ssms.util.cache import TTLCache
+
+# the encoded report bodies, by report, ids and data versions
+reports = TTLCache(REPORT_CACHE_SIZE, REPORT_CACHE_TTL)
+
+
+def _ids_key(ids):
+    return None if ids is None else tuple(sorted(set(ids), key=repr))
+
+
+def get_report(name, ids, dependencies, build, **filters):
+    """Returns the encoded report of the given ids and filters, from the cache if possible.
+
+    The cache key holds the current `DataVersion` of every model the report
+    depends on, so any write to them makes the previous entries unreachable.
+    A report read by a transaction which wrote one of them isn't cached, its
+    versions don't cover its writes until the commit.
+
+    Args:
+        name: The report name.
+        ids: The ids the report is built for, their order and repetitions
+            don't change the report. None if the report isn't restricted to
+            some ids.
+        dependencies: The models read to build the report.
+        build: A callable building the encoded report from the ids and the filters.
+        filters: The other report filters, lists of ids are treated as the ids.
+    """
+    from ssms.models import DataVersion
+
+    if DataVersion.is_pending(dependencies):
+        return build(ids, **filters)
+
+    key = (
+        name,
+        _ids_key(ids),
+        tuple(sorted((field, _ids_key(value) if isinstance(value, list) else value)
+                     for field, value in filters.items())),
+        DataVersion.get_versions(dependencies),
+    )
+
+    body = reports.get(key)
+    if body is None:
+        body = build(ids, **filters)
+        reports.set(key, body)
+    return body
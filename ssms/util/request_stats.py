@@ -0,0 +1,60 @@
+"""The statements, database time and serialization time of the request handled by the current thread.
+
+The counters are reset when a request starts (see `MetricsMiddleware`) and read
+when its response is sent, so they also cover the streamed responses.
+
+The serialization time excludes the time of the statements the serialization
+itself runs (e.g. lazy loaded relationships), those are database time.
+"""
+import threading
+import time
+from functools import wraps
+
+
+class _Stats(threading.local):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.query_start = None
+        self.serializing = False
+
+
+stats = _Stats()
+
+
+def reset():
+    stats.reset()
+
+
+def before_query():
+    stats.query_start = time.perf_counter()
+
+
+def after_query():
+    if stats.query_start is not None:
+        stats.db_time += time.perf_counter() - stats.query_start
+        stats.query_start = None
+    stats.queries += 1
+
+
+def timed_serialization(func):
+    """Adds the time spent in `func` to the serialization time, the nested calls are only counted once."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if stats.serializing:
+            return func(*args, **kwargs)
+
+        stats.serializing = True
+        db_time = stats.db_time
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.serialization_time += time.perf_counter() - start - (stats.db_time - db_time)
+            stats.serializing = False
+
+    return wrapper
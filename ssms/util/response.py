@@ -1,7 +1,23 @@
-def format_response(response):
-    return {
-        "data": response,
-    }
+from logging import getLogger
+
+from ssms import database
+from ssms.util import codec
+
+logger = getLogger(__name__)
+
+STREAM_FORMATS = {
+    'json': 'application/json; charset=UTF-8',
+    'ndjson': 'application/x-ndjson; charset=UTF-8',
+}
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def format_response(response, **extra):
+    return dict(
+        data=response,
+        **extra
+    )
 
 
 def format_error(code, message, extra):
@@ -17,3 +33,55 @@ def format_errors(errors):
         error=True,
         errors=[error for error in errors]
     )
+
+
+def stream_response(resp, stream_format, rows, dump):
+    """Streams the rows as they are read from the database, one dumped row at a time.
+
+    The json format keeps the `format_response` envelope and the ndjson format
+    writes one row per line.
+
+    Args:
+        resp: The response object.
+        stream_format: One of the STREAM_FORMATS.
+        rows: A callable returning the rows iterable. It is only called when the
+            response is sent, after the request session was closed, so it runs
+            in a session of its own.
+        dump: A callable serializing one row.
+    """
+    resp.content_type = STREAM_FORMATS[stream_format]
+    resp.stream = _stream(stream_format, rows, dump)
+
+
+def _stream(stream_format, rows, dump):
+    is_json = stream_format == 'json'
+
+    database.begin_request()
+    try:
+        chunk = [b'{"data": ['] if is_json else []
+        chunk_size = 0
+        separator = b''
+
+        for row in rows():
+            line = codec.dumps(dump(row))
+            if is_json:
+                chunk.append(separator)
+                separator = b', '
+            else:
+                line += b'\n'
+            chunk.append(line)
+            chunk_size += len(line)
+
+            if chunk_size >= _STREAM_CHUNK_SIZE:
+                yield b''.join(chunk)
+                chunk = []
+                chunk_size = 0
+
+        if is_json:
+            chunk.append(b']}')
+        yield b''.join(chunk)
+    except Exception:
+        logger.exception('Error while streaming the response')
+        raise
+    finally:
+        database.end_request(commit=False)
@@ -0,0 +1,120 @@
+"""The always-on sampling profiler of each worker.
+
+A daemon thread snapshots the stacks of the threads handling a request
+(`sys._current_frames`) SAMPLING_RATE times per second, and counts them by
+folded stack (`module:function` frames from the root, separated by `;`). The
+table holds at most SAMPLING_MAX_STACKS stacks, the samples of the new stacks
+are counted under OVERFLOW_STACK once it is full.
+
+The folded stacks are the input of flamegraph.pl and speedscope, they are
+served on /v1/profiles/samples. Each worker samples its own requests, the
+endpoint serves the stacks of the worker handling it.
+"""
+import os
+import sys
+import threading
+import time
+
+from ssms.app import SAMPLING_MAX_STACKS, SAMPLING_RATE
+
+# the stack of the samples which didn't fit in the table
+OVERFLOW_STACK = '[other]'
+
+# the threads handling a request, the idle ones aren't sampled
+active_threads = set()
+
+_sampler = None
+_pid = None
+
+
+class Sampler(object):
+    def __init__(self, rate, max_stacks):
+        self.interval = 1 / rate
+        self.max_stacks = max_stacks
+        self.stacks = {}
+        self.samples = 0
+        # the time spent sampling, to check the overhead
+        self.busy = 0.0
+        self.started = time.time()
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ssms-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            self.sample()
+            self.busy += time.perf_counter() - start
+
+    def _fold(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = '{}:{}'.format(frame.f_globals.get('__name__', '?'), code.co_name)
+            labels.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def sample(self):
+        """Counts the current stack of each thread handling a request."""
+        frames = sys._current_frames()
+        stacks = [self._fold(frames[thread_id]) for thread_id in list(active_threads) if thread_id in frames]
+        del frames
+
+        with self._lock:
+            for stack in stacks:
+                if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    stack = OVERFLOW_STACK
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += len(stacks)
+
+    def folded(self):
+        """Returns the folded stacks, one `stack count` per line."""
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in stacks)
+
+    def stats(self):
+        elapsed = time.time() - self.started
+        return dict(samples=self.samples, stacks=len(self.stacks), seconds=elapsed,
+                    overhead=self.busy / elapsed if elapsed else 0.0)
+
+    def reset(self):
+        with self._lock:
+            self.stacks = {}
+            self.samples = 0
+            self.busy = 0.0
+            self.started = time.time()
+
+
+def start():
+    """Starts the sampler of this process, if SAMPLING_RATE is set.
+
+    Meant to be called when the app is created and after the fork of each
+    worker, the thread of the parent process isn't copied to the child.
+    """
+    global _sampler, _pid
+
+    if SAMPLING_RATE <= 0 or (_sampler is not None and _pid == os.getpid()):
+        return
+
+    # the threads of the parent process are gone
+    active_threads.clear()
+    _sampler = Sampler(SAMPLING_RATE, SAMPLING_MAX_STACKS)
+    _sampler.start()
+    _pid = os.getpid()
+
+
+def get_sampler():
+    """Returns the sampler of this process, None if it isn't running."""
+    return _sampler if _pid == os.getpid() else None
@@ -0,0 +1,139 @@
+"""The opt-in log of the slow SQL statements (SLOW_QUERY_THRESHOLD milliseconds or more).
+
+Each entry holds the statement, its parameters (the passwords, seeds, tokens
+and secrets redacted), the model and resource methods which ran it, and its
+query plan, explained on the same connection right after it ran. The entries
+go to their own rotating file, SLOW_QUERY_LOG, instead of the app log.
+
+Only the SELECT statements are explained, with EXPLAIN QUERY PLAN on SQLite
+and EXPLAIN on the other databases.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ssms.app import SLOW_QUERY_LOG, SLOW_QUERY_LOG_BACKUPS, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_THRESHOLD
+
+logger = logging.getLogger(__name__)
+# the slow queries only go to their own file
+logger.propagate = False
+
+REDACTED = '<redacted>'
+_SECRET_NAMES = re.compile(r'password|seed|token|secret', re.IGNORECASE)
+
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the frames of the package which aren't reported as callers
+_IGNORED_FILES = frozenset(os.path.join(_PACKAGE_DIR, 'util', name)
+                           for name in ('slow_queries.py', 'request_stats.py'))
+
+# the statements taking at least this many seconds are logged
+_threshold = None
+_handler = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.slow_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.slow_query_start
+    if elapsed >= _threshold:
+        log(conn, statement, parameters, context, executemany, elapsed)
+
+
+def redact(parameters, names=None):
+    """Returns the parameters of a statement as a dict, the secret ones redacted.
+
+    Args:
+        parameters: A dict of parameters, or a sequence of positional ones.
+        names: The names of the positional parameters, in order, if known.
+    """
+    if isinstance(parameters, dict):
+        items = parameters.items()
+    elif names and len(names) == len(parameters):
+        items = zip(names, parameters)
+    else:
+        items = enumerate(parameters)
+
+    return {name: REDACTED if _SECRET_NAMES.search(str(name)) else value for name, value in items}
+
+
+def get_callers():
+    """Returns the frames of the package (e.g. the model and resource methods) running a statement, innermost first."""
+    callers = []
+    frame = sys._getframe(1)
+    while frame:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_PACKAGE_DIR) and filename not in _IGNORED_FILES:
+            callers.append('{}:{} {}'.format(os.path.relpath(filename, os.path.dirname(_PACKAGE_DIR)),
+                                             frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    return callers
+
+
+def explain(conn, statement, parameters):
+    """Returns the rows of the plan of a SELECT statement, run on a raw cursor so no event is triggered."""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return []
+
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [' | '.join(str(value) for value in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return ['EXPLAIN failed: {}'.format(e)]
+    finally:
+        cursor.close()
+
+
+def log(conn, statement, parameters, context, executemany, elapsed):
+    names = getattr(getattr(context, 'compiled', None), 'positiontup', None)
+    if executemany:
+        params = '{} (first of {})'.format(redact(parameters[0], names), len(parameters)) if parameters else '[]'
+        plan = []
+    else:
+        params = redact(parameters, names)
+        plan = explain(conn, statement, parameters)
+
+    lines = ['{:.1f} ms'.format(elapsed * 1000)]
+    lines.extend(line.strip() for line in statement.strip().splitlines())
+    lines.append('params: {}'.format(params))
+    lines.extend('caller: ' + caller for caller in get_callers())
+    lines.extend('plan: ' + row for row in plan)
+    logger.warning('\n    '.join(lines))
+
+
+def enable(threshold=SLOW_QUERY_THRESHOLD, path=SLOW_QUERY_LOG):
+    """Logs the statements taking at least `threshold` milliseconds to the rotating file at `path`."""
+    global _threshold, _handler
+
+    _threshold = threshold / 1000
+    if _handler is None:
+        _handler = RotatingFileHandler(path, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+        _handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
+        logger.addHandler(_handler)
+        logger.setLevel(logging.WARNING)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def disable():
+    global _handler
+
+    if event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.remove(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    if _handler is not None:
+        logger.removeHandler(_handler)
+        _handler.close()
+        _handler = None
@@ -52,3 +52,18 @@ class SimpleBaseStore(object):
         stream_len = os.path.getsize(file_path)
 
         return stream, stream_len
+
+    def list_files(self):
+        """Returns the (name, size, modified time) of the stored files, the newest first."""
+        files = []
+        for entry in os.scandir(self._storage_path):
+            if self._NAME_PATTERN.match(entry.name) and entry.is_file():
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime))
+        return sorted(files, key=lambda file: file[2], reverse=True)
+
+    def delete(self, name):
+        if not self._NAME_PATTERN.match(name):
+            raise IOError('File not found')
+
+        os.remove(os.path.join(self._storage_path, name))
@@ -1,4 +1,5 @@
 import logging
+import os
 
 from sqlalchemy.schema import MetaData
 
@@ -8,8 +9,11 @@ import pytest
 
 from base64 import b64encode
 
-import ssms.app
-from ssms.models import Admin, Client
+# every request of the tests fails when it goes over the query budget of its route
+os.environ.setdefault('QUERY_BUDGET_MODE', 'raise')
+
+import ssms.app  # noqa: E402
+from ssms.models import Admin, Client  # noqa: E402
 
 
 @pytest.fixture(scope='module')
@@ -1,10 +1,13 @@
 import falcon
 
+import ssms.app
+
 from ssms.models import Admin, Ingredient, Product, ProductIngredient, Client, Order, OrderProduct, UsersEnum, User
 
 from tests import util, conftest
 
 import json
+import os
 
 from logging import getLogger
 
@@ -489,6 +492,8 @@ def test_orders_list_resource__on_post(db_session, client, admin):
 
 
 def test_orders_list_resource__on_get(db_session, client, admin):
+    util.create_random_order(amount_of_products=1)
+
     response = client.simulate_get(
         '/v1/orders/',
         headers={'Authorization': 'Basic {}'.format(admin.basic_password)}
@@ -504,6 +509,7 @@ def test_orders_list_resource__on_get(db_session, client, admin):
         assert order_data.get('client_id') == order.client_id
         assert len(order_data.get('products')) == len(list(order.products))
         assert order_data.get('code') == order.code
+        assert 'password' not in order_data.get('client') and 'seed' not in order_data.get('client')
 
 
 def test_orders_detail_resource__on_get(db_session, client, admin):
@@ -529,6 +535,7 @@ def test_orders_detail_resource__on_get(db_session, client, admin):
     assert data.get('client_id') == order.client_id
     assert len(data.get('products')) == len(list(order.products))
     assert data.get('code') == order.code
+    assert 'password' not in data.get('client') and 'seed' not in data.get('client')
 
 
 def test_orders_detail_resource__on_put(db_session, client, admin):
@@ -819,3 +826,821 @@ def test_clients_detail_resource__on_delete(db_session, client, admin):
 
     assert user_client not in db_session
     assert user_client_db is None
+
+
+def test_engine_options(monkeypatch):
+    from sqlalchemy.pool import NullPool, StaticPool
+
+    monkeypatch.setenv('DATABASE_POOL_SIZE', '8')
+    monkeypatch.setenv('DATABASE_MAX_OVERFLOW', '2')
+    monkeypatch.setenv('DATABASE_POOL_PRE_PING', 'True')
+
+    options = ssms.app.engine_options('postgresql://ssms@localhost/ssms')
+
+    assert options.get('pool_size') == 8
+    assert options.get('max_overflow') == 2
+    assert options.get('pool_pre_ping') is True
+
+    # the sqlite pools are not sized
+    options = ssms.app.engine_options('sqlite:///:memory:')
+
+    assert 'pool_size' not in options
+
+    monkeypatch.setenv('DATABASE_POOL_CLASS', 'static')
+    options = ssms.app.engine_options('sqlite:///:memory:')
+
+    assert options.get('poolclass') is StaticPool
+    assert options.get('connect_args') == dict(check_same_thread=False)
+
+    monkeypatch.setenv('DATABASE_POOL_CLASS', 'null')
+    options = ssms.app.engine_options('sqlite:////tmp/ssms.sqlite')
+
+    assert options.get('poolclass') is NullPool
+    assert 'pool_size' not in options
+
+
+def test_orders_list_resource__on_get_pages(db_session, client, admin):
+    for idx in range(5):
+        util.create_random_order(amount_of_products=1)
+
+    orders_ids = [order.id for order in Order.get_all()]
+
+    pages_ids = []
+    params = 'limit=2'
+    while True:
+        response = client.simulate_get(
+            '/v1/orders/',
+            query_string='{}&token={}'.format(params, admin.get_token()),
+        )
+
+        assert response.status == falcon.HTTP_OK
+
+        content = json.loads(response.content)
+
+        assert len(content.get('data')) <= 2
+
+        pages_ids.extend(order_data.get('id') for order_data in content.get('data'))
+
+        if not content.get('next'):
+            break
+
+        params = 'limit=2&after={}'.format(content.get('next'))
+
+    assert sorted(pages_ids) == sorted(orders_ids)
+
+    # an invalid cursor or limit should return 400, as a cursor which doesn't match the sort key
+    from datetime import datetime
+    from ssms.util import cursor
+
+    created = datetime(2016, 5, 1)
+    for params in ('after=ABCD', 'limit=0', 'after=' + cursor.encode([1]),
+                   'after=' + cursor.encode([created, 1, 2]), 'after=' + cursor.encode([1, created])):
+        response = client.simulate_get(
+            '/v1/orders/',
+            query_string=params,
+            headers={'Authorization': 'Basic {}'.format(admin.basic_password)},
+        )
+
+        assert response.status == falcon.HTTP_400
+
+
+def test_orders_list_resource__on_get_stream(db_session, client, admin):
+    util.create_random_order(amount_of_products=1)
+
+    response = client.simulate_get(
+        '/v1/orders/',
+        query_string='stream=json',
+        headers={'Authorization': 'Basic {}'.format(admin.basic_password)}
+    )
+
+    data = json.loads(response.content).get('data')
+
+    assert response.status == falcon.HTTP_OK
+    assert [order_data.get('id') for order_data in data] == [order.id for order in Order.iter_all()]
+
+    response = client.simulate_get(
+        '/v1/orders/',
+        query_string='stream=ndjson',
+        headers={'Authorization': 'Basic {}'.format(admin.basic_password)}
+    )
+
+    lines = [json.loads(line) for line in response.content.decode().splitlines()]
+
+    assert response.status == falcon.HTTP_OK
+    assert response.headers.get('content-type').startswith('application/x-ndjson')
+    assert lines == data
+
+    for order_data in lines:
+        assert order_data.get('client').get('password') is None
+        assert order_data.get('client').get('seed') is None
+
+
+def test_orders_ingredients_report_resource__on_get_stream(db_session, client, admin):
+    orders_ids = [util.create_random_order(amount_of_products=1).id for idx in range(2)]
+
+    response = client.simulate_get(
+        '/v1/orders/reports/ingredients',
+        headers={'Authorization': 'Basic {}'.format(admin.basic_password)},
+        body=json.dumps(orders_ids),
+    )
+
+    stream_response = client.simulate_get(
+        '/v1/orders/reports/ingredients',
+        query_string='stream=json',
+        headers={'Authorization': 'Basic {}'.format(admin.basic_password)},
+        body=json.dumps(orders_ids),
+    )
+
+    assert stream_response.status == falcon.HTTP_200
+    assert json.loads(stream_response.content) == json.loads(response.content)
+
+
+def test_json_codec(db_session, client, admin):
+    from datetime import datetime
+
+    from ssms.util import codec
+
+    payload = dict(name='Pão de queijo', created=datetime(2018, 1, 2, 3, 4, 5), user_type=UsersEnum.admin, total=1.5)
+
+    for name in codec.available_backends():
+        dumps, loads = codec.get_codec(name)
+        body = dumps(payload)
+
+        assert isinstance(body, bytes)
+        assert loads(body) == dict(name='Pão de queijo', created='2018-01-02T03:04:05', user_type=0, total=1.5)
+
+    try:
+        codec.get_codec('yaml')
+    except ValueError:
+        pass
+    else:
+        assert False, 'unknown backends must be rejected'
+
+    # the responses are written with the selected backend
+    backend = codec.backend
+    try:
+        codec.use('json')
+        response = client.simulate_get(
+            '/v1/ingredients/',
+            headers={'Authorization': 'Basic {}'.format(admin.basic_password)}
+        )
+    finally:
+        codec.use(backend)
+
+    assert response.status == falcon.HTTP_OK
+    assert isinstance(json.loads(response.content).get('data'), list)
+
+
+def test_auth_cache(db_session, client, admin):
+    from ssms.util import auth
+
+    mock_data = util.get_random_user_data()
+
+    user_client = Client(**mock_data)
+    user_client.set_password(mock_data.get('password'))
+    user_client.save()
+
+    headers = {'Authorization': 'Token {}'.format(user_client.get_token())}
+
+    hits = auth.users.hits
+    for idx in range(2):
+        response = client.simulate_get('/v1/users', headers=headers)
+
+        assert response.status == falcon.HTTP_OK
+
+    # the second request is served from the cache
+    assert auth.users.hits == hits + 1
+
+    # the updates and deletes drop the cached user
+    response = client.simulate_put(
+        '/v1/clients/{client_id}'.format(client_id=user_client.id),
+        headers={'Authorization': 'Basic {}'.format(admin.basic_password)},
+        body=json.dumps(dict(first_name='Cached'))
+    )
+
+    assert response.status == falcon.HTTP_OK
+    assert auth.users.get(user_client.email) is None
+
+    response = client.simulate_get('/v1/users', headers=headers)
+    data = json.loads(response.content).get('data')
+
+    assert data.get('first_name') == 'Cached'
+
+    response = client.simulate_delete(
+        '/v1/clients/{client_id}'.format(client_id=user_client.id),
+        headers={'Authorization': 'Basic {}'.format(admin.basic_password)}
+    )
+
+    assert response.status == falcon.HTTP_OK
+
+    response = client.simulate_get('/v1/users', headers=headers)
+
+    assert response.status == falcon.HTTP_NOT_FOUND
+
+
+def test_auth_cache__write_elsewhere(db_session, client):
+    """
+    A user written by another process (another session here) isn't served from the cache of this one.
+    """
+    from base64 import b64encode
+    from ssms.util import auth
+
+    mock_data = util.get_random_user_data()
+
+    user_client = Client(**mock_data)
+    user_client.set_password(mock_data.get('password'))
+    user_client.save()
+    # not read from the instance afterwards, the test session would keep the loaded row
+    user_id, email = user_client.id, user_client.email
+
+    headers = {'Authorization': 'Basic {}'.format(
+        b64encode('{}:{}'.format(email, mock_data.get('password')).encode()).decode('ascii'))}
+
+    assert client.simulate_get('/v1/users', headers=headers).status == falcon.HTTP_OK
+    assert auth.users.get(email) is not None
+
+    other_session = ssms.app.Session()
+    try:
+        other_session.query(Client).get(user_id).set_password('changed')
+        other_session.commit()
+    finally:
+        other_session.close()
+
+    # still cached here, but under the previous version
+    assert auth.users.get(email) is not None
+    assert client.simulate_get('/v1/users', headers=headers).status == falcon.HTTP_FORBIDDEN
+
+
+def test_report_cache(db_session, client, admin):
+    from ssms.util import report_cache
+
+    orders = [util.create_random_order(amount_of_products=2) for idx in range(2)]
+    orders_ids = [order.id for order in orders]
+
+    def get_report(ids):
+        response = client.simulate_get(
+            '/v1/orders/reports/ingredients',
+            headers={'Authorization': 'Basic {}'.format(admin.basic_password)},
+            body=json.dumps(ids),
+        )
+        assert response.status == falcon.HTTP_200
+        return {row.get('ingredient_id'): row.get('total') for row in json.loads(response.content).get('data')}
+
+    hits = report_cache.reports.hits
+    report = get_report(orders_ids)
+
+    # the same ids in any order hit the cache
+    assert get_report(list(reversed(orders_ids)) + orders_ids[:1]) == report
+    assert report_cache.reports.hits == hits + 1
+
+    # a recipe write invalidates it
+    pi = orders[0].products[0].product.ingredients[0]
+    pi.amount += 1
+    pi.product.save()
+
+    new_report = get_report(orders_ids)
+
+    expected = sum(op.amount * recipe.amount
+                   for order in orders
+                   for op in order.products
+                   for recipe in op.product.ingredients
+                   if recipe.ingredient_id == pi.ingredient_id)
+
+    assert report_cache.reports.hits == hits + 1
+    assert new_report[pi.ingredient_id] != report[pi.ingredient_id]
+    assert abs(new_report[pi.ingredient_id] - expected) < 1e-6
+
+
+def test_orders_timeseries_resource__on_get(db_session, client, admin):
+    from collections import defaultdict
+    from datetime import datetime
+
+    # monday to wednesday, before any other order of the suite
+    created = [datetime(2017, 3, 6, 9, 15), datetime(2017, 3, 6, 9, 45), datetime(2017, 3, 8, 18, 5)]
+    orders = []
+    for value in created:
+        order = util.create_random_order(amount_of_products=2)
+        order.created = value
+        order.save()
+        orders.append(order)
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    time_range = 'from=2017-03-01&to=2017-03-31'
+
+    def get(route, query):
+        response = client.simulate_get(route, headers=headers, query_string=query)
+        assert response.status == falcon.HTTP_200
+        return json.loads(response.content).get('data')
+
+    def expected_totals(key):
+        totals = defaultdict(lambda: [set(), 0, 0.0])
+        for order in orders:
+            for op in order.products:
+                bucket = totals[key(order.created)]
+                bucket[0].add(order.id)
+                bucket[1] += op.amount
+                bucket[2] += op.amount * (op.product.value - (op.product.discount or 0.0))
+        return {k: (len(ids), units, revenue) for k, (ids, units, revenue) in totals.items()}
+
+    def check(data, key_name, expected):
+        assert {row[key_name] for row in data} == set(expected)
+        for row in data:
+            orders_count, units, revenue = expected[row[key_name]]
+            assert row['orders'] == orders_count
+            assert row['units'] == units
+            assert abs(row['revenue'] - revenue) < 1e-6
+
+    check(get('/v1/orders/reports/timeseries', time_range + '&interval=hour'), 'start',
+          expected_totals(lambda value: value.strftime('%Y-%m-%dT%H:00:00')))
+    check(get('/v1/orders/reports/timeseries', time_range), 'start',
+          expected_totals(lambda value: value.strftime('%Y-%m-%dT00:00:00')))
+    check(get('/v1/orders/reports/timeseries', time_range + '&interval=week'), 'start',
+          expected_totals(lambda value: '2017-03-06T00:00:00'))
+
+    slots = get('/v1/orders/reports/timeseries/slots', time_range)
+    assert [row['slot'] for row in slots] == [9, 18]
+    check(slots, 'slot', expected_totals(lambda value: value.hour))
+
+    products = get('/v1/orders/reports/timeseries/products', time_range + '&interval=week')
+    expected_units = defaultdict(int)
+    for order in orders:
+        for op in order.products:
+            expected_units[op.product_id] += op.amount
+    assert {row['product_id']: row['units'] for row in products} == expected_units
+
+    # the writes are followed
+    orders[0].products[0].amount += 5
+    orders[0].save()
+    orders[2].delete()
+    orders = orders[:2]
+
+    check(get('/v1/orders/reports/timeseries', time_range), 'start',
+          expected_totals(lambda value: value.strftime('%Y-%m-%dT00:00:00')))
+
+    # as the price changes, the cached prices are reloaded
+    product = orders[0].products[0].product
+    product.value += 10
+    product.save()
+
+    check(get('/v1/orders/reports/timeseries', time_range), 'start',
+          expected_totals(lambda value: value.strftime('%Y-%m-%dT00:00:00')))
+
+    assert get('/v1/orders/reports/timeseries', 'from=2017-03-07&to=2017-03-08') == []
+
+    response = client.simulate_get('/v1/orders/reports/timeseries', headers=headers, query_string='interval=month')
+    assert response.status == falcon.HTTP_400
+    response = client.simulate_get('/v1/orders/reports/timeseries', headers=headers, query_string='from=yesterday')
+    assert response.status == falcon.HTTP_400
+
+
+def test_orders_reports_filters(db_session, client, admin):
+    from collections import Counter
+    from datetime import datetime
+
+    orders = [util.create_random_order(amount_of_products=2) for idx in range(2)]
+    for order, created in zip(orders, (datetime(2015, 2, 1, 10), datetime(2015, 2, 2, 10))):
+        order.created = created
+        order.save()
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+
+    def get_report(report, query):
+        response = client.simulate_get('/v1/orders/reports/' + report, headers=headers, query_string=query)
+        assert response.status == falcon.HTTP_200
+        return json.loads(response.content).get('data')
+
+    # no ids are sent, the orders are selected by the filters
+    report = get_report('products', 'from=2015-02-01&to=2015-02-02T00:00:00')
+    assert {row['product_id']: row['total'] for row in report} == \
+        {op.product_id: op.amount for op in orders[0].products}
+
+    product_id = orders[1].products[0].product_id
+    report = get_report('ingredients', 'from=2015-02-01&to=2015-02-03&client_id={}&product_id={}'.format(
+        orders[1].client_id, product_id))
+    expected = Counter()
+    for order in orders:
+        for op in order.products:
+            if order.client_id == orders[1].client_id and op.product_id == product_id:
+                for pi in op.product.ingredients:
+                    expected[pi.ingredient_id] += pi.amount * op.amount
+    assert {row['ingredient_id'] for row in report} == set(expected)
+    for row in report:
+        assert abs(row['total'] - expected[row['ingredient_id']]) < 1e-6
+
+    response = client.simulate_get('/v1/orders/reports/products', headers=headers, query_string='client_id=abc')
+    assert response.status == falcon.HTTP_400
+
+
+def test_bulk_resources__on_post(db_session, client, admin):
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+
+    def post(resource, items):
+        return client.simulate_post('/v1/{}/bulk'.format(resource), headers=headers, body=json.dumps(items))
+
+    # ingredients, the invalid items are reported in place
+    items = [util.get_random_ingredient_data() for idx in range(5)]
+    response = post('ingredients', items[:2] + [dict(name='no unit')] + items[2:])
+    assert response.status == falcon.HTTP_207
+
+    body = json.loads(response.content)
+    assert body.get('created') == 5
+    assert body.get('rejected') == 1
+    results = body.get('data')
+    assert [result.get('errors')[0].get('field') for result in results if 'errors' in result] == ['unit']
+
+    ingredients = [result['data'] for result in results if 'data' in result]
+    assert [ingredient['name'] for ingredient in ingredients] == [item['name'] for item in items]
+    assert len({ingredient['code'] for ingredient in ingredients}) == 5
+    for ingredient in ingredients:
+        assert Ingredient.get_by_code(ingredient['code']).id == ingredient['id']
+
+    # products, referencing the new ingredients
+    response = post('products', [
+        dict(name='product {}'.format(idx), value=10.0 + idx, discount=0.0,
+             ingredients=[dict(ingredient_id=ingredients[idx]['id'], amount=2.0)])
+        for idx in range(3)
+    ] + [dict(name='unknown', value=1.0, ingredients=[dict(ingredient_id=10 ** 6, amount=1.0)])])
+    assert response.status == falcon.HTTP_207
+
+    results = json.loads(response.content).get('data')
+    assert results[3].get('errors')[0].get('code') == 'not-found'
+    products = [result['data'] for result in results[:3]]
+    assert [product['ingredients'][0]['ingredient']['id'] for product in products] == \
+        [ingredient['id'] for ingredient in ingredients[:3]]
+    assert Product.get_by_id(products[0]['id']).ingredients[0].amount == 2.0
+
+    # orders, the rollups are written in the same transaction
+    client_id = util.get_random_client().id
+    response = post('orders', [
+        dict(client_id=client_id, products=[dict(product_id=product['id'], amount=3) for product in products])
+        for idx in range(2)
+    ])
+    assert response.status == falcon.HTTP_200
+
+    orders = [result['data'] for result in json.loads(response.content).get('data')]
+    assert [order['client']['id'] for order in orders] == [client_id, client_id]
+    assert 'password' not in orders[0]['client']
+
+    report = {ingredient.id: total for ingredient, total in Order.report_ingredients([orders[0]['id']])}
+    assert report == {ingredient['id']: 6.0 for ingredient in ingredients[:3]}
+
+    # nothing valid, nothing created
+    response = post('orders', [dict(client_id=client_id, products=[dict(product_id=10 ** 6, amount=1)])])
+    assert response.status == falcon.HTTP_400
+
+    response = client.simulate_post('/v1/orders/bulk', headers=headers, body=json.dumps(dict(client_id=client_id)))
+    assert response.status == falcon.HTTP_400
+    response = post('ingredients', [util.get_random_ingredient_data()] * (ssms.app.BULK_MAX_SIZE + 1))
+    assert response.status == falcon.HTTP_413
+
+
+def test_import_resources(db_session, client, admin, monkeypatch):
+    from ssms.util import importer
+
+    monkeypatch.setattr(importer, 'IMPORT_CHUNK_SIZE', 3)
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+
+    # ingredients from NDJSON, the chunks are smaller than the file
+    lines = [json.dumps(util.get_random_ingredient_data()) for idx in range(7)]
+    lines[3] = '{"name": "no unit"}'
+    lines[5] = 'not json'
+    response = client.simulate_post(
+        '/v1/ingredients/import',
+        headers=dict(headers, **{'Content-Type': 'application/x-ndjson'}),
+        body='\n'.join(lines) + '\n',
+    )
+    assert response.status == falcon.HTTP_200
+
+    job = json.loads(response.content).get('data')
+    assert job.get('status') == 'done'
+    assert (job.get('processed'), job.get('inserted'), job.get('rejected')) == (7, 5, 2)
+    assert [error.get('row') for error in job.get('errors')] == [4, 6]
+
+    ingredients = Ingredient.get_all()[-5:]
+    assert [ingredient.name for ingredient in ingredients] == \
+        [json.loads(line)['name'] for idx, line in enumerate(lines) if idx not in (3, 5)]
+    assert all(ingredient.code for ingredient in ingredients)
+
+    # products from CSV, with their recipes
+    body = 'name,value,discount,ingredients\n' \
+           'Soup,10.5,,{0}:2.5;{1}:1\n' \
+           '"Pie, large",12,1,{0}:3\n' \
+           'Bad,abc,,\n' \
+           'Unknown,1,,{2}:1\n'.format(ingredients[0].id, ingredients[1].id, 10 ** 6)
+    response = client.simulate_post('/v1/products/import', headers=headers, query_string='format=csv', body=body)
+    assert response.status == falcon.HTTP_200
+
+    job = json.loads(response.content).get('data')
+    assert (job.get('processed'), job.get('inserted'), job.get('rejected')) == (4, 2, 2)
+    assert [error['errors'][0]['field'] for error in job.get('errors')] == ['value', 'ingredients']
+
+    pie = Product.get_by_id(Product.get_all()[-1].id)
+    assert (pie.name, pie.value, pie.discount) == ('Pie, large', 12.0, 1.0)
+    assert [(pi.ingredient_id, pi.amount) for pi in pie.ingredients] == [(ingredients[0].id, 3.0)]
+
+    # the progress resource
+    response = client.simulate_get('/v1/imports/{}'.format(job['id']), headers=headers)
+    assert response.status == falcon.HTTP_200
+    assert json.loads(response.content).get('data') == job
+
+    response = client.simulate_get('/v1/imports', headers=headers)
+    assert [data['id'] for data in json.loads(response.content).get('data')][-1] == job['id']
+
+    response = client.simulate_post('/v1/products/import', headers=headers, body=body)
+    assert response.status == falcon.HTTP_400
+
+
+def test_orders_export_resource__on_get(db_session, client, admin, monkeypatch):
+    import csv
+    import gzip
+    import io
+    from datetime import datetime
+
+    from ssms.util import export
+
+    # fetched a few rows at a time, so the orders span several batches
+    monkeypatch.setattr(export, 'EXPORT_BATCH_SIZE', 2)
+
+    orders = [util.create_random_order(amount_of_products=3) for idx in range(3)]
+    for idx, order in enumerate(orders):
+        order.created = datetime(2014, 3, 1 + idx, 10)
+        order.save()
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    query = 'from=2014-03-01&to=2014-03-04'
+
+    response = client.simulate_get('/v1/orders/export', headers=headers, query_string=query)
+    assert response.status == falcon.HTTP_200
+    assert response.headers['content-type'].startswith('text/csv')
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(int(row['order_id']), int(row['product_id'])) for row in rows] == \
+        [(order.id, op.product_id) for order in orders for op in sorted(order.products, key=lambda op: op.product_id)]
+
+    for order in orders:
+        lines = [row for row in rows if int(row['order_id']) == order.id]
+        total = sum(op.amount * (op.product.value - (op.product.discount or 0)) for op in order.products)
+        assert all(abs(float(row['order_total']) - total) < 1e-6 for row in lines)
+        assert abs(sum(float(row['line_total']) for row in lines) - total) < 1e-6
+        assert lines[0]['order_code'] == order.code
+        assert lines[0]['client_email'] == order.client.email
+
+    # gzip compressed ndjson, filtered by client
+    response = client.simulate_get('/v1/orders/export', query_string=query + '&format=ndjson&client_id={}'.format(
+        orders[0].client_id), headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+    assert response.status == falcon.HTTP_200
+    assert response.headers['content-encoding'] == 'gzip'
+
+    lines = [json.loads(line) for line in gzip.decompress(response.content).decode().splitlines()]
+    assert {line['order_id'] for line in lines} == \
+        {order.id for order in orders if order.client_id == orders[0].client_id}
+    assert set(lines[0]) == set(export.COLUMNS)
+
+    response = client.simulate_get('/v1/orders/export', headers=headers, query_string='format=xml')
+    assert response.status == falcon.HTTP_400
+
+
+def test_code_resources__on_get(db_session, client, admin):
+    from ssms.util import code_cache, friendly_code
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+
+    def get(path, query=None):
+        return client.simulate_get('/v1/' + path, headers=headers, query_string=query)
+
+    order = util.create_random_order(amount_of_products=2)
+    product = order.products[0].product
+    ingredient = product.ingredients[0].ingredient
+    items = [('orders', order), ('products', product), ('ingredients', ingredient), ('clients', order.client)]
+
+    for resource, item in items:
+        response = get('{}/code/{}'.format(resource, item.code))
+        assert response.status == falcon.HTTP_200
+        data = json.loads(response.content).get('data')
+        assert (data['id'], data['code']) == (item.id, item.code)
+
+    assert 'password' not in json.loads(get('clients/code/' + order.client.code).content)['data']
+    assert get('orders/code/' + friendly_code.encode(10 ** 9)).status == falcon.HTTP_404
+    assert get('ingredients/code/unknown').status == falcon.HTTP_404
+
+    # the second lookup is served from the cache
+    hits = code_cache.caches['ingredients'].hits
+    assert get('ingredients/code/' + ingredient.code).status == falcon.HTTP_200
+    assert code_cache.caches['ingredients'].hits == hits + 1
+
+    # several codes, in order, the unknown ones are reported apart
+    other = util.create_random_ingredient()
+    response = get('ingredients/code', 'codes={},UNKNOWN,{},{}'.format(other.code, ingredient.code, other.code))
+    assert response.status == falcon.HTTP_200
+    body = json.loads(response.content)
+    assert [data['id'] for data in body['data']] == [other.id, ingredient.id]
+    assert body['missing'] == ['UNKNOWN']
+
+    assert get('ingredients/code').status == falcon.HTTP_400
+
+    # a write drops the cached items depending on it
+    response = client.simulate_put('/v1/ingredients/{}'.format(ingredient.id), headers=headers,
+                                   body=json.dumps(dict(name='renamed')))
+    assert response.status == falcon.HTTP_200
+
+    assert json.loads(get('ingredients/code/' + ingredient.code).content)['data']['name'] == 'renamed'
+    response = get('products/code/' + product.code)
+    assert 'renamed' in [pi['ingredient']['name'] for pi in json.loads(response.content)['data']['ingredients']]
+
+
+def test_metrics_resource__on_get(db_session, client, admin):
+    from prometheus_client import REGISTRY
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    labels = dict(method='GET', route='/v1/orders')
+
+    def sample(name, **extra):
+        return REGISTRY.get_sample_value(name, dict(labels, **extra)) or 0
+
+    for idx in range(3):
+        util.create_random_order()
+
+    requests = sample('ssms_requests_total', status='200')
+    queries = sample('ssms_request_queries_sum')
+
+    response = client.simulate_get('/v1/orders', headers=headers)
+    assert response.status == falcon.HTTP_200
+
+    assert sample('ssms_requests_total', status='200') == requests + 1
+    assert sample('ssms_request_queries_sum') > queries
+    assert sample('ssms_response_bytes_sum') >= len(response.content)
+    assert sample('ssms_request_serialization_seconds_count') == sample('ssms_request_duration_seconds_count')
+
+    # the streamed responses are recorded once sent
+    size = sample('ssms_response_bytes_sum')
+    response = client.simulate_get('/v1/orders', headers=headers, query_string='stream=ndjson')
+    assert sample('ssms_response_bytes_sum') == size + len(response.content)
+
+    assert client.simulate_get('/v1/metrics').status == falcon.HTTP_403
+
+    response = client.simulate_get('/v1/metrics', headers=headers)
+    assert response.status == falcon.HTTP_200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'ssms_request_duration_seconds_bucket{le="0.005",method="GET",route="/v1/orders"}' in response.text
+    assert 'ssms_cache_entries{cache="auth_users"}' in response.text
+
+
+def _iter_routes(nodes):
+    for node in nodes:
+        if node.resource is not None:
+            yield node.uri_template, node.resource
+        yield from _iter_routes(node.children)
+
+
+def test_query_budgets(db_session, client, admin, monkeypatch):
+    from ssms import database
+    from ssms.resources.orders import OrderListResource
+    from ssms.util import query_budget
+
+    # every responder of every route has a budget, or explicitly none
+    for uri_template, resource in _iter_routes(client.app._router._roots):
+        for method in ('GET', 'POST', 'PUT', 'DELETE'):
+            if hasattr(resource, 'on_' + method.lower()):
+                budget = getattr(resource, 'query_budget', 0)
+                assert budget is None or query_budget.get_budget(resource, method), (method, uri_template)
+
+    assert query_budget.normalize("SELECT a FROM b\n WHERE c IN (?, ?, ?) AND d = 'x' LIMIT 10") == \
+        'SELECT a FROM b WHERE c IN (...) AND d = ? LIMIT ?'
+
+    if query_budget.QUERY_BUDGET_MODE != 'raise':
+        return
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    util.create_random_order()
+    assert client.simulate_get('/v1/orders', headers=headers).status == falcon.HTTP_200
+
+    # a route over its budget fails
+    monkeypatch.setattr(OrderListResource, 'query_budget', dict(GET=1))
+    response = client.simulate_get('/v1/orders', headers=headers)
+    assert response.status == falcon.HTTP_500
+    assert json.loads(response.content)['title'] == 'Query budget exceeded'
+
+    # so does a statement run once per row
+    monkeypatch.setattr(OrderListResource, 'query_budget', dict(GET=100))
+    monkeypatch.setattr(OrderListResource, 'eager_load', ())
+    for idx in range(query_budget.QUERY_REPEAT_LIMIT):
+        util.create_random_order()
+    database.session().expire_all()
+    response = client.simulate_get('/v1/orders', headers=headers)
+    assert response.status == falcon.HTTP_500
+    assert 'repeated' in json.loads(response.content)['description']
+
+
+def test_slow_queries(db_session, client, admin, tmpdir):
+    from ssms.util import slow_queries
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    path = str(tmpdir.join('slow_queries.log'))
+
+    # every statement is slow
+    slow_queries.enable(threshold=0, path=path)
+    try:
+        user_data = util.get_random_user_data()
+        response = client.simulate_post('/v1/clients', headers=headers, body=json.dumps(user_data))
+        assert response.status == falcon.HTTP_200
+
+        response = client.simulate_get('/v1/orders/reports/ingredients', headers=headers)
+        assert response.status == falcon.HTTP_200
+    finally:
+        slow_queries.disable()
+
+    with open(path) as log:
+        entries = log.read()
+
+    # the secrets are redacted, the plan and the callers are logged
+    assert 'INSERT INTO user' in entries
+    assert "'password': '<redacted>'" in entries and "'seed': '<redacted>'" in entries
+    assert user_data['password'] not in entries
+    assert 'caller: ssms/resources/orders.py' in entries
+    assert 'plan: ' in entries and 'SCAN' in entries
+
+    # nothing is logged once disabled
+    size = os.path.getsize(path)
+    client.simulate_get('/v1/orders', headers=headers)
+    assert os.path.getsize(path) == size
+
+
+def test_profile_resources(db_session, admin, user_client, tmpdir, monkeypatch):
+    import marshal
+    from falcon import testing
+    from ssms.util import profiling
+    from ssms.util.storage import SimpleBaseStore
+
+    monkeypatch.setattr(ssms.app, 'PROFILING', True)
+    monkeypatch.setattr(profiling, '_store', SimpleBaseStore(str(tmpdir)))
+    client = testing.TestClient(ssms.app.create_app())
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    profile_headers = dict(headers, **{profiling.REQUEST_HEADER: '1'})
+
+    # only the admins asking for it are profiled
+    assert profiling.RESPONSE_HEADER.lower() not in client.simulate_get('/v1/orders', headers=headers).headers
+    response = client.simulate_get('/v1/users', headers={
+        'Authorization': 'Basic {}'.format(user_client.basic_password), profiling.REQUEST_HEADER: '1'})
+    assert response.status == falcon.HTTP_200
+    assert profiling.RESPONSE_HEADER.lower() not in response.headers
+
+    response = client.simulate_get('/v1/orders', headers=profile_headers)
+    assert response.status == falcon.HTTP_200
+    name = response.headers[profiling.RESPONSE_HEADER.lower()]
+
+    response = client.simulate_get('/v1/profiles', headers=headers)
+    assert response.status == falcon.HTTP_200
+    assert [profile['name'] for profile in json.loads(response.content)['data']] == [name]
+
+    response = client.simulate_get('/v1/profiles/' + name, headers=headers)
+    assert response.status == falcon.HTTP_200
+    stats = marshal.loads(response.content)
+    assert any(function == 'on_get' and filename.endswith('orders.py') for filename, line, function in stats)
+
+    assert client.simulate_get('/v1/profiles/' + name).status == falcon.HTTP_403
+    assert client.simulate_get('/v1/profiles/unknown.prof', headers=headers).status == falcon.HTTP_404
+
+
+def test_profile_samples_resource(client, admin, user_client):
+    import threading
+    from ssms.util import sampler
+
+    headers = {'Authorization': 'Basic {}'.format(admin.basic_password)}
+    stack_sampler = sampler.get_sampler()
+    assert client.simulate_delete('/v1/profiles/samples', headers=headers).status == falcon.HTTP_204
+
+    # only the threads handling a request are sampled
+    stack_sampler.sample()
+    assert stack_sampler.stats()['samples'] == 0
+    sampler.active_threads.add(threading.get_ident())
+    try:
+        stack_sampler.sample()
+    finally:
+        sampler.active_threads.discard(threading.get_ident())
+
+    response = client.simulate_get('/v1/profiles/samples', headers=headers)
+    assert response.status == falcon.HTTP_200
+    assert response.headers['x-ssms-samples'] == '1'
+    stack, count = response.text.splitlines()[0].rsplit(' ', 1)
+    assert count == '1'
+    assert stack.endswith('test_app:test_profile_samples_resource;ssms.util.sampler:sample')
+
+    assert client.simulate_delete('/v1/profiles/samples', headers=headers).status == falcon.HTTP_204
+    assert client.simulate_get('/v1/profiles/samples', headers=headers).text == ''
+
+    # the table is bounded
+    stack_sampler.max_stacks = 0
+    sampler.active_threads.add(threading.get_ident())
+    try:
+        stack_sampler.sample()
+    finally:
+        sampler.active_threads.discard(threading.get_ident())
+        stack_sampler.max_stacks = ssms.app.SAMPLING_MAX_STACKS
+    assert stack_sampler.folded() == '{} 1\n'.format(sampler.OVERFLOW_STACK)
+    stack_sampler.reset()
+
+    response = client.simulate_get('/v1/profiles/samples',
+                                   headers={'Authorization': 'Basic {}'.format(user_client.basic_password)})
+    assert response.status == falcon.HTTP_403
@@ -1,6 +1,16 @@
 from collections import Counter
 
+import threading
+
+import pytest
+
+from sqlalchemy import inspect
+
+import ssms.app
+from ssms import database
 from ssms.models import Product, Ingredient, Admin, UsersEnum, Client, Order, ProductIngredient
+from ssms.schemas import ClientSchema, OrderProductsReportSchema, OrderSchema
+from ssms.schemas.compiler import compile_schema
 
 from tests import util, conftest
 
@@ -278,3 +288,443 @@ def test_order_ingredients_report(db_session, conf_logger):
         test_data = test_report[ingredient.id]
         assert test_data.get('total') == total
         assert test_data.get('ingredient') == ingredient
+
+
+def test_request_scoped_session(db_session, conf_logger):
+    """
+    A request handled by a thread with no open session gets its own session, which is closed when the request ends.
+    A request issued from a thread that already holds a session joins it.
+    """
+    thread_session = database.session()
+
+    database.begin_request()
+    assert database.session() is thread_session
+    database.end_request()
+
+    assert database.session() is thread_session
+
+    results = {}
+
+    def handle_request():
+        database.begin_request()
+        request_session = database.session()
+        ingredient = Ingredient(**util.get_random_ingredient_data())
+        request_session.add(ingredient)
+        results['in_session'] = ingredient in request_session
+        database.end_request(commit=False)
+        results['closed'] = ingredient not in request_session
+        results['session'] = request_session
+        results['thread_session'] = database.session()
+
+    worker = threading.Thread(target=handle_request)
+    worker.start()
+    worker.join()
+
+    assert results['session'] is not thread_session
+    assert results['session'] is not results['thread_session']
+    assert results['in_session']
+    assert results['closed']
+
+
+def test_relationships_are_lazy(db_session, conf_logger):
+    """
+    Loading a user or an order must not load its relationships unless the caller asks for them.
+    """
+    order = util.create_random_order(amount_of_products=2)
+    client_email = order.client.email
+
+    database.remove()
+
+    client = Client.get_by_email(client_email)
+
+    assert 'orders' in inspect(client).unloaded
+
+    order = Order.get_by_id(order.id)
+
+    assert 'products' in inspect(order).unloaded
+    assert 'client' in inspect(order).unloaded
+
+
+def test_compiled_schemas(db_session, conf_logger):
+    """
+    The compiled serializers must dump exactly what the marshmallow schemas dump.
+    """
+    for idx in range(3):
+        util.create_random_order(amount_of_products=2)
+
+    orders = Order.get_all()
+
+    for context in ({}, dict(remove_fields=['seed', 'password'])):
+        for schema_class, objs in ((OrderSchema, orders), (ClientSchema, Client.get_all())):
+            serializer = compile_schema(schema_class)
+
+            assert serializer.dump(objs, many=True, context=dict(context)) == \
+                schema_class(context=dict(context)).dump(objs, many=True).data
+            assert serializer.dump(objs[0], context=dict(context)) == \
+                schema_class(context=dict(context)).dump(objs[0]).data
+
+    report = [
+        dict(product_id=product.id, product=product, total=float(total))
+        for product, total in Order.report_products([order.id for order in orders])
+    ]
+    serializer = compile_schema(OrderProductsReportSchema)
+
+    assert serializer.dump(report, many=True) == OrderProductsReportSchema().dump(report, many=True).data
+
+
+def test_migrate_users(db_session, conf_logger):
+    """
+    The admins and clients of the legacy tables are moved into the user table.
+    """
+    import ssms.app
+    from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+    from scripts.migrate_users import migrate
+
+    metadata = MetaData()
+    legacy_tables = [
+        Table(name, metadata,
+              Column('id', Integer, primary_key=True),
+              Column('email', String(128)),
+              Column('first_name', String(128)),
+              Column('last_name', String(128)),
+              Column('password', String(256)),
+              Column('seed', String(128)),
+              Column('user_type', String(16)),
+              Column('code', String(256)),
+              Column('created', DateTime),
+              Column('updated', DateTime))
+        for name in ('admin', 'client')
+    ]
+
+    # the same id in both tables, as the legacy sqlite tables had
+    user_id = 100000
+    admin_data = util.get_random_user_data()
+    client_data = util.get_random_user_data()
+
+    database.session().commit()
+    metadata.create_all(ssms.app.engine)
+    with ssms.app.engine.begin() as connection:
+        connection.execute(legacy_tables[0].insert(), dict(id=user_id, code='LEGACYADMIN', **admin_data))
+        connection.execute(legacy_tables[1].insert(), dict(id=user_id, code='LEGACYCLIENT', **client_data))
+
+    assert migrate(ssms.app.engine) == 2
+    assert migrate(ssms.app.engine) == 0
+
+    client = Client.get_by_id(user_id)
+    admin = Admin.get_by_email(admin_data.get('email'))
+
+    assert client.email == client_data.get('email')
+    assert client.user_type == UsersEnum.client
+    assert admin.id != user_id
+    assert admin.user_type == UsersEnum.admin
+    assert admin.code == 'LEGACYADMIN'
+    assert Admin.get_by_id(user_id) is None
+
+
+def test_order_ingredients_rollup(db_session, conf_logger):
+    """
+    The materialised ingredients demand follows the writes to the orders and to the recipes.
+    """
+    from ssms.models import OrderIngredient
+
+    def demand(order):
+        totals = Counter()
+        for op in order.products:
+            for pi in op.product.ingredients:
+                totals[pi.ingredient_id] += pi.amount * op.amount
+        return totals
+
+    def rollup(order):
+        return {row.ingredient_id: row.total for row in db_session.query(OrderIngredient)
+                .filter(OrderIngredient.order_id == order.id)}
+
+    order = util.create_random_order(amount_of_products=2)
+
+    assert rollup(order) == demand(order)
+
+    # recipe change
+    product = order.products[0].product
+    product.ingredients[0].amount += 10
+    product.save()
+
+    assert rollup(order) == demand(order)
+
+    # order change
+    order.products[0].amount += 1
+    order.save()
+
+    assert rollup(order) == demand(order)
+
+    # drift is fixed by a rebuild
+    db_session.execute(OrderIngredient.__table__.delete())
+    db_session.commit()
+    OrderIngredient.rebuild()
+
+    assert rollup(order) == demand(order)
+
+    order.delete()
+
+    assert rollup(order) == {}
+
+
+def test_bill_of_materials(db_session, conf_logger):
+    """
+    The NumPy engine returns the SQL reports and follows the recipe changes.
+    """
+    pytest.importorskip('numpy')
+
+    from ssms.util import bom
+
+    def same(expected, actual):
+        assert [ingredient.id for ingredient, total in expected] == [ingredient.id for ingredient, total in actual]
+        for (_, expected_total), (_, actual_total) in zip(expected, actual):
+            assert abs(expected_total - actual_total) < 1e-6
+
+    engine = bom.engine
+
+    orders = [util.create_random_order(amount_of_products=2) for idx in range(3)]
+    orders_ids = [order.id for order in orders]
+    products_ids = list({op.product_id for order in orders for op in order.products})
+
+    same(Order.report_ingredients(orders_ids), engine.report_orders_ingredients(orders_ids))
+    same(Product.report_ingredients(products_ids), engine.report_products_ingredients(products_ids))
+
+    # recipe change, written by this process
+    matrix = engine.get_matrix()
+    demand = [(product_id, 1) for product_id in products_ids]
+    requirements = matrix.requirements(demand)
+    product = orders[0].products[0].product
+    product.ingredients[0].amount += 10
+    product.save()
+
+    same(Order.report_ingredients(orders_ids), engine.report_orders_ingredients(orders_ids))
+    # the refresh swaps in a new matrix, the one in use is left as is
+    assert engine.get_matrix() is not matrix
+    assert matrix.requirements(demand) == requirements
+    assert engine.get_matrix().requirements(demand) != requirements
+
+    assert engine.report_orders_ingredients([]) == []
+
+
+def test_order_reports_filters(db_session, conf_logger):
+    """
+    The reports filters select the orders by creation time and client, and the lines by product, in SQL.
+    """
+    from datetime import datetime
+
+    from scripts.create_indexes import create_indexes
+
+    orders = [util.create_random_order(amount_of_products=2) for idx in range(3)]
+    for order, created in zip(orders, (datetime(2016, 5, 1), datetime(2016, 5, 2), datetime(2016, 5, 3))):
+        order.created = created
+        order.save()
+
+    def expected(orders, products_ids=None):
+        products, ingredients = Counter(), Counter()
+        for order in orders:
+            for op in order.products:
+                if products_ids is None or op.product_id in products_ids:
+                    products[op.product_id] += op.amount
+                    for pi in op.product.ingredients:
+                        ingredients[pi.ingredient_id] += pi.amount * op.amount
+        return products, ingredients
+
+    def check(expected, orders_ids=None, **filters):
+        products, ingredients = expected
+        assert {product.id: total for product, total in
+                Order.report_products(orders_ids, **filters)} == products
+        report = {ingredient.id: total for ingredient, total in Order.report_ingredients(orders_ids, **filters)}
+        assert report.keys() == ingredients.keys()
+        for ingredient_id, total in report.items():
+            assert abs(total - ingredients[ingredient_id]) < 1e-6
+
+    check(expected(orders[:2]), start=datetime(2016, 5, 1), end=datetime(2016, 5, 3))
+    check(expected(orders[1:]), start=datetime(2016, 5, 2), end=datetime(2016, 6, 1),
+          orders_ids=[order.id for order in orders] + [orders[0].id])
+    check(expected([order for order in orders if order.client_id == orders[2].client_id]),
+          start=datetime(2016, 5, 1), end=datetime(2016, 6, 1), clients_ids=[orders[2].client_id])
+
+    products_ids = {orders[0].products[0].product_id, orders[2].products[1].product_id}
+    check(expected(orders, products_ids), start=datetime(2016, 5, 1), end=datetime(2016, 5, 4),
+          products_ids=list(products_ids))
+
+    check((Counter(), Counter()), orders_ids=[], start=datetime(2016, 5, 1))
+
+    # the time range is served by the order index
+    query = Order.report_products(None, subquery=True, start=datetime(2016, 5, 1), end=datetime(2016, 5, 3))
+    compiled = query.element.compile(dialect=ssms.app.engine.dialect)
+    cursor = db_session.connection().connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN {}'.format(compiled),
+                   [compiled.params[name] for name in compiled.positiontup])
+    plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+    assert 'ix_order_created_id' in plan
+
+    # the indexes are added to the existing tables
+    db_session.execute('DROP INDEX ix_orderproduct_order_id_product_id')
+    db_session.commit()
+    assert create_indexes(ssms.app.engine) == ['ix_orderproduct_order_id_product_id']
+    assert create_indexes(ssms.app.engine) == []
+
+
+def test_save_single_commit(db_session, conf_logger):
+    """
+    A save commits once, a new item gets its code in the same transaction and an
+    update only writes the changed columns.
+    """
+    from sqlalchemy import event
+
+    statements, commits = [], []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def commit(conn):
+        commits.append(conn)
+
+    event.listen(ssms.app.engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(ssms.app.engine, 'commit', commit)
+    try:
+        ingredient = Ingredient(**util.get_random_ingredient_data())
+        ingredient.save()
+
+        assert len(commits) == 1
+        writes = [statement.split()[:2] for statement in statements if not statement.startswith('SELECT')]
+        # the data version is bumped once, along with the insert
+        assert writes == [['INSERT', 'INTO'], ['UPDATE', 'dataversion'], ['UPDATE', 'ingredient']]
+        assert ingredient.code
+        created, updated = ingredient.created, ingredient.updated
+
+        del statements[:], commits[:]
+        ingredient.name = ingredient.name + ' changed'
+        ingredient.save()
+
+        assert len(commits) == 1
+        update = [statement for statement in statements if statement.startswith('UPDATE ingredient')]
+        assert len(update) == 1
+        assert 'name=' in update[0] and 'unit=' not in update[0] and 'code=' not in update[0]
+        assert ingredient.created == created and ingredient.updated > updated
+
+        # nothing changed, nothing is written
+        del statements[:], commits[:]
+        updated = ingredient.updated
+        ingredient.save()
+
+        assert not [statement for statement in statements if not statement.startswith('SELECT')]
+        assert ingredient.updated == updated
+    finally:
+        event.remove(ssms.app.engine, 'before_cursor_execute', before_cursor_execute)
+        event.remove(ssms.app.engine, 'commit', commit)
+
+    assert Ingredient.get_by_code(ingredient.code).name == ingredient.name
+
+
+def test_data_versions_pending(db_session, conf_logger):
+    """
+    What a transaction reads between two flushes isn't cached under the versions it bumped.
+    """
+    from ssms.models import DataVersion, OrderProduct
+    from ssms.util import report_cache
+
+    order = util.create_random_order(amount_of_products=1)
+    op = order.products[0]
+    pi = op.product.ingredients[0]
+
+    def report():
+        return dict(report_cache.get_report(
+            'test/ingredients', [order.id], [Order, OrderProduct, ProductIngredient],
+            lambda ids: [(ingredient.id, total) for ingredient, total in Order.report_ingredients(ids)]))
+
+    def expected():
+        return sum(op.amount * recipe.amount for recipe in op.product.ingredients
+                   if recipe.ingredient_id == pi.ingredient_id)
+
+    pi.amount += 1
+    database.session().flush()
+    assert DataVersion.is_pending([ProductIngredient]) and not DataVersion.is_pending([Ingredient])
+    assert abs(report()[pi.ingredient_id] - expected()) < 1e-6
+
+    # the second flush doesn't bump the version again
+    pi.amount += 1
+    database.session().flush()
+    database.session().commit()
+
+    assert not DataVersion.is_pending([ProductIngredient])
+    assert abs(report()[pi.ingredient_id] - expected()) < 1e-6
+
+
+def test_friendly_code_properties(db_session, conf_logger):
+    """
+    The codes are a bijection of the ids, decoding any string never fails.
+    """
+    pytest.importorskip('hypothesis')
+    from hypothesis import given, strategies as st
+
+    from ssms.util import friendly_code
+
+    ids = st.integers(min_value=0, max_value=friendly_code.SIZE - 1)
+
+    @given(ids)
+    def round_trip(num):
+        code = friendly_code.encode(num)
+        assert len(code) == friendly_code.STRING_LENGTH
+        assert set(code) <= set(friendly_code.VALID_CHARS)
+        assert friendly_code.decode(code) == num
+        assert friendly_code.encode(num) == code
+
+    @given(ids, ids)
+    def unique(num, other):
+        assert (friendly_code.encode(num) == friendly_code.encode(other)) == (num == other)
+
+    @given(st.text(alphabet=friendly_code.VALID_CHARS + 'abz0', max_size=12))
+    def decode_any(code):
+        num = friendly_code.decode(code)
+        assert num is None or friendly_code.encode(num) == code
+
+    @given(st.lists(ids, max_size=50))
+    def batches(nums):
+        codes = friendly_code.encode_many(nums)
+        assert codes == [friendly_code.encode(num) for num in nums]
+        assert friendly_code.decode_many(codes) == nums
+
+    round_trip()
+    unique()
+    decode_any()
+    batches()
+
+    assert friendly_code.encode(-1) is None
+    assert friendly_code.encode(friendly_code.SIZE) is None
+    assert friendly_code.decode(None) is None
+
+
+def test_get_by_code(db_session, conf_logger):
+    """
+    The codes are looked up by the id they decode to, the ones of the previous encoder by value.
+    """
+    from sqlalchemy import event
+
+    from ssms.util import friendly_code
+
+    ingredient = util.create_random_ingredient()
+    assert friendly_code.decode(ingredient.code) == ingredient.id
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    database.session().expunge_all()
+    event.listen(ssms.app.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        assert Ingredient.get_by_code(ingredient.code).id == ingredient.id
+    finally:
+        event.remove(ssms.app.engine, 'before_cursor_execute', before_cursor_execute)
+    assert len(statements) == 1 and 'WHERE ingredient.id = ?' in statements[0]
+
+    # a code of the previous encoder, they all start with one of the first 19 characters
+    legacy = Ingredient.get_by_id(ingredient.id)
+    legacy.code = '3' + ingredient.code[1:]
+    legacy.save()
+
+    assert Ingredient.get_by_code(legacy.code).id == ingredient.id
+    assert Ingredient.get_by_code(ingredient.code) is None
+    assert Ingredient.get_by_code('not a code') is None